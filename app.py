@@ -1,31 +1,125 @@
 #!/usr/bin/env python3
+import json
+
 from aws_cdk import App, Aspects
 from cdk_nag import AwsSolutionsChecks
 
-from src.amplify_add_on_stack import CustomAmplifyDistributionStack
-from src.web_acl_stack import CustomWebAclStack
+from src.amplify_add_on_stack import CustomAmplifyDistributionStack, branch_batches
+from src.amplify_automation_stack import CustomAmplifyAutomationStack
+from src.amplify_credentials_stack import CustomAmplifyCredentialsStack
+from src.web_acl_stack import WEB_ACL_REGION, CustomWebAclStack
 
 app = App()
 
+# Amplify app branches protected by the custom distribution stack, either listed
+# in the file named by the branches_config context value or a single branch
+branches_config = app.node.try_get_context("branches_config")
+if branches_config:
+    with open(branches_config) as f:
+        branches = json.load(f)
+else:
+    branches = [
+        {
+            "app_id": app.node.try_get_context("app_id"),
+            "branch_name": app.node.try_get_context("branch_name"),
+        }
+    ]
+
+web_acl_stack_name = "CustomWebAclStack"
 CustomWebAclStack(
     app,
-    "CustomWebAclStack",
+    web_acl_stack_name,
     description="This stack creates WebACL to be attached to a CloudFront distribution \
         for a Web App hosted with Amplify",
-    env={"region": "us-east-1"},
-)
-CustomAmplifyDistributionStack(
-    app,
-    "CustomAmplifyDistributionStack",
-    description="This stack creates a custom CloudFront distribution pointing to \
-        Amplify app's default CloudFront distribution. \
-        It also enables Basic Auth protection on specified branch. \
-        Creates event based setup for invalidating custom CloudFront distribution when \
-        a new version of Amplify App is deployed.",
-    web_acl_arn=app.node.try_get_context("web_acl_arn"),
-    app_id=app.node.try_get_context("app_id"),
-    branch_name=app.node.try_get_context("branch_name"),
+    env={"region": WEB_ACL_REGION},
+    managed_rule_groups=app.node.try_get_context("waf_managed_rule_groups"),
+    rate_limits=app.node.try_get_context("waf_rate_limits"),
+    block_list_ip_set_shards=app.node.try_get_context("waf_block_list_ip_set_shards"),
+    log_destination=app.node.try_get_context("waf_log_destination"),
+    log_filter=app.node.try_get_context("waf_log_filter"),
+    log_redacted_fields=app.node.try_get_context("waf_log_redacted_fields"),
+    cache_warmer=app.node.try_get_context("cache_warmer") is not None,
 )
+# CloudFormation limits the number of resources in a stack, branches beyond the
+# capacity of one group of stacks are protected by additional groups. Each group
+# is split in layers deployed in order, which only reference each other through
+# SSM parameters so that each layer deploys without touching the others.
+for index, stack_branches in enumerate(branch_batches(branches)):
+    # Additional stacks are numbered from 2
+    suffix = index + 1 if index else ""
+    credentials_stack_name = f"CustomAmplifyCredentialsStack{suffix}"
+    distribution_stack_name = f"CustomAmplifyDistributionStack{suffix}"
+
+    credentials_stack = CustomAmplifyCredentialsStack(
+        app,
+        credentials_stack_name,
+        description="This stack creates the Basic Auth credentials of the Amplify app branches \
+            protected by the custom CloudFront distributions and enables Basic Auth on them.",
+        branches=stack_branches,
+        distribution_stack_name=distribution_stack_name,
+        combined_credentials_secret=app.node.try_get_context(
+            "combined_credentials_secret"
+        ),
+        credentials_rotation_days=app.node.try_get_context("credentials_rotation_days"),
+    )
+
+    distribution_stack = CustomAmplifyDistributionStack(
+        app,
+        distribution_stack_name,
+        description="This stack creates a custom CloudFront distribution pointing to \
+            Amplify app's default CloudFront distribution for each protected branch.",
+        web_acl_arn=app.node.try_get_context("web_acl_arn"),
+        branches=stack_branches,
+        credentials_stack_name=credentials_stack_name,
+        cache_behaviors=app.node.try_get_context("cache_behaviors"),
+        default_cache_tier=app.node.try_get_context("default_cache_tier"),
+        origin_shield_region=app.node.try_get_context("origin_shield_region"),
+        origin_connection_attempts=app.node.try_get_context(
+            "origin_connection_attempts"
+        ),
+        origin_connection_timeout=app.node.try_get_context("origin_connection_timeout"),
+        origin_keepalive_timeout=app.node.try_get_context("origin_keepalive_timeout"),
+        origin_read_timeout=app.node.try_get_context("origin_read_timeout"),
+        error_caching_ttls=app.node.try_get_context("error_caching_ttls"),
+        origin_fallback=app.node.try_get_context("origin_fallback"),
+        credentials_rotated=bool(app.node.try_get_context("credentials_rotation_days")),
+        cache_key_normalization=app.node.try_get_context("cache_key_normalization"),
+        cloudfront_additional_metrics=app.node.try_get_context(
+            "cloudfront_additional_metrics"
+        ),
+        price_class=app.node.try_get_context("price_class"),
+        access_logs=app.node.try_get_context("access_logs"),
+        staging_distribution=app.node.try_get_context("staging_distribution"),
+    )
+    distribution_stack.add_dependency(credentials_stack)
+
+    automation_stack = CustomAmplifyAutomationStack(
+        app,
+        f"CustomAmplifyAutomationStack{suffix}",
+        description="This stack creates event based setup for invalidating the custom \
+            CloudFront distributions when a new version of Amplify App is deployed, \
+            and their dashboard and alarms.",
+        branches=stack_branches,
+        distribution_stack_name=distribution_stack_name,
+        manifest_path=app.node.try_get_context("manifest_path"),
+        invalidation_batching_window=app.node.try_get_context(
+            "invalidation_batching_window"
+        ),
+        cache_warmer=app.node.try_get_context("cache_warmer"),
+        web_acl_stack_name=web_acl_stack_name,
+        cloudfront_additional_metrics=app.node.try_get_context(
+            "cloudfront_additional_metrics"
+        ),
+        cache_hit_ratio_alarm_threshold=app.node.try_get_context(
+            "cache_hit_ratio_alarm_threshold"
+        ),
+        origin_latency_alarm_threshold=app.node.try_get_context(
+            "origin_latency_alarm_threshold"
+        ),
+        staging_distributions=app.node.try_get_context("staging_distribution")
+        is not None,
+    )
+    automation_stack.add_dependency(distribution_stack)
 
 Aspects.of(app).add(AwsSolutionsChecks())
 app.synth()
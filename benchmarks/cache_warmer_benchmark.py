@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+"""Benchmark the cache warmer against a local HTTP server standing in for CloudFront.
+
+The server answers the first request for each path after a cache miss latency
+and the following ones after a hit latency, and fails a share of the requests
+with a 503. The warmer fetches the paths through it with several concurrency
+settings, then a second pass shows the latency visitors get once warmed.
+
+    python3 benchmarks/cache_warmer_benchmark.py --paths 200 --miss-ms 300 --error-rate 0.05
+"""
+
+import argparse
+import os
+import random
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "cache_warmer",
+    ),
+)
+from warmer import summarize, warm  # noqa: E402
+
+
+class EdgeStub(BaseHTTPRequestHandler):
+    """Cache stand-in, slow on the first request of a path and fast afterwards."""
+
+    cached = set()
+    lock = threading.Lock()
+    miss_seconds = 0.3
+    hit_seconds = 0.005
+    error_rate = 0.0
+    rng = random.Random(0)
+
+    def do_GET(self):
+        with self.lock:
+            failed = self.rng.random() < self.error_rate
+            hit = self.path in self.cached
+            if not failed:
+                self.cached.add(self.path)
+
+        time.sleep(self.hit_seconds if hit else self.miss_seconds)
+        body = b"x" * 20000
+        self.send_response(503 if failed else 200)
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header(
+            "X-Cache", "Hit from cloudfront" if hit else "Miss from cloudfront"
+        )
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--paths", type=int, default=200)
+    parser.add_argument("--miss-ms", type=float, default=300)
+    parser.add_argument("--hit-ms", type=float, default=5)
+    parser.add_argument("--error-rate", type=float, default=0.05)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 8, 16])
+    args = parser.parse_args()
+
+    EdgeStub.miss_seconds = args.miss_ms / 1000
+    EdgeStub.hit_seconds = args.hit_ms / 1000
+    EdgeStub.error_rate = args.error_rate
+    # The default backlog of 5 connections delays concurrent connections by 1s
+    ThreadingHTTPServer.request_queue_size = 128
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EdgeStub)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    print(
+        f"{'pass':<6} {'concurrency':>11} {'seconds':>8} {'urls':>5} {'failed':>6} "
+        f"{'retried':>7} {'p50 ms':>7} {'p99 ms':>7}"
+    )
+    for concurrency in args.concurrency:
+        # Every concurrency setting starts from an empty cache
+        EdgeStub.cached.clear()
+        paths = [f"/run-{concurrency}/page/{index}" for index in range(args.paths)]
+        for name in ("cold", "warm"):
+            started = time.perf_counter()
+            results = warm(base_url, paths, concurrency=concurrency, retries=2)
+            elapsed = time.perf_counter() - started
+            summary = summarize(results)
+            print(
+                f"{name:<6} {concurrency:>11} {elapsed:>8.2f} {summary['urls']:>5} "
+                f"{summary['failed']:>6} {summary['retried']:>7} "
+                f"{summary['p50_ms']:>7} {summary['p99_ms']:>7}"
+            )
+
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
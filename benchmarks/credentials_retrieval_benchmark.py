@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""Measure AWS calls and latency of the branch credentials custom resource function.
+
+The function runs locally, its Secrets Manager and Amplify calls are answered
+in memory after waiting for the given latency, standing in for the round trip.
+The Amplify branch starts without basic auth, so the first event applies the
+credentials and later ones find them unchanged.
+
+    python3 benchmarks/credentials_retrieval_benchmark.py --latency-ms 50
+"""
+
+import argparse
+import base64
+import contextlib
+import functools
+import importlib.util
+import io
+import json
+import os
+import sys
+import time
+
+from botocore.awsrequest import AWSResponse
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FUNCTION_PATH = os.path.join(
+    ROOT, "src", "functions", "password_retrieval", "lambda_function.py"
+)
+
+USERNAME_ARN = "arn:aws:secretsmanager:us-east-1:111111111111:secret:username-AbCdEf"
+PASSWORD_ARN = "arn:aws:secretsmanager:us-east-1:111111111111:secret:password-AbCdEf"
+CREDENTIALS_ARN = (
+    "arn:aws:secretsmanager:us-east-1:111111111111:secret:credentials-AbCdEf"
+)
+SECRET_VALUES = {
+    USERNAME_ARN: "benchmark",
+    PASSWORD_ARN: "correct-horse-battery-staple",
+    CREDENTIALS_ARN: json.dumps(
+        {"username": "benchmark", "password": "correct-horse-battery-staple"}
+    ),
+}
+BRANCH_PROPERTIES = {"AppId": "d1a2b3c4", "BranchName": "main"}
+SEPARATE_PROPERTIES = {
+    **BRANCH_PROPERTIES,
+    "UsernameSecretArn": USERNAME_ARN,
+    "PasswordSecretArn": PASSWORD_ARN,
+}
+COMBINED_PROPERTIES = {**BRANCH_PROPERTIES, "CredentialsSecretArn": CREDENTIALS_ARN}
+EXPECTED_CREDENTIALS = "benchmark:correct-horse-battery-staple"
+
+# The function imports the telemetry layer
+sys.path.insert(0, os.path.join(ROOT, "src", "layers", "telemetry", "python"))
+
+
+def load_function():
+    """Import a fresh copy of the function module, i.e. a cold container."""
+    os.environ.setdefault("AWS_DEFAULT_REGION", "us-east-1")
+    spec = importlib.util.spec_from_file_location("lambda_function", FUNCTION_PATH)
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def legacy_handler(module, event):
+    """Previous behavior, two sequential secret reads whatever the request type,
+    then the unconditional branch update of a second custom resource."""
+    properties = event["ResourceProperties"]
+    for secret_id in (properties["UsernameSecretArn"], properties["PasswordSecretArn"]):
+        module.service_client.get_secret_value(
+            SecretId=secret_id, VersionStage="AWSCURRENT"
+        )
+    if event["RequestType"] != "Delete":
+        module.amplify_client.update_branch(
+            appId=properties["AppId"],
+            branchName=properties["BranchName"],
+            enableBasicAuth=True,
+            basicAuthCredentials="",
+        )
+
+
+def run(module, events, latency_seconds, handler=None):
+    """Invoke the handler for each event and return (calls, seconds)."""
+    calls = []
+    responses = []
+    branch = {"enableBasicAuth": False}
+
+    def remember_params(params, context, **kwargs):
+        context["benchmark_params"] = params
+
+    def answer(model, context, **kwargs):
+        calls.append(model.name)
+        time.sleep(latency_seconds)
+        params = context["benchmark_params"]
+        if model.name == "GetSecretValue":
+            parsed = {
+                "ARN": params["SecretId"],
+                "SecretString": SECRET_VALUES[params["SecretId"]],
+            }
+        elif model.name == "UpdateBranch":
+            branch.update(
+                enableBasicAuth=True,
+                basicAuthCredentials=params["basicAuthCredentials"],
+            )
+            parsed = {"branch": dict(branch)}
+        else:
+            parsed = {"branch": dict(branch)}
+        return AWSResponse(None, 200, {}, None), parsed
+
+    # Registered first so that no request is sent
+    for client in (module.service_client, module.amplify_client):
+        client.meta.events.register("before-parameter-build.*.*", remember_params)
+        client.meta.events.register_first("before-call.*.*", answer)
+
+    def send_response(event, status, physical_resource_id, data=None, reason=None):
+        responses.append((status, data, reason))
+
+    # Responses are kept instead of being sent to CloudFormation
+    module.send_response = send_response
+
+    started = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for event in events:
+            if handler:
+                handler(event)
+            else:
+                module.lambda_handler(event, None)
+    elapsed = time.perf_counter() - started
+
+    for (status, data, reason), event in zip(responses, events):
+        if status != "SUCCESS":
+            raise AssertionError(f"Request failed: {reason}")
+        if event["RequestType"] != "Delete":
+            _check(data)
+    return len(calls), elapsed
+
+
+def _check(data):
+    decoded = base64.b64decode(data["EncodedSuffix"].split(" ", 1)[1]).decode("utf-8")
+    if decoded != EXPECTED_CREDENTIALS:
+        raise AssertionError(f"Unexpected credentials {decoded}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--latency-ms", type=float, default=50)
+    args = parser.parse_args()
+    latency = args.latency_ms / 1000
+
+    def event(request_type, properties):
+        return {
+            "RequestType": request_type,
+            "ResourceType": "Custom::AmplifyBranchCredentials",
+            "ResourceProperties": properties,
+            "ResponseURL": "https://cloudformation-custom-resource-response.invalid/",
+            "StackId": "benchmark",
+            "RequestId": "benchmark",
+            "LogicalResourceId": "rBranchCredentials",
+        }
+
+    scenarios = [
+        (
+            "legacy, create",
+            [event("Create", SEPARATE_PROPERTIES)],
+            legacy_handler,
+        ),
+        (
+            "legacy, delete",
+            [event("Delete", SEPARATE_PROPERTIES)],
+            legacy_handler,
+        ),
+        ("separate secrets, create", [event("Create", SEPARATE_PROPERTIES)], None),
+        ("separate secrets, delete", [event("Delete", SEPARATE_PROPERTIES)], None),
+        (
+            "separate secrets, create then update (warm)",
+            [
+                event("Create", SEPARATE_PROPERTIES),
+                event("Update", SEPARATE_PROPERTIES),
+            ],
+            None,
+        ),
+        ("combined secret, create", [event("Create", COMBINED_PROPERTIES)], None),
+        (
+            "combined secret, create then update (warm)",
+            [
+                event("Create", COMBINED_PROPERTIES),
+                event("Update", COMBINED_PROPERTIES),
+            ],
+            None,
+        ),
+    ]
+
+    print(f"{'scenario':<44} {'calls':>5} {'ms':>8}")
+    for name, events, handler in scenarios:
+        module = load_function()
+        if handler is not None:
+            handler = functools.partial(handler, module)
+        calls, seconds = run(module, events, latency, handler=handler)
+        print(f"{name:<44} {calls:>5} {seconds * 1000:>8.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,125 @@
+#!/usr/bin/env python3
+"""Report where the time of the last deployment of a stack went.
+
+Reads the CloudFormation events of the latest create or update of the stack
+and prints its duration, the slowest resources and the time spent in custom
+resources. Run it after a cold deploy and after a no-op update, e.g.
+
+    cdk deploy CustomAmplifyDistributionStack && \\
+        python3 benchmarks/deploy_time_report.py CustomAmplifyDistributionStack
+"""
+
+import argparse
+from collections import defaultdict
+
+import boto3
+
+STARTED = {"CREATE_IN_PROGRESS", "UPDATE_IN_PROGRESS", "DELETE_IN_PROGRESS"}
+FINISHED = {
+    "CREATE_COMPLETE",
+    "UPDATE_COMPLETE",
+    "DELETE_COMPLETE",
+    "CREATE_FAILED",
+    "UPDATE_FAILED",
+    "DELETE_FAILED",
+}
+# Status of the stack itself once the resources are done
+STACK_FINISHED = {
+    "CREATE_COMPLETE",
+    "UPDATE_COMPLETE_CLEANUP_IN_PROGRESS",
+    "UPDATE_COMPLETE",
+    "CREATE_FAILED",
+    "UPDATE_ROLLBACK_IN_PROGRESS",
+    "ROLLBACK_IN_PROGRESS",
+}
+
+
+def last_operation_events(stack_name, client):
+    """Events of the latest stack operation, oldest first."""
+    events = []
+    for page in client.get_paginator("describe_stack_events").paginate(
+        StackName=stack_name
+    ):
+        for event in page["StackEvents"]:
+            events.append(event)
+            # Events are listed newest first, the operation starts with a user
+            # initiated in progress event of the stack
+            if (
+                event["LogicalResourceId"] == stack_name
+                and event["ResourceStatus"]
+                in ("CREATE_IN_PROGRESS", "UPDATE_IN_PROGRESS")
+                and event.get("ResourceStatusReason") == "User Initiated"
+            ):
+                return list(reversed(events))
+    return list(reversed(events))
+
+
+def resource_durations(events, stack_name):
+    """Seconds between the start and end events of each resource."""
+    started = {}
+    durations = []
+    for event in events:
+        key = (event["LogicalResourceId"], event["ResourceType"])
+        if event["LogicalResourceId"] == stack_name:
+            continue
+        if event["ResourceStatus"] in STARTED and key not in started:
+            started[key] = event["Timestamp"]
+        elif event["ResourceStatus"] in FINISHED and key in started:
+            durations.append(
+                (
+                    key[0],
+                    key[1],
+                    event["ResourceStatus"],
+                    (event["Timestamp"] - started.pop(key)).total_seconds(),
+                )
+            )
+    return durations
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("stack_name")
+    parser.add_argument("--top", type=int, default=15)
+    args = parser.parse_args()
+
+    events = last_operation_events(args.stack_name, boto3.client("cloudformation"))
+    stack_events = [
+        event for event in events if event["LogicalResourceId"] == args.stack_name
+    ]
+    finished = next(
+        (
+            event["Timestamp"]
+            for event in stack_events
+            if event["ResourceStatus"] in STACK_FINISHED
+        ),
+        events[-1]["Timestamp"],
+    )
+    total = (finished - events[0]["Timestamp"]).total_seconds()
+    durations = resource_durations(events, args.stack_name)
+
+    print(f"{args.stack_name}: {stack_events[0]['ResourceStatus']} in {total:.0f}s")
+    print(f"{len(durations)} resource operations\n")
+
+    print(f"{'seconds':>8}  {'status':<16} {'type':<40} resource")
+    for logical_id, resource_type, status, seconds in sorted(
+        durations, key=lambda item: item[3], reverse=True
+    )[: args.top]:
+        print(f"{seconds:>8.0f}  {status:<16} {resource_type:<40} {logical_id}")
+
+    by_type = defaultdict(list)
+    for _, resource_type, _, seconds in durations:
+        if resource_type.startswith("Custom::") or resource_type.endswith(
+            "CustomResource"
+        ):
+            by_type[resource_type].append(seconds)
+    if by_type:
+        print("\nCustom resources")
+        for resource_type, seconds in sorted(by_type.items()):
+            print(
+                f"  {resource_type:<40} {len(seconds):>3} operation(s), "
+                f"{sum(seconds):>6.0f}s in total, {max(seconds):>4.0f}s at most"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""Check the invalidation slots semaphore under contention against a DynamoDB endpoint.
+
+Workers stand for concurrent invalidation function invocations: each takes the
+slots of random invalidation batches on a few distributions, holds them for a
+while as CloudFront would, then returns them as the invalidation tracker does.
+The paths held are counted on the side to check that no distribution ever
+exceeds its quota, and the table is checked to be back to zero at the end.
+Run it against DynamoDB Local rather than an AWS account, e.g.
+
+    docker run -p 8000:8000 amazon/dynamodb-local
+    python3 benchmarks/invalidation_slots_benchmark.py --endpoint-url http://localhost:8000
+"""
+
+import argparse
+import os
+import random
+import statistics
+import sys
+import threading
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import boto3
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "layers",
+        "invalidation_slots",
+        "python",
+    ),
+)
+import invalidation_slots  # noqa: E402
+
+
+def random_batch(rng):
+    """A full invalidation, a few wildcards or a batch of files."""
+    kind = rng.random()
+    if kind < 0.3:
+        return ["/*"]
+    if kind < 0.6:
+        return [f"/dir-{index}/*" for index in range(rng.randint(1, 8))]
+    return [f"/page-{index}.html" for index in range(rng.randint(1, 1000))]
+
+
+def worker(args, client, table_name, held, lock, seed):
+    rng = random.Random(seed)
+    stats = {"acquired": 0, "throttled": 0, "latencies": [], "violations": 0}
+    for _ in range(args.batches):
+        distribution_id = f"E{rng.randrange(args.distributions)}"
+        batch = random_batch(rng)
+        lease_id = uuid.uuid4().hex
+        wildcards, files = invalidation_slots.weights(batch)
+
+        started = time.perf_counter()
+        acquired = invalidation_slots.acquire(
+            client, table_name, distribution_id, lease_id, batch
+        )
+        stats["latencies"].append(1000 * (time.perf_counter() - started))
+        if not acquired:
+            stats["throttled"] += 1
+            # The function queues the deployment again after a jittered delay
+            time.sleep(rng.uniform(0, args.hold_ms / 1000))
+            continue
+
+        stats["acquired"] += 1
+        with lock:
+            held[distribution_id][0] += wildcards
+            held[distribution_id][1] += files
+            if (
+                held[distribution_id][0] > invalidation_slots.MAX_WILDCARD_SLOTS
+                or held[distribution_id][1] > invalidation_slots.MAX_PATH_SLOTS
+            ):
+                stats["violations"] += 1
+
+        time.sleep(rng.uniform(0, args.hold_ms / 1000))
+
+        # Counted down first, the slots are only free once returned
+        with lock:
+            held[distribution_id][0] -= wildcards
+            held[distribution_id][1] -= files
+        invalidation_slots.release(
+            client, table_name, distribution_id, lease_id, wildcards, files
+        )
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--endpoint-url", required=True)
+    parser.add_argument("--region", default="us-east-1")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--batches", type=int, default=50)
+    parser.add_argument("--distributions", type=int, default=3)
+    parser.add_argument("--hold-ms", type=float, default=50)
+    args = parser.parse_args()
+
+    client = boto3.client(
+        "dynamodb",
+        endpoint_url=args.endpoint_url,
+        region_name=args.region,
+        # DynamoDB Local accepts any credentials
+        aws_access_key_id="benchmark",
+        aws_secret_access_key="benchmark",
+    )
+    table_name = f"invalidation-slots-{uuid.uuid4().hex[:8]}"
+    client.create_table(
+        TableName=table_name,
+        KeySchema=[{"AttributeName": "DistributionId", "KeyType": "HASH"}],
+        AttributeDefinitions=[
+            {"AttributeName": "DistributionId", "AttributeType": "S"}
+        ],
+        BillingMode="PAY_PER_REQUEST",
+    )
+    client.get_waiter("table_exists").wait(TableName=table_name)
+
+    held = defaultdict(lambda: [0, 0])
+    lock = threading.Lock()
+    try:
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=args.workers) as executor:
+            results = list(
+                executor.map(
+                    lambda seed: worker(args, client, table_name, held, lock, seed),
+                    range(args.workers),
+                )
+            )
+        elapsed = time.perf_counter() - started
+
+        leftovers = []
+        for item in client.scan(TableName=table_name, ConsistentRead=True)["Items"]:
+            if (
+                item["WildcardSlots"]["N"] != "0"
+                or item["PathSlots"]["N"] != "0"
+                or any(
+                    name.startswith(invalidation_slots.LEASE_PREFIX) for name in item
+                )
+            ):
+                leftovers.append(item["DistributionId"]["S"])
+    finally:
+        client.delete_table(TableName=table_name)
+
+    latencies = sorted(latency for result in results for latency in result["latencies"])
+    acquired = sum(result["acquired"] for result in results)
+    throttled = sum(result["throttled"] for result in results)
+    violations = sum(result["violations"] for result in results)
+    print(
+        f"{args.workers} workers, {len(latencies)} acquisitions on "
+        f"{args.distributions} distributions in {elapsed:.1f}s"
+    )
+    print(f"acquired {acquired}, throttled {throttled}")
+    print(
+        f"acquire ms p50 {statistics.median(latencies):.1f}, "
+        f"p99 {latencies[int(0.99 * (len(latencies) - 1))]:.1f}, max {latencies[-1]:.1f}"
+    )
+    print(f"quota violations {violations}, distributions not back to zero {leftovers}")
+    if violations or leftovers:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
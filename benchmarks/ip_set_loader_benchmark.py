@@ -0,0 +1,146 @@
+#!/usr/bin/env python3
+"""Measure the block list loader against a stubbed WAFv2 client.
+
+A synthetic block list with duplicates, overlapping and adjacent networks is
+streamed through the loader, which must merge it and write every IP set shard.
+One update is refused with a lock exception to exercise the retry path.
+
+    python3 benchmarks/ip_set_loader_benchmark.py --entries 300000 --shards 3
+"""
+
+import argparse
+import ipaddress
+import os
+import random
+import sys
+import time
+import tracemalloc
+
+import boto3
+from botocore.stub import ANY, Stubber
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "ip_set_loader",
+    ),
+)
+import block_list  # noqa: E402
+
+
+def synthetic_block_list(entries, networks, seed=0):
+    """Yield block list lines drawn from a pool of /24 networks.
+
+    Entries are single hosts, halves and whole /24s of the pool, so the list
+    merges down to at most one CIDR per pool network.
+    """
+    rng = random.Random(seed)
+    pool = [rng.getrandbits(24) << 8 for _ in range(networks)]
+    for index in range(entries):
+        network = rng.choice(pool)
+        kind = index % 4
+        if kind == 0:
+            yield f"{ipaddress.IPv4Address(network)}/24\n"
+        elif kind == 1:
+            half = network + rng.choice((0, 128))
+            yield f"{ipaddress.IPv4Address(half)}/25  # half\n"
+        else:
+            yield f"{ipaddress.IPv4Address(network + rng.randrange(256))}\n"
+    yield "2001:db8::/48\n"
+    yield "2001:db8:1::/48\n"
+    yield "not-an-address\n"
+
+
+def stubbed_client(ip_sets):
+    client = boto3.client("wafv2", region_name="us-east-1")
+    stubber = Stubber(client)
+    first = True
+    for version_ip_sets in ip_sets.values():
+        for ip_set in version_ip_sets:
+            get_ip_set = {
+                "IPSet": {
+                    "Name": ip_set["Name"],
+                    "Id": ip_set["Id"],
+                    "ARN": f"arn:aws:wafv2:us-east-1:111111111111:global/ipset/{ip_set['Name']}/{ip_set['Id']}",
+                    "IPAddressVersion": "IPV4",
+                    "Addresses": [],
+                },
+                "LockToken": "0" * 36,
+            }
+            expected = {
+                "Name": ip_set["Name"],
+                "Scope": "CLOUDFRONT",
+                "Id": ip_set["Id"],
+            }
+            if first:
+                # Another writer changed the first IP set between get and update
+                stubber.add_response("get_ip_set", get_ip_set, expected)
+                stubber.add_client_error("update_ip_set", "WAFOptimisticLockException")
+                first = False
+            stubber.add_response("get_ip_set", get_ip_set, expected)
+            stubber.add_response(
+                "update_ip_set",
+                {"NextLockToken": "1" * 36},
+                {**expected, "Addresses": ANY, "LockToken": "0" * 36},
+            )
+    return client, stubber
+
+
+def load(ip_sets, args):
+    """Load the synthetic block list, return the loaded counts and API calls."""
+    client, stubber = stubbed_client(ip_sets)
+    calls = []
+    client.meta.events.register(
+        "before-call.*.*", lambda model, **kwargs: calls.append(model.name)
+    )
+    with stubber:
+        loaded = block_list.load_block_list(
+            client, synthetic_block_list(args.entries, args.networks), ip_sets
+        )
+        stubber.assert_no_pending_responses()
+    return loaded, calls
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--entries", type=int, default=300000)
+    parser.add_argument("--networks", type=int, default=25000)
+    parser.add_argument("--shards", type=int, default=3)
+    args = parser.parse_args()
+
+    ip_sets = {
+        version: [
+            {
+                "Name": f"benchmark-block-list-ipv{version}-{index}",
+                "Id": f"{version}{index:035d}",
+            }
+            for index in range(args.shards)
+        ]
+        for version in (4, 6)
+    }
+    # The retry waits one second, which is not part of the loader's work
+    block_list.time.sleep = lambda seconds: None
+
+    # Timed first, memory is traced in a second run as tracing slows Python down
+    started = time.perf_counter()
+    loaded, calls = load(ip_sets, args)
+    elapsed = time.perf_counter() - started
+
+    tracemalloc.start()
+    load(ip_sets, args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print(f"entries          {args.entries}")
+    print(f"loaded IPv4      {loaded[4]}")
+    print(f"loaded IPv6      {loaded[6]}")
+    print(f"WAFv2 calls      {len(calls)} ({', '.join(sorted(set(calls)))})")
+    print(f"seconds          {elapsed:.2f} (including list generation)")
+    print(f"peak memory MB   {peak / 1024 / 1024:.1f}")
+
+
+if __name__ == "__main__":
+    main()
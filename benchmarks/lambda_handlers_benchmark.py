@@ -0,0 +1,404 @@
+#!/usr/bin/env python3
+"""Measure the init and per-invoke cost of the password retrieval and cache invalidation functions.
+
+Each function is imported in fresh interpreters to measure its init cost, then
+invoked many times against botocore Stubbers, with and without the telemetry
+layer, to measure the per-invoke overhead. Lambda allocates CPU in proportion
+to memory, a full vCPU at 1769 MB, so the CPU times measured here are projected
+to each memory size, adding --latency-ms per SDK call for the AWS round trips.
+
+    python3 benchmarks/lambda_handlers_benchmark.py --invocations 500 --json results.json
+"""
+
+import argparse
+import contextlib
+import importlib.util
+import io
+import json
+import os
+import statistics
+import subprocess
+import sys
+import time
+import types
+from datetime import datetime, timezone
+
+from botocore.response import StreamingBody
+from botocore.stub import Stubber
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+LAYER_PATHS = [
+    os.path.join(ROOT, "src", "layers", layer, "python")
+    for layer in ("telemetry", "invalidation_slots")
+]
+FUNCTIONS_PATH = os.path.join(ROOT, "src", "functions")
+
+# Memory of a full vCPU, the CPU share is proportional below it
+FULL_VCPU_MEMORY = 1769
+
+# Imports a function in a fresh interpreter, as in a new execution environment
+INIT_SCRIPT = """
+import json, sys, time
+wall, cpu = time.perf_counter(), time.process_time()
+sys.path[:0] = sys.argv[1:]
+import lambda_function, telemetry
+print(json.dumps({
+    "wall_ms": 1000 * (time.perf_counter() - wall),
+    "cpu_ms": 1000 * (time.process_time() - cpu),
+    "telemetry_init_ms": 1000 * telemetry.init_seconds,
+}))
+"""
+
+ENVIRONMENT = {
+    "AWS_DEFAULT_REGION": "us-east-1",
+    "AWS_ACCESS_KEY_ID": "benchmark",
+    "AWS_SECRET_ACCESS_KEY": "benchmark",
+    "AWS_LAMBDA_FUNCTION_NAME": "benchmark",
+    "DISTRIBUTION_PARAMETER_PREFIX": "/amplify-waf/benchmark/distributions",
+    "MANIFEST_BUCKET": "benchmark-manifests",
+    "MANIFEST_PATH": "/deploy-manifest.json",
+    "TRACKING_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/111111111111/tracking",
+    "INVALIDATION_QUEUE_URL": "https://sqs.us-east-1.amazonaws.com/111111111111/invalidation",
+    "INVALIDATION_SLOTS_TABLE": "benchmark-invalidation-slots",
+}
+
+CREDENTIALS_ARN = (
+    "arn:aws:secretsmanager:us-east-1:111111111111:secret:credentials-AbCdEf"
+)
+DISTRIBUTION_ID = "E2BENCHMARK"
+
+# Deployed files, the current deployment changes a handful of them
+PREVIOUS_MANIFEST = {
+    f"/assets/page-{index}.html": f"{index:064x}" for index in range(500)
+}
+CURRENT_MANIFEST = {
+    **PREVIOUS_MANIFEST,
+    **{f"/assets/page-{index}.html": "f" * 64 for index in range(5)},
+}
+
+
+def load_function(name):
+    """Import a fresh copy of a function module."""
+    function_path = os.path.join(FUNCTIONS_PATH, name)
+    for path in (*LAYER_PATHS, function_path):
+        if path not in sys.path:
+            sys.path.insert(0, path)
+    spec = importlib.util.spec_from_file_location(
+        f"{name}_function", os.path.join(function_path, "lambda_function.py")
+    )
+    module = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+def measure_init(name, runs):
+    """Median wall and CPU time of importing the function, in milliseconds."""
+    samples = []
+    for _ in range(runs):
+        output = subprocess.run(
+            [
+                sys.executable,
+                "-c",
+                INIT_SCRIPT,
+                *LAYER_PATHS,
+                os.path.join(FUNCTIONS_PATH, name),
+            ],
+            check=True,
+            capture_output=True,
+            text=True,
+            env={**os.environ, **ENVIRONMENT},
+        ).stdout
+        samples.append(json.loads(output.splitlines()[-1]))
+    return {
+        key: statistics.median(sample[key] for sample in samples) for key in samples[0]
+    }
+
+
+def password_retrieval_scenario(module, stubbers, invocations):
+    # Responses are dropped instead of being sent to CloudFormation
+    module.send_response = lambda *args, **kwargs: None
+    now = datetime.now(timezone.utc)
+    for _ in range(invocations):
+        stubbers["service_client"].add_response(
+            "get_secret_value",
+            {
+                "ARN": CREDENTIALS_ARN,
+                "Name": "credentials",
+                "SecretString": json.dumps(
+                    {"username": "benchmark", "password": "benchmark"}
+                ),
+            },
+        )
+        # The branch already uses the credentials, as on most deployments
+        stubbers["amplify_client"].add_response(
+            "get_branch",
+            {
+                "branch": {
+                    "branchArn": "arn:aws:amplify:us-east-1:111111111111:apps/d1a2b3c4/branches/main",
+                    "branchName": "main",
+                    "description": "",
+                    "stage": "PRODUCTION",
+                    "displayName": "main",
+                    "enableNotification": False,
+                    "createTime": now,
+                    "updateTime": now,
+                    "environmentVariables": {},
+                    "enableAutoBuild": True,
+                    "customDomains": [],
+                    "framework": "",
+                    "activeJobId": "1",
+                    "totalNumberOfJobs": "1",
+                    "enableBasicAuth": True,
+                    "basicAuthCredentials": "YmVuY2htYXJrOmJlbmNobWFyaw==",
+                    "ttl": "5",
+                    "enablePullRequestPreview": False,
+                }
+            },
+        )
+    event = {
+        "RequestType": "Update",
+        "ResourceType": "Custom::AmplifyBranchCredentials",
+        "LogicalResourceId": "rBranchCredentials",
+        "PhysicalResourceId": "d1a2b3c4/main",
+        "ResourceProperties": {
+            "AppId": "d1a2b3c4",
+            "BranchName": "main",
+            "CredentialsSecretArn": CREDENTIALS_ARN,
+        },
+    }
+    return [event] * invocations
+
+
+def cache_invalidation_scenario(module, stubbers, invocations):
+    # The manifest is served from memory instead of the Amplify origin
+    manifest = json.dumps(CURRENT_MANIFEST).encode("utf-8")
+    module.urllib = types.SimpleNamespace(
+        request=types.SimpleNamespace(
+            Request=module.urllib.request.Request,
+            urlopen=lambda request, timeout: io.BytesIO(manifest),
+        )
+    )
+    previous = json.dumps(PREVIOUS_MANIFEST).encode("utf-8")
+    now = datetime.now(timezone.utc)
+
+    stubbers["ssm_client"].add_response(
+        "get_parameter",
+        {"Parameter": {"Name": "distribution", "Value": DISTRIBUTION_ID}},
+    )
+    for _ in range(invocations):
+        stubbers["service_client"].add_response(
+            "get_distribution_config",
+            {
+                "DistributionConfig": {
+                    "CallerReference": "benchmark",
+                    "Comment": "",
+                    "Enabled": True,
+                    "Origins": {
+                        "Quantity": 1,
+                        "Items": [
+                            {
+                                "Id": "amplify",
+                                "DomainName": "main.d1a2b3c4.amplifyapp.com",
+                                "CustomHeaders": {
+                                    "Quantity": 1,
+                                    "Items": [
+                                        {
+                                            "HeaderName": "Authorization",
+                                            "HeaderValue": "Basic YmVuY2htYXJr",
+                                        }
+                                    ],
+                                },
+                            }
+                        ],
+                    },
+                    "DefaultCacheBehavior": {
+                        "TargetOriginId": "amplify",
+                        "ViewerProtocolPolicy": "redirect-to-https",
+                    },
+                }
+            },
+        )
+        stubbers["s3_client"].add_response(
+            "get_object",
+            {"Body": StreamingBody(io.BytesIO(previous), len(previous))},
+        )
+        stubbers["service_client"].add_response(
+            "list_invalidations",
+            {
+                "InvalidationList": {
+                    "Marker": "",
+                    "MaxItems": 100,
+                    "IsTruncated": False,
+                    "Quantity": 0,
+                }
+            },
+        )
+        stubbers["dynamodb_client"].add_response("update_item", {})
+        stubbers["service_client"].add_response(
+            "create_invalidation",
+            {
+                "Invalidation": {
+                    "Id": "I2BENCHMARK",
+                    "Status": "InProgress",
+                    "CreateTime": now,
+                    "InvalidationBatch": {
+                        "Paths": {"Quantity": 1, "Items": ["/"]},
+                        "CallerReference": "benchmark",
+                    },
+                }
+            },
+        )
+        stubbers["s3_client"].add_response("put_object", {})
+        stubbers["sqs_client"].add_response(
+            "send_message", {"MessageId": "benchmark", "MD5OfMessageBody": "0" * 32}
+        )
+
+    event = {
+        "Records": [
+            {
+                "messageId": "benchmark",
+                "body": json.dumps(
+                    {
+                        "id": "benchmark",
+                        "time": now.strftime("%Y-%m-%dT%H:%M:%SZ"),
+                        "detail": {
+                            "appId": "d1a2b3c4",
+                            "branchName": "main",
+                            "jobId": "1",
+                            "jobStatus": "SUCCEED",
+                        },
+                    }
+                ),
+            }
+        ]
+    }
+    return [event] * invocations
+
+
+SCENARIOS = {
+    "password_retrieval": (
+        ["service_client", "amplify_client"],
+        password_retrieval_scenario,
+    ),
+    "cache_invalidation": (
+        ["service_client", "dynamodb_client", "s3_client", "sqs_client", "ssm_client"],
+        cache_invalidation_scenario,
+    ),
+}
+
+
+def measure_invocations(name, invocations, instrumented):
+    """Wall and CPU time per invocation in milliseconds, and SDK calls per invocation."""
+    module = load_function(name)
+    client_names, scenario = SCENARIOS[name]
+    handler = module.lambda_handler
+    if not instrumented:
+        handler = handler.__wrapped__
+
+    stubbers = {
+        client_name: Stubber(getattr(module, client_name))
+        for client_name in client_names
+    }
+    calls = []
+    for client_name in client_names:
+        getattr(module, client_name).meta.events.register(
+            "after-call.*.*", lambda **kwargs: calls.append(1)
+        )
+
+    with contextlib.ExitStack() as stack:
+        for stubber in stubbers.values():
+            stack.enter_context(stubber)
+        events = scenario(module, stubbers, invocations)
+        context = types.SimpleNamespace(
+            aws_request_id="benchmark",
+            get_remaining_time_in_millis=lambda: 300000,
+        )
+
+        # Logs are written out as they would be to the function log stream
+        with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(devnull):
+            wall, cpu = time.perf_counter(), time.process_time()
+            for event in events:
+                handler(event, context)
+            wall, cpu = time.perf_counter() - wall, time.process_time() - cpu
+
+        for stubber in stubbers.values():
+            stubber.assert_no_pending_responses()
+
+    return {
+        "wall_ms": 1000 * wall / invocations,
+        "cpu_ms": 1000 * cpu / invocations,
+        "sdk_calls": len(calls) / invocations,
+    }
+
+
+def projected_ms(cpu_ms, memory, sdk_calls=0, latency_ms=0):
+    return cpu_ms / min(1, memory / FULL_VCPU_MEMORY) + sdk_calls * latency_ms
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--invocations", type=int, default=500)
+    parser.add_argument("--init-runs", type=int, default=5)
+    parser.add_argument("--latency-ms", type=float, default=20)
+    parser.add_argument(
+        "--memory", type=int, nargs="+", default=[128, 256, 512, 1024, 1769]
+    )
+    parser.add_argument("--json", help="Write the results to this file")
+    args = parser.parse_args()
+    os.environ.update(ENVIRONMENT)
+
+    results = {}
+    for name in SCENARIOS:
+        results[name] = {
+            "init": measure_init(name, args.init_runs),
+            "invoke": measure_invocations(name, args.invocations, instrumented=True),
+            "invoke_uninstrumented": measure_invocations(
+                name, args.invocations, instrumented=False
+            ),
+        }
+
+    print(
+        f"{'function':<20} {'init ms':>8} {'init cpu':>8} {'boto3 ms':>8} "
+        f"{'invoke ms':>9} {'bare ms':>8} {'overhead':>8} {'calls':>5}"
+    )
+    for name, result in results.items():
+        init, invoke, bare = (
+            result["init"],
+            result["invoke"],
+            result["invoke_uninstrumented"],
+        )
+        print(
+            f"{name:<20} {init['wall_ms']:>8.1f} {init['cpu_ms']:>8.1f} "
+            f"{init['telemetry_init_ms']:>8.1f} {invoke['wall_ms']:>9.3f} "
+            f"{bare['wall_ms']:>8.3f} {invoke['wall_ms'] - bare['wall_ms']:>8.3f} "
+            f"{invoke['sdk_calls']:>5.1f}"
+        )
+
+    print(
+        f"\nProjected init and invocation ms by memory size, {args.latency_ms:g} ms per SDK call"
+    )
+    print(f"{'function':<20} " + " ".join(f"{memory:>13}" for memory in args.memory))
+    for name, result in results.items():
+        cells = []
+        for memory in args.memory:
+            init_ms = projected_ms(result["init"]["cpu_ms"], memory)
+            invoke_ms = projected_ms(
+                result["invoke"]["cpu_ms"],
+                memory,
+                result["invoke"]["sdk_calls"],
+                args.latency_ms,
+            )
+            cells.append(f"{init_ms:>6.0f}/{invoke_ms:<6.1f}")
+            result.setdefault("projected", {})[memory] = {
+                "init_ms": init_ms,
+                "invoke_ms": invoke_ms,
+            }
+        print(f"{name:<20} " + " ".join(cells))
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
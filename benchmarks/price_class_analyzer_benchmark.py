@@ -0,0 +1,164 @@
+#!/usr/bin/env python3
+"""Benchmark the price class analyzer on synthetic CloudFront access logs.
+
+Logs of the requested uncompressed size are generated with skewed edge
+locations, viewer addresses and object sizes, along with a country file
+covering the addresses. The analyzer runs with one and with several worker
+processes; its totals are compared with the exact ones.
+
+    python3 benchmarks/price_class_analyzer_benchmark.py --size-mb 1024 --files 8
+"""
+
+import argparse
+import gzip
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"),
+)
+import price_class_analyzer  # noqa: E402
+
+# Edge locations by share of traffic, most requests from North America and Europe
+EDGE_LOCATIONS = [
+    "IAD89-C1",
+    "FRA56-P5",
+    "LHR61-C2",
+    "SFO5-C3",
+    "NRT57-C2",
+    "SIN2-P1",
+    "GRU3-C1",
+    "BOM78-P4",
+    "SYD62-P1",
+    "DXB52-C1",
+    "JNB50-C1",
+    "XYZ1-C1",
+]
+COUNTRIES = ["US", "DE", "GB", "US", "JP", "SG", "BR", "IN", "AU", "AE", "ZA", "US"]
+
+FIELDS = (
+    "date time x-edge-location sc-bytes c-ip cs-method cs(Host) cs-uri-stem sc-status "
+    "cs(Referer) cs(User-Agent) cs-uri-query cs(Cookie) x-edge-result-type x-edge-request-id "
+    "x-host-header cs-protocol cs-bytes time-taken x-forwarded-for ssl-protocol ssl-cipher "
+    "x-edge-response-result-type cs-protocol-version fle-status fle-encrypted-fields c-port "
+    "time-to-first-byte x-edge-detailed-result-type sc-content-type sc-content-len "
+    "sc-range-start sc-range-end"
+)
+LINE = (
+    "2024-05-{day:02d}\t12:00:00\t{edge}\t{bytes}\t{ip}\tGET\td111111abcdef8.cloudfront.net\t"
+    "/page/{page}\t200\t-\tMozilla/5.0%20(X11;%20Linux%20x86_64)\t-\t-\tHit\t{request_id}\t"
+    "example.com\thttps\t120\t{time_taken}\t-\tTLSv1.3\tTLS_AES_128_GCM_SHA256\tHit\tHTTP/2.0\t-\t-\t"
+    "51234\t{time_taken}\tHit\ttext/html\t{bytes}\t-\t-\n"
+)
+
+
+def skewed(rng, values, skew=1.2):
+    """Pick an index with a Zipf-like distribution."""
+    return min(int(rng.paretovariate(skew)) - 1, len(values) - 1)
+
+
+def generate(directory, size_mb, files, seed=0):
+    """Write the logs and country file, return their paths and the exact totals."""
+    rng = random.Random(seed)
+    # One /16 network per edge location, whose viewers are in its country
+    countries_path = os.path.join(directory, "countries.csv")
+    with open(countries_path, "w") as f:
+        f.write("first,last,country\n")
+        for index, country in enumerate(COUNTRIES):
+            f.write(f"10.{index}.0.0,10.{index}.255.255,{country}\n")
+
+    exact = {"edge_locations": Counter(), "countries": Counter(), "bytes": 0}
+    file_size = size_mb * 1024 * 1024 // files
+    paths = []
+    for file_index in range(files):
+        path = os.path.join(directory, f"E1ABCDEFGHIJKL.2024-05-01-{file_index:04d}.gz")
+        written = 0
+        with gzip.open(path, "wt", compresslevel=1) as f:
+            f.write("#Version: 1.0\n")
+            f.write(f"#Fields: {FIELDS}\n")
+            while written < file_size:
+                index = skewed(rng, EDGE_LOCATIONS, 0.6)
+                sc_bytes = int(rng.lognormvariate(9, 1.5))
+                line = LINE.format(
+                    day=1 + written % 28,
+                    edge=EDGE_LOCATIONS[index],
+                    bytes=sc_bytes,
+                    ip=f"10.{index}.{rng.randrange(256)}.{rng.randrange(256)}",
+                    page=skewed(rng, range(5000)),
+                    request_id=f"{file_index}-{written}",
+                    time_taken=f"{rng.expovariate(1 / 0.05):.3f}",
+                )
+                f.write(line)
+                written += len(line)
+                exact["edge_locations"][EDGE_LOCATIONS[index]] += 1
+                exact["countries"][COUNTRIES[index]] += 1
+                exact["bytes"] += sc_bytes
+        paths.append(path)
+
+    return paths, countries_path, exact
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size-mb", type=int, default=256, help="Uncompressed size of the logs"
+    )
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        paths, countries_path, exact = generate(directory, args.size_mb, args.files)
+        print(
+            f"generated {args.size_mb} MB in {args.files} files in {time.perf_counter() - started:.1f}s"
+        )
+
+        print(
+            f"{'workers':>7} {'seconds':>8} {'MB/s':>8} {'records/s':>10} {'peak MB':>8}"
+        )
+        for workers in sorted({1, args.workers}):
+            started = time.perf_counter()
+            summary = price_class_analyzer.summarize(
+                paths, countries_path, workers=workers
+            )
+            elapsed = time.perf_counter() - started
+            # Largest of this process and its workers, in kilobytes on Linux
+            peak_mb = (
+                max(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                )
+                / 1024
+            )
+            print(
+                f"{workers:>7} {elapsed:>8.1f} {args.size_mb / elapsed:>8.1f} "
+                f"{summary.records / elapsed:>10.0f} {peak_mb:>8.0f}"
+            )
+
+            for name in ("edge_locations", "countries"):
+                counts = {
+                    key: totals[0] for key, totals in getattr(summary, name).items()
+                }
+                if counts != dict(exact[name]):
+                    sys.exit(f"{name} totals differ from the generated logs")
+            if sum(totals[1] for totals in summary.regions.values()) != exact["bytes"]:
+                sys.exit("bytes differ from the generated logs")
+
+    report = summary.report(10, max_added_ms=10)
+    for projection in report["projections"]:
+        print(
+            f"{projection['price_class']:<16} ${projection['cost']:>8.2f} "
+            f"mean {projection['mean_ms']:>5.0f} ms p90 {projection['p90_ms']:>4} ms"
+        )
+    print(f"recommended {report['recommended']}")
+
+
+if __name__ == "__main__":
+    main()
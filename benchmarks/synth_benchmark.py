@@ -0,0 +1,154 @@
+#!/usr/bin/env python3
+"""Benchmark offline synthesis of the CDK app for a growing number of branches.
+
+Each measurement runs in its own process so that peak memory is not shared
+between runs. For every branch count the app is synthesized with and without
+the AwsSolutionsChecks aspect, which isolates the cost of cdk-nag.
+
+    python3 benchmarks/synth_benchmark.py --branches 1 10 100
+"""
+
+import argparse
+import json
+import os
+import subprocess  # nosec B404
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WEB_ACL_ARN = "arn:aws:wafv2:us-east-1:111111111111:global/webacl/benchmark/id"
+
+
+def synth(branch_count, with_nag, outdir):
+    """Synthesize the app in this process and return timings and template stats."""
+    started = time.perf_counter()
+    sys.path.insert(0, ROOT)
+    from aws_cdk import App, Aspects
+    from cdk_nag import AwsSolutionsChecks
+
+    from src.amplify_add_on_stack import CustomAmplifyDistributionStack, branch_batches
+    from src.amplify_automation_stack import CustomAmplifyAutomationStack
+    from src.amplify_credentials_stack import CustomAmplifyCredentialsStack
+    from src.web_acl_stack import CustomWebAclStack
+
+    with open(os.path.join(ROOT, "cdk.json")) as f:
+        context = json.load(f)["context"]
+
+    imported = time.perf_counter()
+    app = App(outdir=outdir, context=context)
+
+    # Same layout as app.py, branches beyond one stack go to additional stacks
+    CustomWebAclStack(app, "CustomWebAclStack", env={"region": "us-east-1"})
+    branches = [
+        {"app_id": f"d{index:013d}", "branch_name": f"branch-{index}"}
+        for index in range(branch_count)
+    ]
+    for index, stack_branches in enumerate(branch_batches(branches)):
+        suffix = index + 1 if index else ""
+        CustomAmplifyCredentialsStack(
+            app,
+            f"CustomAmplifyCredentialsStack{suffix}",
+            branches=stack_branches,
+            distribution_stack_name=f"CustomAmplifyDistributionStack{suffix}",
+        )
+        CustomAmplifyDistributionStack(
+            app,
+            f"CustomAmplifyDistributionStack{suffix}",
+            web_acl_arn=WEB_ACL_ARN,
+            branches=stack_branches,
+            credentials_stack_name=f"CustomAmplifyCredentialsStack{suffix}",
+            cache_behaviors=context["cache_behaviors"],
+        )
+        CustomAmplifyAutomationStack(
+            app,
+            f"CustomAmplifyAutomationStack{suffix}",
+            branches=stack_branches,
+            distribution_stack_name=f"CustomAmplifyDistributionStack{suffix}",
+            manifest_path=context["manifest_path"],
+        )
+
+    if with_nag:
+        Aspects.of(app).add(AwsSolutionsChecks())
+    constructed = time.perf_counter()
+
+    assembly = app.synth()
+    synthesized = time.perf_counter()
+
+    templates = [os.path.join(outdir, stack.template_file) for stack in assembly.stacks]
+    return {
+        "import_seconds": imported - started,
+        "construct_seconds": constructed - imported,
+        "synth_seconds": synthesized - constructed,
+        "template_bytes": sum(os.path.getsize(path) for path in templates),
+        "resource_count": sum(_resource_count(path) for path in templates),
+    }
+
+
+def _resource_count(template_path):
+    with open(template_path) as f:
+        return len(json.load(f).get("Resources", {}))
+
+
+def measure(branch_count, with_nag):
+    """Run one synthesis in a child process and return its results."""
+    with tempfile.TemporaryDirectory() as outdir:
+        started = time.perf_counter()
+        process = subprocess.Popen(  # nosec B603
+            [
+                sys.executable,
+                __file__,
+                "--worker",
+                str(branch_count),
+                "--nag" if with_nag else "--no-nag",
+                "--outdir",
+                outdir,
+            ],
+            stdout=subprocess.PIPE,
+            env={**os.environ, "JSII_SILENCE_WARNING_DEPRECATED_NODE_VERSION": "1"},
+        )
+        output = process.stdout.read()
+        _, status, usage = os.wait4(process.pid, 0)
+        wall_seconds = time.perf_counter() - started
+
+    if status != 0:
+        raise RuntimeError(f"Synthesis of {branch_count} branch(es) failed")
+
+    result = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    result["wall_seconds"] = wall_seconds
+    # ru_maxrss is reported in kilobytes on Linux, the largest process wins
+    result["peak_rss_mb"] = usage.ru_maxrss / 1024
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--branches", type=int, nargs="+", default=[1, 10, 100])
+    parser.add_argument("--worker", type=int, help=argparse.SUPPRESS)
+    parser.add_argument("--nag", action=argparse.BooleanOptionalAction, default=True)
+    parser.add_argument("--outdir", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.worker is not None:
+        print(json.dumps(synth(args.worker, args.nag, args.outdir)))
+        return
+
+    print(
+        f"{'branches':>8} {'wall s':>8} {'import s':>8} {'build s':>8} {'synth s':>8} "
+        f"{'nag s':>8} {'peak MB':>8} {'template KB':>11} {'resources':>9}"
+    )
+    for branch_count in args.branches:
+        with_nag = measure(branch_count, with_nag=True)
+        without_nag = measure(branch_count, with_nag=False)
+        print(
+            f"{branch_count:>8} {with_nag['wall_seconds']:>8.2f} "
+            f"{with_nag['import_seconds']:>8.2f} {with_nag['construct_seconds']:>8.2f} "
+            f"{with_nag['synth_seconds']:>8.2f} "
+            f"{with_nag['synth_seconds'] - without_nag['synth_seconds']:>8.2f} "
+            f"{with_nag['peak_rss_mb']:>8.0f} {with_nag['template_bytes'] / 1024:>11.0f} "
+            f"{with_nag['resource_count']:>9}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,155 @@
+#!/usr/bin/env python3
+"""Benchmark the WAF log analyzer on synthetic gzip compressed WAF logs.
+
+Logs of the requested uncompressed size are generated with skewed client IPs,
+URIs, countries and rules. The analyzer runs with one and with several worker
+processes; its top blocked values are compared with the exact counts.
+
+    python3 benchmarks/waf_log_analyzer_benchmark.py --size-mb 2048 --files 16
+"""
+
+import argparse
+import gzip
+import os
+import random
+import resource
+import sys
+import tempfile
+import time
+from collections import Counter
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "tools"),
+)
+import waf_log_analyzer  # noqa: E402
+
+RULES = [
+    "AWS-AmazonIpReputationList",
+    "AWS-ManagedRulesAnonymousIpList",
+    "AWS-ManagedRulesCommonRuleSet",
+    "AWS-ManagedRulesKnownBadInputsRuleSet",
+    "AWS-BotControl",
+    "RateLimit-api",
+    "BlockList",
+]
+COUNTRIES = ["US", "DE", "FR", "GB", "IN", "BR", "JP", "CN", "RU", "NL", "SG", "CA"]
+
+# Static part of a record, close to the size of real WAF log records
+RECORD = (
+    '{{"timestamp":{timestamp},"formatVersion":1,"webaclId":"arn:aws:wafv2:us-east-1:111111111111:'
+    'global/webacl/benchmark/00000000-0000-0000-0000-000000000000","terminatingRuleId":"{rule}",'
+    '"terminatingRuleType":"MANAGED_RULE_GROUP","action":"{action}","terminatingRuleMatchDetails":[],'
+    '"httpSourceName":"CF","httpSourceId":"E1ABCDEFGHIJKL","ruleGroupList":[],"rateBasedRuleList":[],'
+    '"nonTerminatingMatchingRules":[],"requestHeadersInserted":null,"responseCodeSent":null,'
+    '"httpRequest":{{"clientIp":"{ip}","country":"{country}","headers":[{{"name":"host",'
+    '"value":"d111111abcdef8.cloudfront.net"}},{{"name":"user-agent","value":"Mozilla/5.0 (X11; Linux x86_64)"}},'
+    '{{"name":"accept","value":"text/html,application/xhtml+xml"}}],"uri":"{uri}","args":"",'
+    '"httpVersion":"HTTP/2.0","httpMethod":"GET","requestId":"{request_id}"}}}}\n'
+)
+
+
+def skewed(rng, values, skew=1.2):
+    """Pick a value with a Zipf-like distribution over its index."""
+    return values[min(int(rng.paretovariate(skew)) - 1, len(values) - 1)]
+
+
+def generate(directory, size_mb, files, seed=0):
+    """Write the synthetic logs and return the exact blocked counts."""
+    rng = random.Random(seed)
+    ips = [
+        f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+        for _ in range(200000)
+    ]
+    uris = [f"/page/{index}" for index in range(20000)]
+    exact = {name: Counter() for name in waf_log_analyzer.DIMENSIONS}
+    file_size = size_mb * 1024 * 1024 // files
+    paths = []
+
+    for file_index in range(files):
+        path = os.path.join(directory, f"waf-{file_index:04d}.log.gz")
+        written = 0
+        with gzip.open(path, "wt", compresslevel=1) as f:
+            while written < file_size:
+                blocked = rng.random() < 0.1
+                values = {
+                    "ip": skewed(rng, ips),
+                    "uri": skewed(rng, uris),
+                    "rule": skewed(rng, RULES, 0.8) if blocked else "Default_Action",
+                    "country": skewed(rng, COUNTRIES, 0.8),
+                }
+                line = RECORD.format(
+                    timestamp=1700000000000 + written,
+                    action="BLOCK" if blocked else "ALLOW",
+                    request_id=f"{file_index}-{written}",
+                    **values,
+                )
+                f.write(line)
+                written += len(line)
+                if blocked:
+                    for name, value in values.items():
+                        exact[name][value] += 1
+        paths.append(path)
+
+    return paths, exact
+
+
+def accuracy(summary, exact, n):
+    """Return (recall of the top n, largest relative overcount) over dimensions."""
+    recalls, errors = [], []
+    for name, counts in exact.items():
+        expected = {value for value, _ in counts.most_common(n)}
+        reported = dict(summary.blocked[name].most_common(n))
+        recalls.append(len(expected & set(reported)) / max(1, len(expected)))
+        errors.extend(
+            (count - counts[value]) / max(1, counts[value])
+            for value, count in reported.items()
+        )
+    return min(recalls), max(errors, default=0)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size-mb", type=int, default=512, help="Uncompressed size of the logs"
+    )
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as directory:
+        started = time.perf_counter()
+        paths, exact = generate(directory, args.size_mb, args.files)
+        compressed_mb = sum(os.path.getsize(path) for path in paths) / 1024 / 1024
+        print(
+            f"generated {args.size_mb} MB ({compressed_mb:.0f} MB compressed) in "
+            f"{args.files} files in {time.perf_counter() - started:.1f}s"
+        )
+
+        print(
+            f"{'workers':>7} {'seconds':>8} {'MB/s':>8} {'records/s':>10} {'peak MB':>8} {'recall':>7} {'overcount':>9}"
+        )
+        for workers in sorted({1, args.workers}):
+            started = time.perf_counter()
+            summary = waf_log_analyzer.summarize(
+                paths, workers=workers, k=max(100, 10 * args.top)
+            )
+            elapsed = time.perf_counter() - started
+            # Largest of this process and its workers, in kilobytes on Linux
+            peak_mb = (
+                max(
+                    resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                    resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss,
+                )
+                / 1024
+            )
+            recall, overcount = accuracy(summary, exact, args.top)
+            print(
+                f"{workers:>7} {elapsed:>8.1f} {args.size_mb / elapsed:>8.1f} "
+                f"{summary.records / elapsed:>10.0f} {peak_mb:>8.0f} {recall:>7.0%} {overcount:>9.2%}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+#!/usr/bin/env python3
+"""Benchmark the WAF replay on synthetic WAF logs and a synthesized web ACL.
+
+The web ACL of CustomWebAclStack is synthesized with the managed rule groups
+of cdk.json, a rate limit on /api/ and a block list IP set. Synthetic logs are
+generated as for the WAF log analyzer benchmark, along with a block list of
+random addresses and networks. The replay runs with one and with several
+worker processes, whose reports must be identical.
+
+    python3 benchmarks/waf_replay_benchmark.py --size-mb 1024 --block-list-size 50000
+"""
+
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "tools")]
+import waf_log_analyzer_benchmark  # noqa: E402
+import waf_replay  # noqa: E402
+from aws_cdk import App  # noqa: E402
+
+from src.web_acl_stack import CustomWebAclStack  # noqa: E402
+
+
+def synthesize_template():
+    with open(os.path.join(ROOT, "cdk.json")) as f:
+        context = json.load(f)["context"]
+    app = App(outdir=tempfile.mkdtemp())
+    CustomWebAclStack(
+        app,
+        "CustomWebAclStack",
+        env={"region": "us-east-1"},
+        managed_rule_groups=context["waf_managed_rule_groups"],
+        rate_limits=[{"name": "api", "limit": 100, "path_prefix": "/page/1"}],
+        block_list_ip_set_shards=1,
+        log_destination=context["waf_log_destination"],
+        log_filter=context["waf_log_filter"],
+        log_redacted_fields=context["waf_log_redacted_fields"],
+    )
+    return app.synth().get_stack_by_name("CustomWebAclStack").template
+
+
+def block_list(size, seed=1):
+    rng = random.Random(seed)
+    lines = []
+    for _ in range(size):
+        address = f"{rng.randrange(1, 224)}.{rng.randrange(256)}.{rng.randrange(256)}.{rng.randrange(256)}"
+        lines.append(address if rng.random() < 0.9 else f"{address}/24")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument(
+        "--size-mb", type=int, default=256, help="Uncompressed size of the logs"
+    )
+    parser.add_argument("--files", type=int, default=8)
+    parser.add_argument("--block-list-size", type=int, default=50000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+
+    started = time.perf_counter()
+    template = synthesize_template()
+    print(f"synthesized the web ACL in {time.perf_counter() - started:.1f}s")
+
+    addresses = {
+        logical_id: block_list(args.block_list_size)
+        for logical_id, resource in template["Resources"].items()
+        if resource["Type"] == "AWS::WAFv2::IPSet"
+    }
+
+    with tempfile.TemporaryDirectory() as directory:
+        paths, _ = waf_log_analyzer_benchmark.generate(
+            directory, args.size_mb, args.files
+        )
+
+        print(f"{'workers':>7} {'seconds':>8} {'records/min':>12} {'changed':>8}")
+        reports = []
+        for workers in sorted({1, args.workers}):
+            started = time.perf_counter()
+            summary = waf_replay.replay(paths, template, addresses, workers=workers)
+            elapsed = time.perf_counter() - started
+            reports.append(summary.report(10))
+            print(
+                f"{workers:>7} {elapsed:>8.1f} {60 * summary.records / elapsed:>12.0f} "
+                f"{sum(summary.changes.values()):>8}"
+            )
+
+    report = reports[0]
+    print(
+        "\n"
+        + "\n".join(f"{rule['hits']:>10}  {rule['name']}" for rule in report["rules"])
+    )
+    if any(other != report for other in reports[1:]):
+        sys.exit("reports differ between worker counts")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,74 @@
+from aws_cdk import Duration
+from aws_cdk import aws_s3 as s3
+from constructs import Construct
+
+# Options of the standard access logs of the distributions
+ACCESS_LOGS_DEFAULTS = {
+    "expiration_days": 90,
+    "include_cookies": False,
+}
+
+
+def validate_access_logs(access_logs):
+    """Return the access logs options completed with defaults, failing synth on invalid ones."""
+    unknown = set(access_logs) - set(ACCESS_LOGS_DEFAULTS)
+    if unknown:
+        raise ValueError(
+            f"Unknown access logs options {sorted(unknown)}, "
+            f"expected some of {sorted(ACCESS_LOGS_DEFAULTS)}"
+        )
+    options = {**ACCESS_LOGS_DEFAULTS, **access_logs}
+
+    expiration_days = options["expiration_days"]
+    if expiration_days is not None and (
+        not isinstance(expiration_days, int) or expiration_days < 1
+    ):
+        raise ValueError("Access logs expiration_days must be a positive integer")
+    return options
+
+
+class AccessLogsBucket(Construct):
+    """Bucket receiving the standard access logs of the distributions.
+
+    Each branch logs under its app id and branch name, staging distributions
+    under the staging/ prefix. CloudFront delivers
+    standard logs with object ACLs, which the bucket must accept.
+    """
+
+    def __init__(self, scope: Construct, id: str, options: dict):
+        super().__init__(scope, id)
+
+        self.include_cookies = options["include_cookies"]
+
+        self.bucket = s3.Bucket(
+            self,
+            "rBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+            object_ownership=s3.ObjectOwnership.BUCKET_OWNER_PREFERRED,
+            lifecycle_rules=(
+                [s3.LifecycleRule(expiration=Duration.days(options["expiration_days"]))]
+                if options["expiration_days"]
+                else None
+            ),
+        )
+
+        self.nag_suppressions = [
+            (
+                self.bucket,
+                {
+                    "AwsSolutions-S1": "bucket only stores the access logs of the distributions",
+                },
+                False,
+            ),
+        ]
+
+    def logging_options(self, app_id, branch_name, prefix=""):
+        """Distribution properties logging the requests of a branch under prefix."""
+        return {
+            "enable_logging": True,
+            "log_bucket": self.bucket,
+            "log_file_prefix": f"{prefix}{app_id}/{branch_name.replace('/', '-')}/",
+            "log_includes_cookies": self.include_cookies,
+        }
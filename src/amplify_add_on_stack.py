@@ -1,398 +1,365 @@
-import os
-from urllib.parse import quote
-
-import aws_cdk.aws_cloudfront as cloudfront
-import aws_cdk.aws_cloudfront_origins as origins
-from aws_cdk import Aws, CfnOutput, CustomResource, Duration, Stack
-from aws_cdk import aws_events as events
-from aws_cdk import aws_events_targets as targets
-from aws_cdk import aws_iam as iam
-from aws_cdk import aws_secretsmanager as secrets
-from aws_cdk import custom_resources as custom
-from aws_cdk.aws_lambda import Code, Function, Runtime, Tracing
-from aws_cdk.aws_logs import RetentionDays
-from cdk_nag import NagSuppressions
+from aws_cdk import Annotations, CfnOutput, Stack
+from aws_cdk import aws_ssm as ssm
 from constructs import Construct
 
-dirname = os.path.dirname(__file__)
-
-
-class CustomAmplifyDistributionStack(Stack):
-    def __init__(
-        self,
-        scope: Construct,
-        id: str,
-        web_acl_arn: str,
-        app_id: str,
-        branch_name: str,
-        **kwargs,
-    ):
-        super().__init__(scope, id, **kwargs)
-
-        amplify_username = secrets.Secret(
-            self,
-            "rAmplifyUsername",
-            description=f"Username created for Amplify app with id {app_id}",
-            generate_secret_string=secrets.SecretStringGenerator(
-                password_length=12, exclude_punctuation=True
-            ),
-        )
-
-        amplify_password = secrets.Secret(
-            self,
-            "rAmplifyPassword",
-            description=f"Password created for Amplify app with id {app_id}",
-            generate_secret_string=secrets.SecretStringGenerator(
-                password_length=32, exclude_characters=":"
-            ),
-        )
-
-        # Lambda Baic Execution Permissions
-        lambda_exec_policy = iam.ManagedPolicy.from_managed_policy_arn(
-            self,
-            "lambda-exec-policy-00",
-            managed_policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
-        )
-
-        # Amplify Credential Retrieval Lambda Execution Role
-        amplify_credentials_retrieval_function_role = iam.Role(
-            self,
-            "rAmplifyCredentialsRetrievalFunctionRole",
-            description="Role used by amplify_credentials_retrieval_function lambda function",
-            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
-        )
-
-        amplify_credentials_retrieval_function_role.add_managed_policy(
-            lambda_exec_policy
+from src.access_logs import AccessLogsBucket, validate_access_logs
+from src.amplify_branch_credentials import (
+    branch_parameter_path,
+    credentials_function_parameter_name,
+    credentials_parameter_name,
+    credentials_version_parameter_name,
+)
+from src.amplify_branch_distribution import PRICE_CLASSES, AmplifyBranchDistribution
+from src.cache_key_normalization import CacheKeyNormalizationFunction
+from src.cache_tiers import CacheTierPolicies, validate_cache_behaviors
+from src.continuous_deployment import validate_staging_distribution
+from src.nag_suppressions import apply_nag_suppressions
+from src.origin_failover import (
+    MAX_FAILOVER_DELAY,
+    OriginFallbackBucket,
+    validate_error_caching_ttls,
+    validate_origin_fallback,
+)
+
+# Regions in which CloudFront offers Origin Shield
+ORIGIN_SHIELD_REGIONS = {
+    "us-east-1",
+    "us-east-2",
+    "us-west-2",
+    "ap-south-1",
+    "ap-northeast-1",
+    "ap-northeast-2",
+    "ap-southeast-1",
+    "ap-southeast-2",
+    "eu-central-1",
+    "eu-west-1",
+    "eu-west-2",
+    "sa-east-1",
+}
+
+# CloudFront accepted ranges for the origin connection settings, the upper bound
+# of the keep-alive and read timeouts requires a quota increase above 60 seconds
+ORIGIN_SETTING_RANGES = {
+    "origin_connection_attempts": (1, 3),
+    "origin_connection_timeout": (1, 10),
+    "origin_keepalive_timeout": (1, 180),
+    "origin_read_timeout": (1, 180),
+}
+DEFAULT_ORIGIN_TIMEOUT_QUOTA = 60
+
+# Branches per group of credentials, distribution and automation stacks, each
+# branch adds up to 8 resources to a stack with staging distributions, credentials
+# rotation and alarms, and CloudFormation accepts at most 500 resources and 200 parameters in a stack
+MAX_BRANCHES_PER_STACK = 35
+
+
+def validate_origin_settings(scope, origin_shield_region, **settings):
+    """Fail synth on origin settings CloudFront would reject."""
+    if origin_shield_region and origin_shield_region not in ORIGIN_SHIELD_REGIONS:
+        raise ValueError(
+            f"Origin Shield is not available in {origin_shield_region}, "
+            f"expected one of {sorted(ORIGIN_SHIELD_REGIONS)}"
         )
 
-        amplify_password.grant_read(amplify_credentials_retrieval_function_role)
-        amplify_username.grant_read(amplify_credentials_retrieval_function_role)
+    for name, value in settings.items():
+        low, high = ORIGIN_SETTING_RANGES[name]
+        if not isinstance(value, int) or not low <= value <= high:
+            raise ValueError(f"{name} must be an integer between {low} and {high}")
 
-        # Function to retrieve base64 encoded authorisation string
-        amplify_credentials_retrieval_function = Function(
-            self,
-            "rAmplifyCredentialsRetrievalFunction",
-            description="custom function to retrieve value of scecrets that contain amplify auth info",  # noqa 501
-            runtime=Runtime.PYTHON_3_9,
-            handler="lambda_function.lambda_handler",
-            code=Code.from_asset(
-                path=os.path.join(dirname, "functions/password_retrieval")
-            ),
-            timeout=Duration.seconds(30),
-            memory_size=128,
-            role=amplify_credentials_retrieval_function_role,
-            tracing=Tracing.ACTIVE,
-            log_retention=RetentionDays.SIX_MONTHS,
-            environment={
-                "USERNAME_SECRET_ARN": amplify_username.secret_full_arn,
-                "CREDENTIALS_SECRET_ARN": amplify_password.secret_full_arn,
-            },
-        )
-
-        password_provider = custom.Provider(
-            self,
-            "rPasswordProvider",
-            on_event_handler=amplify_credentials_retrieval_function,
-        )
+    for name in ("origin_keepalive_timeout", "origin_read_timeout"):
+        if settings[name] > DEFAULT_ORIGIN_TIMEOUT_QUOTA:
+            Annotations.of(scope).add_warning(
+                f"{name} above {DEFAULT_ORIGIN_TIMEOUT_QUOTA} seconds requires a CloudFront quota increase"
+            )
 
-        amplify_auth_value = CustomResource(
-            self,
-            "rPasswordRequestResource",
-            service_token=password_provider.service_token,
-            properties={},
-        )
 
-        app_branch_update = custom.AwsCustomResource(
-            self,
-            "rAmplifyAppBranchUpdate",
-            policy=custom.AwsCustomResourcePolicy.from_sdk_calls(
-                resources=[
-                    f"arn:aws:amplify:{Aws.REGION}:{Aws.ACCOUNT_ID}:apps/{app_id}/branches/{quote(branch_name, safe='')}",
-                ]
-            ),
-            on_create=custom.AwsSdkCall(
-                service="Amplify",
-                action="updateBranch",
-                parameters={
-                    "appId": app_id,
-                    "branchName": branch_name,
-                    "enableBasicAuth": True,
-                    "basicAuthCredentials": amplify_auth_value.get_att_string(
-                        "EncodedCredentials"
-                    ),
-                },
-                physical_resource_id=custom.PhysicalResourceId.of(
-                    "amplify-branch-update"
-                ),
-            ),
-            on_update=custom.AwsSdkCall(
-                service="Amplify",
-                action="updateBranch",
-                parameters={
-                    "appId": app_id,
-                    "branchName": branch_name,
-                    "enableBasicAuth": True,
-                    "basicAuthCredentials": amplify_auth_value.get_att_string(
-                        "EncodedCredentials"
-                    ),
-                },
-                physical_resource_id=custom.PhysicalResourceId.of(
-                    "amplify-branch-update"
-                ),
-            ),
+def validate_price_class(price_class):
+    """Fail synth on a price class CloudFront does not offer."""
+    if price_class not in PRICE_CLASSES:
+        raise ValueError(
+            f"Unknown price class {price_class}, expected one of {list(PRICE_CLASSES)}"
         )
 
-        app_branch_update.node.add_dependency(amplify_auth_value)
-        app_branch_update.node.add_dependency(amplify_auth_value)
-
-        # Format amplify branch
-        formatted_amplify_branch = branch_name.replace("/", "-")
 
-        # Define cloudfront distribution
-        amplify_app_distribution = cloudfront.Distribution(
-            self,
-            "rCustomCloudFrontDistribution",
-            default_behavior=cloudfront.BehaviorOptions(
-                origin=origins.HttpOrigin(
-                    domain_name=f"{formatted_amplify_branch}.{app_id}.amplifyapp.com",
-                    custom_headers={
-                        "Authorization": amplify_auth_value.get_att_string(
-                            "EncodedSuffix"
-                        )
-                    },
-                ),
-                viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
-            ),
-            price_class=cloudfront.PriceClass.PRICE_CLASS_ALL,
-            web_acl_id=web_acl_arn,
-        )
+def branch_batches(branches):
+    """Split branches into the lists protected by each group of stacks."""
+    return [
+        branches[index : index + MAX_BRANCHES_PER_STACK]
+        for index in range(0, len(branches), MAX_BRANCHES_PER_STACK)
+    ]
 
-        amplify_app_distribution.node.add_dependency(amplify_auth_value)
 
-        self.amplify_app_distribution = amplify_app_distribution
+def validate_branches(branches):
+    """Fail synth on an empty, duplicated or oversized list of branches."""
+    if not branches:
+        raise ValueError("At least one Amplify app branch must be configured")
 
-        # CloudFront cache invalidation Lambda Execution Role
-        cache_invalidation_function_role = iam.Role(
-            self,
-            "rCacheInvalidationFunctionCustomRole",
-            description="Role used by cache_invalidation lambda function",
-            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+    if len(branches) > MAX_BRANCHES_PER_STACK:
+        raise ValueError(
+            f"{len(branches)} branches exceed the {MAX_BRANCHES_PER_STACK} branches a stack can hold, "
+            "split them with branch_batches"
         )
 
-        cache_invalidation_function_role.add_managed_policy(lambda_exec_policy)
+    seen = set()
+    for branch in branches:
+        # Branches share a parameter when their names only differ by the
+        # characters replaced in parameter names
+        key = branch_parameter_path(branch["app_id"], branch["branch_name"])
+        if key in seen:
+            raise ValueError(
+                f"Amplify branch {branch['app_id']}/{branch['branch_name']} is configured more than once"
+            )
+        seen.add(key)
 
-        cache_invalidation_function_custom_policy = iam.ManagedPolicy(
-            self,
-            "rCacheInvalidationFunctionCustomPolicy",
-            statements=[
-                iam.PolicyStatement(
-                    effect=iam.Effect.ALLOW,
-                    actions=[
-                        "cloudfront:CreateInvalidation",
-                    ],
-                    resources=[
-                        f"arn:aws:cloudfront::{Aws.ACCOUNT_ID}:distribution/{amplify_app_distribution.distribution_id}"
-                    ],
-                ),
-            ],
-        )
 
-        cache_invalidation_function_role.add_managed_policy(
-            cache_invalidation_function_custom_policy
-        )
+class CustomAmplifyDistributionStack(Stack):
+    """Edge layer, the custom distributions of the branches and their cache settings.
 
-        # Function to trigger CloudFront invalidation
-        cache_invalidation_function = Function(
-            self,
-            "rCacheInvalidationFunction",
-            description="custom function to trigger cloudfront cache invalidation",  # noqa 501
-            runtime=Runtime.PYTHON_3_9,
-            handler="lambda_function.lambda_handler",
-            code=Code.from_asset(
-                path=os.path.join(dirname, "functions/cache_invalidation")
-            ),
-            timeout=Duration.seconds(30),
-            memory_size=128,
-            role=cache_invalidation_function_role,
-            tracing=Tracing.ACTIVE,
-            log_retention=RetentionDays.SIX_MONTHS,
-            environment={
-                "DISTRIBUTION_ID": amplify_app_distribution.distribution_id,
-            },
-        )
+    Credentials are read from the parameters of the credentials stack, and the
+    distributions are published in a lookup table for the automation and
+    credentials stacks, so that none of them references this stack directly.
+    """
 
-        events.Rule(
-            self,
-            "rInvokeCacheInvalidation",
-            description="Rule is triggered when the Amplify app is redeployed, which creates a CloudFront cache invalidation request",  # noqa E501
-            event_pattern=events.EventPattern(
-                source=["aws.amplify"],
-                detail_type=["Amplify Deployment Status Change"],
-                detail={
-                    "appId": [app_id],
-                    "branchName": [branch_name],
-                    "jobStatus": ["SUCCEED"],
-                },
-            ),
-            targets=[
-                targets.LambdaFunction(cache_invalidation_function, retry_attempts=2)
-            ],
-        )
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        web_acl_arn: str,
+        branches: list,
+        credentials_stack_name: str,
+        cache_behaviors: dict = None,
+        default_cache_tier: str = "default",
+        origin_shield_region: str = None,
+        origin_connection_attempts: int = 3,
+        origin_connection_timeout: int = 5,
+        origin_keepalive_timeout: int = 60,
+        origin_read_timeout: int = 30,
+        error_caching_ttls: dict = None,
+        origin_fallback: dict = None,
+        credentials_rotated: bool = False,
+        cache_key_normalization: dict = None,
+        cloudfront_additional_metrics: bool = False,
+        price_class: str = "PriceClass_All",
+        access_logs: dict = None,
+        staging_distribution: dict = None,
+        **kwargs,
+    ):
+        super().__init__(scope, id, **kwargs)
 
-        CfnOutput(
+        validate_origin_settings(
             self,
-            "oCloudFrontDistributionDomain",
-            value=amplify_app_distribution.distribution_domain_name,
-        )
-
-        # Stack Suppressions
-        NagSuppressions.add_resource_suppressions(
-            amplify_username,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-SMG4",
-                    "reason": "user to retrigger rotation by recreating stack",
-                }
-            ],
-        )
-
-        NagSuppressions.add_resource_suppressions(
-            amplify_password,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-SMG4",
-                    "reason": "user to retrigger rotation by recreating stack",
-                }
-            ],
+            origin_shield_region,
+            origin_connection_attempts=origin_connection_attempts,
+            origin_connection_timeout=origin_connection_timeout,
+            origin_keepalive_timeout=origin_keepalive_timeout,
+            origin_read_timeout=origin_read_timeout,
         )
 
-        NagSuppressions.add_resource_suppressions(
-            amplify_app_distribution,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-CFR1",
-                    "reason": "geo restictions to be enabled using WAF by user",
+        error_caching_ttls = validate_error_caching_ttls(error_caching_ttls or {})
+        if origin_fallback is not None:
+            origin_fallback = validate_origin_fallback(origin_fallback)
+            if (
+                origin_connection_attempts * origin_connection_timeout
+                > MAX_FAILOVER_DELAY
+            ):
+                Annotations.of(self).add_warning(
+                    f"Viewers may wait up to {origin_connection_attempts * origin_connection_timeout} seconds "
+                    "for an unreachable Amplify origin before the fallback origin is tried, "
+                    "lower origin_connection_attempts or origin_connection_timeout"
+                )
+
+        cache_behaviors = cache_behaviors or {}
+        validate_cache_behaviors(cache_behaviors, default_cache_tier)
+        validate_branches(branches)
+        for branch_price_class in {
+            branch.get("price_class", price_class) for branch in branches
+        }:
+            validate_price_class(branch_price_class)
+
+        # Settings of the staging distributions, those of the primary ones with
+        # the staging config applied
+        staging_options = None
+        staging_settings = None
+        if staging_distribution is not None:
+            staging_options = validate_staging_distribution(staging_distribution)
+            staging_config = staging_options["config"]
+            if not staging_config:
+                Annotations.of(self).add_warning(
+                    "The staging distributions have the same settings as the primary ones, "
+                    "set the settings to compare in staging_distribution config"
+                )
+
+            staging_settings = {
+                "cache_behaviors": cache_behaviors,
+                "default_cache_tier": default_cache_tier,
+                "origin_shield_region": origin_shield_region,
+                "origin_connection_attempts": origin_connection_attempts,
+                "origin_connection_timeout": origin_connection_timeout,
+                "origin_keepalive_timeout": origin_keepalive_timeout,
+                "origin_read_timeout": origin_read_timeout,
+                "error_caching_ttls": error_caching_ttls,
+                **{
+                    name: value
+                    for name, value in staging_config.items()
+                    if name != "cache_key_normalization"
                 },
-                {
-                    "id": "AwsSolutions-CFR3",
-                    "reason": "user to override the logging property as required",
+            }
+            validate_origin_settings(
+                self,
+                staging_settings["origin_shield_region"],
+                **{
+                    name: staging_settings[name]
+                    for name in (
+                        "origin_connection_attempts",
+                        "origin_connection_timeout",
+                        "origin_keepalive_timeout",
+                        "origin_read_timeout",
+                    )
                 },
-                {
-                    "id": "AwsSolutions-CFR4",
-                    "reason": "user to override when using a custom domain and certificate",
-                },
-            ],
-        )
-
-        NagSuppressions.add_resource_suppressions(
-            cache_invalidation_function_role,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM4",
-                    "reason": "CDK generated service role and policy",
-                },
-                {
-                    "id": "AwsSolutions-IAM5",
-                    "reason": "CDK generated service role and policy",
-                },
-                {
-                    "id": "AwsSolutions-L1",
-                    "reason": "CDK generated custom resource",
-                },
-            ],
-            apply_to_children=True,
-        )
-
-        NagSuppressions.add_resource_suppressions(
-            password_provider,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM4",
-                    "reason": "CDK generated service role and policy",
-                },
-                {
-                    "id": "AwsSolutions-IAM5",
-                    "reason": "CDK generated service role and policy",
-                },
-                {
-                    "id": "AwsSolutions-L1",
-                    "reason": "CDK generated custom resource",
-                },
-            ],
-            apply_to_children=True,
+            )
+            staging_settings["error_caching_ttls"] = validate_error_caching_ttls(
+                staging_settings["error_caching_ttls"] or {}
+            )
+            staging_settings["cache_behaviors"] = (
+                staging_settings["cache_behaviors"] or {}
+            )
+            validate_cache_behaviors(
+                staging_settings["cache_behaviors"],
+                staging_settings["default_cache_tier"],
+            )
+
+        # Function of the credentials stack reading the Authorization header
+        # of each branch, resolved on every deployment
+        credentials_service_token = ssm.StringParameter.value_for_string_parameter(
+            self, credentials_function_parameter_name(credentials_stack_name)
         )
 
-        NagSuppressions.add_resource_suppressions(
-            amplify_credentials_retrieval_function_role,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM4",
-                    "reason": "CDK generated service role and policy",
-                },
-                {
-                    "id": "AwsSolutions-IAM5",
-                    "reason": "CDK generated service role and policy",
-                },
-            ],
-            apply_to_children=True,
-        )
-
-        NagSuppressions.add_resource_suppressions(
-            amplify_credentials_retrieval_function_role,
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM4",
-                    "reason": "CDK generated service role and policy",
-                },
-                {
-                    "id": "AwsSolutions-IAM5",
-                    "reason": "CDK generated service role and policy",
-                },
-            ],
-            apply_to_children=True,
-        )
-
-        NagSuppressions.add_resource_suppressions_by_path(
+        # Requests for the same content are normalized to the same cache key
+        # before the cache is looked up
+        function_associations = None
+        if cache_key_normalization is not None:
+            function_associations = CacheKeyNormalizationFunction(
+                self, "rCacheKeyNormalization", options=cache_key_normalization
+            ).associations()
+
+        if staging_settings and "cache_key_normalization" in staging_config:
+            # An empty list removes the shared normalization from the staging
+            # behaviors, which otherwise use the primary ones' function
+            staging_settings["function_associations"] = []
+            if staging_config["cache_key_normalization"] is not None:
+                staging_settings["function_associations"] = (
+                    CacheKeyNormalizationFunction(
+                        self,
+                        "rStagingCacheKeyNormalization",
+                        options=staging_config["cache_key_normalization"],
+                    ).associations()
+                )
+
+        # Cache and origin request policies of each cache tier in use, shared
+        # by the primary and staging distributions
+        cache_tiers = CacheTierPolicies(
             self,
-            path=f"/{self.stack_name}/LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole/Resource",
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM4",
-                    "reason": "CDK generated service role and policy",
-                },
-            ],
-        )
-
-        NagSuppressions.add_resource_suppressions_by_path(
-            self,
-            path=f"/{self.stack_name}/LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole/DefaultPolicy/Resource",
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM5",
-                    "reason": "CDK generated service role and policy",
-                },
+            "rCacheTiers",
+            tier_names=[
+                default_cache_tier,
+                *cache_behaviors.values(),
+                *(
+                    [
+                        staging_settings["default_cache_tier"],
+                        *staging_settings["cache_behaviors"].values(),
+                    ]
+                    if staging_settings
+                    else []
+                ),
             ],
+            function_associations=function_associations,
         )
 
-        NagSuppressions.add_resource_suppressions_by_path(
-            self,
-            path=f"/{self.stack_name}/AWS679f53fac002430cb0da5b7982bd2287/ServiceRole/Resource",
-            suppressions=[
-                {
-                    "id": "AwsSolutions-IAM4",
-                    "reason": "CDK generated service role and policy",
-                },
-            ],
-        )
+        # Static copies of the branches served while Amplify fails
+        fallback_bucket = None
+        if origin_fallback is not None:
+            fallback_bucket = OriginFallbackBucket(
+                self, "rOriginFallback", options=origin_fallback
+            )
+
+            CfnOutput(
+                self,
+                "oOriginFallbackBucket",
+                description="Bucket of the static copies served while Amplify fails, one prefix per app id and branch",
+                value=fallback_bucket.bucket.bucket_name,
+            )
+
+        # Standard access logs of every branch, read by the price class analyzer
+        access_logs_bucket = None
+        if access_logs is not None:
+            access_logs_bucket = AccessLogsBucket(
+                self, "rAccessLogs", options=validate_access_logs(access_logs)
+            )
+
+            CfnOutput(
+                self,
+                "oAccessLogsBucket",
+                description="Bucket of the standard access logs, one prefix per app id and branch",
+                value=access_logs_bucket.bucket.bucket_name,
+            )
+
+        self.branch_distributions = [
+            AmplifyBranchDistribution(
+                self,
+                f"{branch['app_id']}-{branch['branch_name'].replace('/', '-')}",
+                app_id=branch["app_id"],
+                branch_name=branch["branch_name"],
+                web_acl_arn=branch.get("web_acl_arn", web_acl_arn),
+                credentials_service_token=credentials_service_token,
+                credentials=ssm.StringParameter.value_for_string_parameter(
+                    self,
+                    credentials_parameter_name(
+                        credentials_stack_name,
+                        branch["app_id"],
+                        branch["branch_name"],
+                    ),
+                ),
+                cache_tiers=cache_tiers,
+                cache_behaviors=cache_behaviors,
+                default_cache_tier=default_cache_tier,
+                origin_shield_region=origin_shield_region,
+                origin_connection_attempts=origin_connection_attempts,
+                origin_connection_timeout=origin_connection_timeout,
+                origin_keepalive_timeout=origin_keepalive_timeout,
+                origin_read_timeout=origin_read_timeout,
+                credentials_version=(
+                    ssm.StringParameter.value_for_string_parameter(
+                        self,
+                        credentials_version_parameter_name(
+                            credentials_stack_name,
+                            branch["app_id"],
+                            branch["branch_name"],
+                        ),
+                    )
+                    if credentials_rotated
+                    else None
+                ),
+                additional_metrics=cloudfront_additional_metrics,
+                error_caching_ttls=error_caching_ttls,
+                origin_fallback=fallback_bucket,
+                price_class=branch.get("price_class", price_class),
+                access_logs=access_logs_bucket,
+                staging_settings=staging_settings,
+                staging_options=staging_options,
+            )
+            for branch in branches
+        ]
 
-        NagSuppressions.add_resource_suppressions_by_path(
+        # Stack Suppressions
+        apply_nag_suppressions(
             self,
-            path=f"/{self.stack_name}/AWS679f53fac002430cb0da5b7982bd2287/Resource",
-            suppressions=[
-                {
-                    "id": "AwsSolutions-L1",
-                    "reason": "CDK generated custom resource",
-                },
+            [
+                *(fallback_bucket.nag_suppressions if fallback_bucket else []),
+                *(access_logs_bucket.nag_suppressions if access_logs_bucket else []),
+                *(
+                    row
+                    for branch in self.branch_distributions
+                    for row in branch.nag_suppressions
+                ),
             ],
         )
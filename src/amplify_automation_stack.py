@@ -0,0 +1,625 @@
+import json
+import os
+
+from aws_cdk import Aws, Duration, RemovalPolicy, Stack
+from aws_cdk import aws_dynamodb as dynamodb
+from aws_cdk import aws_events as events
+from aws_cdk import aws_events_targets as targets
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_sqs as sqs
+from aws_cdk import aws_ssm as ssm
+from aws_cdk.aws_lambda import Code, Function, LayerVersion, Runtime, Tracing
+from aws_cdk.aws_lambda_event_sources import SqsEventSource
+from aws_cdk.aws_logs import RetentionDays
+from constructs import Construct
+
+from src.amplify_add_on_stack import validate_branches
+from src.amplify_branch_distribution import (
+    DISTRIBUTION_STACK_TAG,
+    distribution_parameter_name,
+    distribution_parameter_prefix,
+    staging_distribution_parameter_name,
+)
+from src.monitoring import DistributionMonitoring, validate_alarm_thresholds
+from src.nag_suppressions import (
+    CDK_GENERATED_FUNCTION,
+    CDK_GENERATED_ROLE,
+    apply_nag_suppressions,
+)
+from src.waf_rules import CACHE_WARMER_HEADER, cache_warmer_token_secret_name
+from src.web_acl_stack import WEB_ACL_REGION
+
+dirname = os.path.dirname(__file__)
+
+# Options of the cache warmer and their accepted ranges
+CACHE_WARMER_DEFAULTS = {
+    "paths": ["/"],
+    "sitemap_path": None,
+    "max_urls": 200,
+    "concurrency": 8,
+}
+# Seconds SQS can buffer messages for a function, which receives up to 100
+# messages at once with a batching window and up to 10 without
+MAX_INVALIDATION_BATCHING_WINDOW = 300
+BATCHED_INVALIDATION_BATCH_SIZE = 100
+UNBATCHED_INVALIDATION_BATCH_SIZE = 10
+
+CACHE_WARMER_RANGES = {
+    "max_urls": (1, 1000),
+    "concurrency": (1, 64),
+}
+
+
+def validate_cache_warmer(cache_warmer):
+    """Return the cache warmer options completed with defaults, failing synth on invalid ones."""
+    unknown = set(cache_warmer) - set(CACHE_WARMER_DEFAULTS)
+    if unknown:
+        raise ValueError(
+            f"Unknown cache warmer options {sorted(unknown)}, "
+            f"expected some of {sorted(CACHE_WARMER_DEFAULTS)}"
+        )
+    options = {**CACHE_WARMER_DEFAULTS, **cache_warmer}
+
+    for name, (low, high) in CACHE_WARMER_RANGES.items():
+        if not isinstance(options[name], int) or not low <= options[name] <= high:
+            raise ValueError(
+                f"Cache warmer {name} must be an integer between {low} and {high}"
+            )
+    for path in [*options["paths"], options["sitemap_path"] or "/"]:
+        if not path.startswith("/"):
+            raise ValueError(f"Cache warmer path {path} must start with /")
+
+    return options
+
+
+def validate_invalidation_batching_window(invalidation_batching_window):
+    """Fail synth when the batching window is not a number of seconds SQS accepts."""
+    if (
+        not isinstance(invalidation_batching_window, int)
+        or not 0 <= invalidation_batching_window <= MAX_INVALIDATION_BATCHING_WINDOW
+    ):
+        raise ValueError(
+            "Invalidation batching window must be an integer between 0 and "
+            f"{MAX_INVALIDATION_BATCHING_WINDOW} seconds"
+        )
+
+
+class CustomAmplifyAutomationStack(Stack):
+    """Deploy automation of the branch distributions.
+
+    Invalidates, tracks and warms the caches of the distributions after each
+    Amplify deployment, and monitors them. Distributions are found through the
+    lookup table of the distribution stack, deploying this stack never touches
+    their configuration.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        branches: list,
+        distribution_stack_name: str,
+        manifest_path: str = "/deploy-manifest.json",
+        invalidation_batching_window: int = 120,
+        cache_warmer: dict = None,
+        web_acl_stack_name: str = None,
+        cloudfront_additional_metrics: bool = False,
+        cache_hit_ratio_alarm_threshold: float = None,
+        origin_latency_alarm_threshold: float = None,
+        staging_distributions: bool = False,
+        **kwargs,
+    ):
+        super().__init__(scope, id, **kwargs)
+
+        validate_branches(branches)
+        validate_invalidation_batching_window(invalidation_batching_window)
+        if cache_warmer is not None:
+            cache_warmer = validate_cache_warmer(cache_warmer)
+        validate_alarm_thresholds(
+            cloudfront_additional_metrics,
+            cache_hit_ratio_alarm_threshold,
+            origin_latency_alarm_threshold,
+        )
+
+        # Lookup table used to dispatch deployment events to the right distribution
+        lookup_prefix = distribution_parameter_prefix(distribution_stack_name)
+        # Distributions of the distribution stack, tagged with its name
+        distributions_arn = f"arn:aws:cloudfront::{Aws.ACCOUNT_ID}:distribution/*"
+        distributions_condition = {
+            "StringEquals": {
+                f"aws:ResourceTag/{DISTRIBUTION_STACK_TAG}": distribution_stack_name
+            }
+        }
+
+        # Lambda Baic Execution Permissions
+        lambda_exec_policy = iam.ManagedPolicy.from_managed_policy_arn(
+            self,
+            "lambda-exec-policy-00",
+            managed_policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
+        )
+
+        # Structured logging and embedded metric format metrics of the functions
+        telemetry_layer = LayerVersion(
+            self,
+            "rTelemetryLayer",
+            description="Structured logs and invocation metrics of the functions",
+            code=Code.from_asset(path=os.path.join(dirname, "layers/telemetry")),
+            compatible_runtimes=[Runtime.PYTHON_3_9],
+        )
+
+        # CloudFront cache invalidation Lambda Execution Role
+        cache_invalidation_function_role = iam.Role(
+            self,
+            "rCacheInvalidationFunctionCustomRole",
+            description="Role used by cache_invalidation lambda function",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+        )
+
+        cache_invalidation_function_role.add_managed_policy(lambda_exec_policy)
+
+        cache_invalidation_function_custom_policy = iam.ManagedPolicy(
+            self,
+            "rCacheInvalidationFunctionCustomPolicy",
+            statements=[
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=[
+                        "cloudfront:CreateInvalidation",
+                        "cloudfront:GetDistributionConfig",
+                        "cloudfront:GetInvalidation",
+                        "cloudfront:ListInvalidations",
+                    ],
+                    # Distribution ids are only known to the distribution stack,
+                    # which tags them
+                    resources=[distributions_arn],
+                    conditions=distributions_condition,
+                ),
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["ssm:GetParameter"],
+                    resources=[
+                        f"arn:aws:ssm:{Aws.REGION}:{Aws.ACCOUNT_ID}:parameter{lookup_prefix}/*"
+                    ],
+                ),
+            ],
+        )
+
+        cache_invalidation_function_role.add_managed_policy(
+            cache_invalidation_function_custom_policy
+        )
+
+        # Bucket holding the last invalidated deployment manifest of each branch
+        manifest_bucket = s3.Bucket(
+            self,
+            "rDeploymentManifestBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+        )
+
+        manifest_bucket.grant_read_write(cache_invalidation_function_role)
+
+        # Invalidation paths in progress on each distribution, bounded by the
+        # CloudFront quotas for every invalidation function invocation at once
+        invalidation_slots_table = dynamodb.Table(
+            self,
+            "rInvalidationSlotsTable",
+            partition_key=dynamodb.Attribute(
+                name="DistributionId", type=dynamodb.AttributeType.STRING
+            ),
+            billing_mode=dynamodb.BillingMode.PAY_PER_REQUEST,
+            encryption=dynamodb.TableEncryption.AWS_MANAGED,
+            # Leases are only meaningful to the distributions of the stack
+            removal_policy=RemovalPolicy.DESTROY,
+        )
+        invalidation_slots_table.grant_read_write_data(cache_invalidation_function_role)
+
+        invalidation_slots_layer = LayerVersion(
+            self,
+            "rInvalidationSlotsLayer",
+            description="Invalidation slots semaphore of the invalidation functions",
+            code=Code.from_asset(
+                path=os.path.join(dirname, "layers/invalidation_slots")
+            ),
+            compatible_runtimes=[Runtime.PYTHON_3_9],
+        )
+
+        # Function to trigger CloudFront invalidation
+        cache_invalidation_function = Function(
+            self,
+            "rCacheInvalidationFunction",
+            description="custom function to trigger cloudfront cache invalidation",  # noqa 501
+            runtime=Runtime.PYTHON_3_9,
+            handler="lambda_function.lambda_handler",
+            code=Code.from_asset(
+                path=os.path.join(dirname, "functions/cache_invalidation")
+            ),
+            # A batch holds deployments of up to every branch of the stack,
+            # handled one after the other
+            timeout=Duration.minutes(5),
+            memory_size=128,
+            role=cache_invalidation_function_role,
+            layers=[telemetry_layer, invalidation_slots_layer],
+            tracing=Tracing.ACTIVE,
+            log_retention=RetentionDays.SIX_MONTHS,
+            environment={
+                "DISTRIBUTION_PARAMETER_PREFIX": lookup_prefix,
+                "MANIFEST_BUCKET": manifest_bucket.bucket_name,
+                "MANIFEST_PATH": manifest_path,
+                "INVALIDATION_SLOTS_TABLE": invalidation_slots_table.table_name,
+            },
+        )
+
+        # Queue buffering deployment events so that bursts of deployments of the
+        # same branch are merged into a single invalidation
+        cache_invalidation_dlq = sqs.Queue(
+            self,
+            "rCacheInvalidationDeadLetterQueue",
+            retention_period=Duration.days(14),
+        )
+
+        cache_invalidation_queue = sqs.Queue(
+            self,
+            "rCacheInvalidationQueue",
+            visibility_timeout=Duration.seconds(
+                6 * cache_invalidation_function.timeout.to_seconds()
+                + invalidation_batching_window
+            ),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3, queue=cache_invalidation_dlq
+            ),
+        )
+
+        # Invalidation Tracker Lambda Execution Role
+        invalidation_tracker_function_role = iam.Role(
+            self,
+            "rInvalidationTrackerFunctionRole",
+            description="Role used by invalidation_tracker lambda function",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+        )
+
+        invalidation_tracker_function_role.add_managed_policy(lambda_exec_policy)
+        invalidation_slots_table.grant_read_write_data(
+            invalidation_tracker_function_role
+        )
+        invalidation_tracker_function_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["cloudfront:GetInvalidation"],
+                resources=[distributions_arn],
+                conditions=distributions_condition,
+            )
+        )
+
+        # Function following the invalidations of a deployment until they
+        # complete, re-invoked through delayed messages while they are in progress
+        invalidation_tracker_function = Function(
+            self,
+            "rInvalidationTrackerFunction",
+            description="custom function to track cloudfront invalidations until they complete",
+            runtime=Runtime.PYTHON_3_9,
+            handler="lambda_function.lambda_handler",
+            code=Code.from_asset(
+                path=os.path.join(dirname, "functions/invalidation_tracker")
+            ),
+            timeout=Duration.seconds(60),
+            memory_size=128,
+            role=invalidation_tracker_function_role,
+            layers=[invalidation_slots_layer],
+            tracing=Tracing.ACTIVE,
+            log_retention=RetentionDays.SIX_MONTHS,
+            environment={
+                "STACK_NAME": self.stack_name,
+                "INVALIDATION_SLOTS_TABLE": invalidation_slots_table.table_name,
+            },
+        )
+
+        invalidation_tracking_queue = sqs.Queue(
+            self,
+            "rInvalidationTrackingQueue",
+            visibility_timeout=Duration.seconds(
+                6 * invalidation_tracker_function.timeout.to_seconds()
+            ),
+            dead_letter_queue=sqs.DeadLetterQueue(
+                max_receive_count=3, queue=cache_invalidation_dlq
+            ),
+        )
+
+        invalidation_tracker_function.add_environment(
+            "TRACKING_QUEUE_URL", invalidation_tracking_queue.queue_url
+        )
+        invalidation_tracker_function.add_event_source(
+            SqsEventSource(
+                invalidation_tracking_queue,
+                batch_size=10,
+                report_batch_item_failures=True,
+            )
+        )
+        invalidation_tracking_queue.grant_send_messages(
+            invalidation_tracker_function_role
+        )
+        invalidation_tracking_queue.grant_send_messages(
+            cache_invalidation_function_role
+        )
+        cache_invalidation_function.add_environment(
+            "TRACKING_QUEUE_URL", invalidation_tracking_queue.queue_url
+        )
+
+        queues = [
+            cache_invalidation_queue,
+            cache_invalidation_dlq,
+            invalidation_tracking_queue,
+        ]
+        cache_warmer_nag_suppressions = []
+        if cache_warmer is not None:
+            # Cache warmer Lambda Execution Role
+            cache_warmer_function_role = iam.Role(
+                self,
+                "rCacheWarmerFunctionRole",
+                description="Role used by cache_warmer lambda function",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            )
+
+            cache_warmer_function_role.add_managed_policy(lambda_exec_policy)
+            cache_warmer_function_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["cloudfront:GetDistribution"],
+                    resources=[distributions_arn],
+                    conditions=distributions_condition,
+                )
+            )
+
+            # Messages are sent by the invalidation tracker once the
+            # invalidations of a deployment completed
+            cache_warmer_queue = sqs.Queue(
+                self,
+                "rCacheWarmerQueue",
+                visibility_timeout=Duration.minutes(30),
+                dead_letter_queue=sqs.DeadLetterQueue(
+                    max_receive_count=3, queue=cache_invalidation_dlq
+                ),
+            )
+            queues.append(cache_warmer_queue)
+
+            # Function fetching the hot paths of a branch through its distribution
+            cache_warmer_function = Function(
+                self,
+                "rCacheWarmerFunction",
+                description="custom function to warm the cloudfront cache after an invalidation",
+                runtime=Runtime.PYTHON_3_9,
+                handler="lambda_function.lambda_handler",
+                code=Code.from_asset(
+                    path=os.path.join(dirname, "functions/cache_warmer")
+                ),
+                timeout=Duration.minutes(5),
+                memory_size=256,
+                role=cache_warmer_function_role,
+                tracing=Tracing.ACTIVE,
+                log_retention=RetentionDays.SIX_MONTHS,
+                environment={
+                    "WARM_PATHS": json.dumps(cache_warmer["paths"]),
+                    "WARM_SITEMAP_PATH": cache_warmer["sitemap_path"] or "",
+                    "WARM_MAX_URLS": str(cache_warmer["max_urls"]),
+                    "WARM_CONCURRENCY": str(cache_warmer["concurrency"]),
+                },
+            )
+
+            if web_acl_stack_name:
+                # Token exempting the warmer requests from the web ACL rules,
+                # the secret name is suffixed by Secrets Manager
+                token_secret_name = cache_warmer_token_secret_name(web_acl_stack_name)
+                cache_warmer_function_role.add_to_policy(
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["secretsmanager:GetSecretValue"],
+                        resources=[
+                            f"arn:aws:secretsmanager:{WEB_ACL_REGION}:{Aws.ACCOUNT_ID}:secret:{token_secret_name}-*"
+                        ],
+                    )
+                )
+                cache_warmer_function.add_environment(
+                    "WARM_TOKEN_SECRET_NAME", token_secret_name
+                )
+                cache_warmer_function.add_environment(
+                    "WARM_TOKEN_SECRET_REGION", WEB_ACL_REGION
+                )
+                cache_warmer_function.add_environment(
+                    "WARM_TOKEN_HEADER", CACHE_WARMER_HEADER
+                )
+
+            cache_warmer_function.add_event_source(
+                SqsEventSource(cache_warmer_queue, batch_size=1)
+            )
+            cache_warmer_queue.grant_send_messages(invalidation_tracker_function_role)
+            invalidation_tracker_function.add_environment(
+                "WARM_QUEUE_URL", cache_warmer_queue.queue_url
+            )
+
+            cache_warmer_nag_suppressions = [
+                (
+                    cache_warmer_queue,
+                    {
+                        "AwsSolutions-SQS2": "queue is encrypted with SQS managed keys",
+                    },
+                    False,
+                ),
+                (
+                    cache_warmer_function_role,
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
+                ),
+            ]
+
+        for queue in queues:
+            queue.node.default_child.add_property_override("SqsManagedSseEnabled", True)
+            queue.add_to_resource_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.DENY,
+                    actions=["sqs:*"],
+                    principals=[iam.AnyPrincipal()],
+                    resources=[queue.queue_arn],
+                    conditions={"Bool": {"aws:SecureTransport": "false"}},
+                )
+            )
+
+        # Deployments waiting for invalidation slots are queued again
+        cache_invalidation_queue.grant_send_messages(cache_invalidation_function_role)
+        cache_invalidation_function.add_environment(
+            "INVALIDATION_QUEUE_URL", cache_invalidation_queue.queue_url
+        )
+        cache_invalidation_function.add_event_source(
+            SqsEventSource(
+                cache_invalidation_queue,
+                batch_size=(
+                    BATCHED_INVALIDATION_BATCH_SIZE
+                    if invalidation_batching_window
+                    else UNBATCHED_INVALIDATION_BATCH_SIZE
+                ),
+                max_batching_window=Duration.seconds(invalidation_batching_window),
+                report_batch_item_failures=True,
+            )
+        )
+
+        events.Rule(
+            self,
+            "rInvokeCacheInvalidation",
+            description="Rule is triggered when the Amplify app is redeployed, which creates a CloudFront cache invalidation request",  # noqa E501
+            event_pattern=events.EventPattern(
+                source=["aws.amplify"],
+                detail_type=["Amplify Deployment Status Change"],
+                detail={
+                    "appId": sorted({branch["app_id"] for branch in branches}),
+                    "branchName": sorted(
+                        {branch["branch_name"] for branch in branches}
+                    ),
+                    "jobStatus": ["SUCCEED"],
+                },
+            ),
+            targets=[targets.SqsQueue(cache_invalidation_queue, retry_attempts=2)],
+        )
+
+        monitoring = DistributionMonitoring(
+            self,
+            "rMonitoring",
+            distributions=[
+                (
+                    f"{branch['app_id']}-{branch['branch_name'].replace('/', '-')}",
+                    f"{branch['app_id']}/{branch['branch_name']}",
+                    ssm.StringParameter.value_for_string_parameter(
+                        self,
+                        distribution_parameter_name(
+                            distribution_stack_name,
+                            branch["app_id"],
+                            branch["branch_name"],
+                        ),
+                    ),
+                )
+                for branch in branches
+            ],
+            cache_invalidation_function=cache_invalidation_function,
+            dead_letter_queue=cache_invalidation_dlq,
+            additional_metrics=cloudfront_additional_metrics,
+            cache_hit_ratio_threshold=cache_hit_ratio_alarm_threshold,
+            origin_latency_threshold=origin_latency_alarm_threshold,
+            staging_distributions=(
+                {
+                    f"{branch['app_id']}-{branch['branch_name'].replace('/', '-')}": (
+                        ssm.StringParameter.value_for_string_parameter(
+                            self,
+                            staging_distribution_parameter_name(
+                                distribution_stack_name,
+                                branch["app_id"],
+                                branch["branch_name"],
+                            ),
+                        )
+                    )
+                    for branch in branches
+                }
+                if staging_distributions
+                else None
+            ),
+        )
+
+        # Stack Suppressions
+        apply_nag_suppressions(
+            self,
+            [
+                (
+                    manifest_bucket,
+                    {
+                        "AwsSolutions-S1": "bucket only stores deployment manifests written by the invalidation function",
+                    },
+                    False,
+                ),
+                (
+                    invalidation_slots_table,
+                    {
+                        "AwsSolutions-DDB3": "table only holds leases of invalidations in progress",
+                    },
+                    False,
+                ),
+                (
+                    cache_invalidation_queue,
+                    {
+                        "AwsSolutions-SQS2": "queue is encrypted with SQS managed keys, which EventBridge can write to",
+                    },
+                    False,
+                ),
+                (
+                    cache_invalidation_dlq,
+                    {
+                        "AwsSolutions-SQS2": "queue is encrypted with SQS managed keys, which EventBridge can write to",
+                        "AwsSolutions-SQS3": "queue is the dead letter queue of the cache invalidation, tracking and warmer queues",
+                    },
+                    False,
+                ),
+                (
+                    invalidation_tracking_queue,
+                    {
+                        "AwsSolutions-SQS2": "queue is encrypted with SQS managed keys",
+                    },
+                    False,
+                ),
+                (
+                    invalidation_tracker_function_role,
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
+                ),
+                (
+                    cache_invalidation_function_custom_policy,
+                    {
+                        "AwsSolutions-IAM5": "distributions are restricted to those tagged with their stack, parameters to the lookup table",
+                    },
+                    False,
+                ),
+                (
+                    cache_invalidation_function_role,
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                        "AwsSolutions-L1": CDK_GENERATED_FUNCTION,
+                    },
+                    True,
+                ),
+                (
+                    "LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole",
+                    {"AwsSolutions-IAM4": CDK_GENERATED_ROLE},
+                    False,
+                ),
+                (
+                    "LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole/DefaultPolicy",
+                    {"AwsSolutions-IAM5": CDK_GENERATED_ROLE},
+                    False,
+                ),
+                *cache_warmer_nag_suppressions,
+                *monitoring.nag_suppressions,
+            ],
+        )
@@ -0,0 +1,215 @@
+import json
+import re
+from urllib.parse import quote
+
+from aws_cdk import Aws, CustomResource, Stack, Tags
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_secretsmanager as secrets
+from aws_cdk import aws_ssm as ssm
+from constructs import Construct
+
+# Tag of the credentials secrets naming the stack that owns them
+CREDENTIALS_STACK_TAG = "amplify-waf:stack"
+
+# Characters SSM does not accept in parameter names
+PARAMETER_NAME_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+
+def branch_parameter_path(app_id, branch_name):
+    """Parameter name suffix of a branch, its app id and branch name.
+
+    Slashes of the branch name become dashes, and characters SSM does not
+    accept are replaced by _ followed by their UTF-8 bytes in hex, so that
+    any app id and branch name give a valid parameter name.
+    """
+    return "/".join(
+        PARAMETER_NAME_UNSAFE.sub(
+            lambda match: "".join(f"_{byte:02x}" for byte in match[0].encode()),
+            name,
+        )
+        for name in (app_id, branch_name.replace("/", "-"))
+    )
+
+
+def credentials_parameter_name(stack_name, app_id, branch_name):
+    """Parameter naming the credentials secrets of a branch, read by its distribution."""
+    return f"/amplify-waf/{stack_name}/credentials/{branch_parameter_path(app_id, branch_name)}"
+
+
+def credentials_version_parameter_prefix(stack_name):
+    """Prefix of the parameters holding the rotated credentials versions of a stack."""
+    return f"/amplify-waf/{stack_name}/credentials-versions"
+
+
+def credentials_version_parameter_name(stack_name, app_id, branch_name):
+    """Parameter holding the last rotated secret version of a branch, read by its distribution."""
+    return f"{credentials_version_parameter_prefix(stack_name)}/{branch_parameter_path(app_id, branch_name)}"
+
+
+def credentials_function_parameter_name(stack_name):
+    """Parameter holding the function the distribution stacks read credentials with."""
+    return f"/amplify-waf/{stack_name}/credentials-function-arn"
+
+
+class AmplifyBranchCredentials(Construct):
+    """Basic auth credentials of a protected Amplify app branch.
+
+    Creates the credentials secrets of the branch, enables basic auth on it and
+    publishes the secrets for the distribution stack in a parameter. Functions
+    that apply and rotate the credentials are shared between branches.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        app_id: str,
+        branch_name: str,
+        credentials_service_token: str,
+        credentials_reader_role: iam.IRole,
+        combined_credentials_secret: bool = False,
+        credentials_rotation_function: lambda_.IFunction = None,
+        credentials_rotation_days: int = None,
+    ):
+        super().__init__(scope, id)
+
+        self.app_id = app_id
+        self.branch_name = branch_name
+
+        if combined_credentials_secret:
+            # Username and password in one JSON secret, read with a single call.
+            # The username is fixed, the generated password carries the entropy.
+            amplify_credentials = secrets.Secret(
+                self,
+                "rAmplifyCredentials",
+                description=f"Credentials created for Amplify app with id {app_id}",
+                generate_secret_string=secrets.SecretStringGenerator(
+                    secret_string_template=json.dumps({"username": "amplify"}),
+                    generate_string_key="password",
+                    password_length=32,
+                    exclude_characters=':"\\',
+                ),
+            )
+            credentials_secrets = {"credentials": amplify_credentials}
+            credentials_properties = {
+                "CredentialsSecretArn": amplify_credentials.secret_full_arn,
+            }
+        else:
+            amplify_username = secrets.Secret(
+                self,
+                "rAmplifyUsername",
+                description=f"Username created for Amplify app with id {app_id}",
+                generate_secret_string=secrets.SecretStringGenerator(
+                    password_length=12, exclude_punctuation=True
+                ),
+            )
+
+            amplify_password = secrets.Secret(
+                self,
+                "rAmplifyPassword",
+                description=f"Password created for Amplify app with id {app_id}",
+                generate_secret_string=secrets.SecretStringGenerator(
+                    password_length=32, exclude_characters=":"
+                ),
+            )
+
+            credentials_secrets = {
+                "username": amplify_username,
+                "password": amplify_password,
+            }
+            credentials_properties = {
+                "UsernameSecretArn": amplify_username.secret_full_arn,
+                "PasswordSecretArn": amplify_password.secret_full_arn,
+            }
+
+        # Shared functions are granted access to the secrets through these tags,
+        # which also tell the rotation function what the secret is used for
+        for credential, secret in credentials_secrets.items():
+            Tags.of(secret).add(CREDENTIALS_STACK_TAG, Stack.of(self).stack_name)
+            Tags.of(secret).add("amplify-waf:app-id", app_id)
+            Tags.of(secret).add("amplify-waf:branch-name", branch_name)
+            Tags.of(secret).add("amplify-waf:credential", credential)
+
+        # Secrets read by the distribution of the branch, which only changes
+        # when the secrets are replaced
+        ssm.StringParameter(
+            self,
+            "rCredentialsParameter",
+            description=f"Credentials secrets of {app_id}/{branch_name}",
+            parameter_name=credentials_parameter_name(
+                Stack.of(self).stack_name, app_id, branch_name
+            ),
+            string_value=Stack.of(self).to_json_string(credentials_properties),
+        )
+
+        if credentials_rotation_function:
+            # Overwritten with the new secret version by the rotation function,
+            # the distribution reads the credentials again when it changes so
+            # that its template keeps the credentials in use
+            ssm.StringParameter(
+                self,
+                "rCredentialsVersionParameter",
+                description=f"Last rotated credentials version of {app_id}/{branch_name}",
+                parameter_name=credentials_version_parameter_name(
+                    Stack.of(self).stack_name, app_id, branch_name
+                ),
+                string_value="created",
+            )
+
+        # Reads the credentials and enables basic auth on the branch with them,
+        # in a single invocation of the shared function
+        branch_credentials = CustomResource(
+            self,
+            "rBranchCredentials",
+            service_token=credentials_service_token,
+            resource_type="Custom::AmplifyBranchCredentials",
+            properties={
+                "AppId": app_id,
+                "BranchName": branch_name,
+                **credentials_properties,
+            },
+        )
+
+        # Secrets and branch must be accessible before the shared function is invoked
+        branch_credentials.node.add_dependency(credentials_reader_role)
+
+        self.credentials_secrets = list(credentials_secrets.values())
+        self.branch_arn = f"arn:aws:amplify:{Aws.REGION}:{Aws.ACCOUNT_ID}:apps/{app_id}/branches/{quote(branch_name, safe='')}"
+
+        # Only the password is rotated, the username never changes so that two
+        # rotations never update the credentials of the branch at once
+        rotated_secrets = {
+            credential: secret
+            for credential, secret in credentials_secrets.items()
+            if credentials_rotation_function and credential != "username"
+        }
+        if credentials_rotation_function:
+            for credential, secret in rotated_secrets.items():
+                # The L2 rotation schedule grants the function access to each
+                # secret in its role policy, access is granted by tag instead.
+                # Rotation must not start before the branch uses the secrets.
+                rotation_schedule = secrets.CfnRotationSchedule(
+                    self,
+                    f"rRotationSchedule-{credential}",
+                    secret_id=secret.secret_arn,
+                    rotation_lambda_arn=credentials_rotation_function.function_arn,
+                    rotation_rules=secrets.CfnRotationSchedule.RotationRulesProperty(
+                        automatically_after_days=credentials_rotation_days
+                    ),
+                    rotate_immediately_on_update=False,
+                )
+                rotation_schedule.node.add_dependency(
+                    credentials_rotation_function, branch_credentials
+                )
+
+        # Branch Suppressions, applied together with the stack ones
+        self.nag_suppressions = [
+            (
+                secret,
+                {"AwsSolutions-SMG4": "user to retrigger rotation by recreating stack"},
+                False,
+            )
+            for credential, secret in credentials_secrets.items()
+            if credential not in rotated_secrets
+        ]
@@ -0,0 +1,315 @@
+import aws_cdk.aws_cloudfront as cloudfront
+import aws_cdk.aws_cloudfront_origins as origins
+from aws_cdk import CfnOutput, CfnResource, CustomResource, Duration, Stack, Tags
+from aws_cdk import aws_ssm as ssm
+from constructs import Construct
+
+from src.access_logs import AccessLogsBucket
+from src.amplify_branch_credentials import branch_parameter_path
+from src.cache_tiers import CACHE_TIERS, CacheTierPolicies
+from src.continuous_deployment import ContinuousDeployment
+from src.origin_failover import (
+    FALLBACK_PATH_PREFIX,
+    OriginFallbackBucket,
+    error_responses,
+)
+
+# Price classes accepted for the distributions, from the cheapest edge locations
+# only to every edge location
+PRICE_CLASSES = {
+    "PriceClass_100": cloudfront.PriceClass.PRICE_CLASS_100,
+    "PriceClass_200": cloudfront.PriceClass.PRICE_CLASS_200,
+    "PriceClass_All": cloudfront.PriceClass.PRICE_CLASS_ALL,
+}
+
+# Tag of the distributions naming the stack that owns them, the rotation
+# function of the credentials stack may only update these
+DISTRIBUTION_STACK_TAG = "amplify-waf:stack"
+
+
+def distribution_parameter_prefix(stack_name):
+    """Prefix of the lookup table of the distributions of a stack."""
+    return f"/amplify-waf/{stack_name}/distributions"
+
+
+def distribution_parameter_name(stack_name, app_id, branch_name):
+    """Lookup table entry holding the distribution id of a branch."""
+    return f"{distribution_parameter_prefix(stack_name)}/{branch_parameter_path(app_id, branch_name)}"
+
+
+def staging_distribution_parameter_prefix(stack_name):
+    """Prefix of the lookup table of the staging distributions of a stack."""
+    return f"/amplify-waf/{stack_name}/staging-distributions"
+
+
+def staging_distribution_parameter_name(stack_name, app_id, branch_name):
+    """Lookup table entry holding the staging distribution id of a branch."""
+    return f"{staging_distribution_parameter_prefix(stack_name)}/{branch_parameter_path(app_id, branch_name)}"
+
+
+class AmplifyBranchDistribution(Construct):
+    """Resources that differ for each protected Amplify app branch.
+
+    Places a custom CloudFront distribution in front of the branch, sending
+    the basic auth credentials of the credentials stack to it. The credentials
+    function and the cache policies are shared between branches. With
+    staging_settings, a staging distribution with these settings receives the
+    slice of the traffic selected by staging_options.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        app_id: str,
+        branch_name: str,
+        web_acl_arn: str,
+        credentials_service_token: str,
+        credentials: str,
+        cache_tiers: CacheTierPolicies,
+        cache_behaviors: dict,
+        default_cache_tier: str,
+        origin_shield_region: str,
+        origin_connection_attempts: int,
+        origin_connection_timeout: int,
+        origin_keepalive_timeout: int,
+        origin_read_timeout: int,
+        credentials_version: str = None,
+        additional_metrics: bool = False,
+        error_caching_ttls: dict = None,
+        origin_fallback: OriginFallbackBucket = None,
+        price_class: str = "PriceClass_All",
+        access_logs: AccessLogsBucket = None,
+        staging_settings: dict = None,
+        staging_options: dict = None,
+    ):
+        super().__init__(scope, id)
+
+        self.app_id = app_id
+        self.branch_name = branch_name
+
+        credentials_properties = {"Credentials": credentials}
+        if credentials_version is not None:
+            # Rotated credentials are applied in place by the rotation function,
+            # they are read again when it publishes a new version so that the
+            # template keeps the credentials in use
+            credentials_properties["CredentialsVersion"] = credentials_version
+
+        # Reads the Authorization header of the branch from the secrets named
+        # by the credentials stack, without touching the branch itself
+        amplify_auth_value = CustomResource(
+            self,
+            "rOriginAuthorization",
+            service_token=credentials_service_token,
+            resource_type="Custom::AmplifyOriginAuthorization",
+            properties={
+                "AppId": app_id,
+                "BranchName": branch_name,
+                **credentials_properties,
+            },
+        )
+
+        # Format amplify branch
+        formatted_amplify_branch = branch_name.replace("/", "-")
+
+        def distribution(construct_id, comment, settings, log_prefix=""):
+            """Distribution of the branch with the given cache and origin settings."""
+            amplify_origin = origins.HttpOrigin(
+                domain_name=f"{formatted_amplify_branch}.{app_id}.amplifyapp.com",
+                custom_headers={
+                    "Authorization": amplify_auth_value.get_att_string("EncodedSuffix")
+                },
+                # Origin Shield collapses concurrent misses from all edges into one fetch
+                origin_shield_region=settings["origin_shield_region"],
+                connection_attempts=settings["origin_connection_attempts"],
+                connection_timeout=Duration.seconds(
+                    settings["origin_connection_timeout"]
+                ),
+                keepalive_timeout=Duration.seconds(
+                    settings["origin_keepalive_timeout"]
+                ),
+                read_timeout=Duration.seconds(settings["origin_read_timeout"]),
+            )
+
+            tier_origins = {}
+            fallback_behaviors = {}
+            if origin_fallback:
+                # Static copy of the branch served when Amplify fails, origin groups
+                # only route GET, HEAD and OPTIONS requests
+                fallback_origin = origin_fallback.origin(app_id, branch_name)
+                failover_origin = origin_fallback.failover_origin(
+                    amplify_origin, fallback_origin
+                )
+                tier_origins = {
+                    tier_name: failover_origin
+                    for tier_name, tier in CACHE_TIERS.items()
+                    if not tier["allow_all_methods"]
+                }
+                fallback_behaviors[f"{FALLBACK_PATH_PREFIX}*"] = (
+                    cloudfront.BehaviorOptions(
+                        origin=fallback_origin,
+                        cache_policy=cloudfront.CachePolicy.CACHING_OPTIMIZED,
+                        compress=True,
+                        viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+                    )
+                )
+
+            def behavior_options(tier_name):
+                return cache_tiers.behavior_options(
+                    tier_name,
+                    tier_origins.get(tier_name, amplify_origin),
+                    settings.get("function_associations"),
+                )
+
+            branch_distribution = cloudfront.Distribution(
+                self,
+                construct_id,
+                comment=comment,
+                default_behavior=behavior_options(settings["default_cache_tier"]),
+                additional_behaviors={
+                    **fallback_behaviors,
+                    **{
+                        path_pattern: behavior_options(tier_name)
+                        for path_pattern, tier_name in settings[
+                            "cache_behaviors"
+                        ].items()
+                    },
+                },
+                error_responses=error_responses(
+                    settings["error_caching_ttls"] or {},
+                    fallback_status_codes=(
+                        origin_fallback.status_codes if origin_fallback else ()
+                    ),
+                    error_page_path=(
+                        origin_fallback.error_page_path if origin_fallback else None
+                    ),
+                ),
+                price_class=PRICE_CLASSES[price_class],
+                web_acl_id=web_acl_arn,
+                **(
+                    access_logs.logging_options(app_id, branch_name, log_prefix)
+                    if access_logs
+                    else {}
+                ),
+            )
+            Tags.of(branch_distribution).add(
+                DISTRIBUTION_STACK_TAG, Stack.of(self).stack_name
+            )
+            return branch_distribution
+
+        # Define cloudfront distribution
+        amplify_app_distribution = distribution(
+            "rCustomCloudFrontDistribution",
+            f"{app_id}/{branch_name}",
+            {
+                "cache_behaviors": cache_behaviors,
+                "default_cache_tier": default_cache_tier,
+                "origin_shield_region": origin_shield_region,
+                "origin_connection_attempts": origin_connection_attempts,
+                "origin_connection_timeout": origin_connection_timeout,
+                "origin_keepalive_timeout": origin_keepalive_timeout,
+                "origin_read_timeout": origin_read_timeout,
+                "error_caching_ttls": error_caching_ttls,
+            },
+        )
+
+        amplify_app_distribution.node.add_dependency(amplify_auth_value)
+
+        self.amplify_app_distribution = amplify_app_distribution
+
+        CfnOutput(
+            self,
+            "oCloudFrontDistributionDomain",
+            description=f"Custom CloudFront distribution of {app_id}/{branch_name}",
+            value=amplify_app_distribution.distribution_domain_name,
+        )
+
+        # Lookup table entry of the cache invalidation and rotation functions and
+        # of the monitoring of the automation stack
+        ssm.StringParameter(
+            self,
+            "rDistributionIdParameter",
+            description=f"Custom CloudFront distribution of {app_id}/{branch_name}",
+            parameter_name=distribution_parameter_name(
+                Stack.of(self).stack_name, app_id, branch_name
+            ),
+            string_value=amplify_app_distribution.distribution_id,
+        )
+
+        distributions = [("rMonitoringSubscription", amplify_app_distribution)]
+
+        self.staging_distribution = None
+        if staging_settings is not None:
+            # Same origin and credentials as the primary distribution, CloudFront
+            # only serves it through the primary one's domain name
+            staging_distribution = distribution(
+                "rStagingCloudFrontDistribution",
+                f"{app_id}/{branch_name} staging",
+                staging_settings,
+                log_prefix="staging/",
+            )
+            staging_distribution.node.add_dependency(amplify_auth_value)
+
+            ContinuousDeployment(
+                self,
+                "rContinuousDeployment",
+                primary_distribution=amplify_app_distribution,
+                staging_distribution=staging_distribution,
+                options=staging_options,
+            )
+
+            self.staging_distribution = staging_distribution
+
+            # Lookup table entry of the promotion tool, the rotation function
+            # and the comparison widgets of the automation stack
+            ssm.StringParameter(
+                self,
+                "rStagingDistributionIdParameter",
+                description=f"Staging CloudFront distribution of {app_id}/{branch_name}",
+                parameter_name=staging_distribution_parameter_name(
+                    Stack.of(self).stack_name, app_id, branch_name
+                ),
+                string_value=staging_distribution.distribution_id,
+            )
+
+            distributions.append(
+                ("rStagingMonitoringSubscription", staging_distribution)
+            )
+
+        if additional_metrics:
+            # Cache hit rate, origin latency and error rates per status code,
+            # CloudFormation has no L2 construct for the subscription
+            for subscription_id, subscribed_distribution in distributions:
+                CfnResource(
+                    self,
+                    subscription_id,
+                    type="AWS::CloudFront::MonitoringSubscription",
+                    properties={
+                        "DistributionId": subscribed_distribution.distribution_id,
+                        "MonitoringSubscription": {
+                            "RealtimeMetricsSubscriptionConfig": {
+                                "RealtimeMetricsSubscriptionStatus": "Enabled"
+                            }
+                        },
+                    },
+                )
+
+        # Branch Suppressions, applied together with the stack ones
+        self.nag_suppressions = [
+            (
+                suppressed_distribution,
+                {
+                    "AwsSolutions-CFR1": "geo restictions to be enabled using WAF by user",
+                    **(
+                        {}
+                        if access_logs
+                        else {
+                            "AwsSolutions-CFR3": "user to enable access_logs as required"
+                        }
+                    ),
+                    "AwsSolutions-CFR4": "user to override when using a custom domain and certificate",
+                },
+                False,
+            )
+            for _, suppressed_distribution in distributions
+        ]
@@ -0,0 +1,319 @@
+import os
+
+from aws_cdk import Aws, Duration, Stack
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_ssm as ssm
+from aws_cdk.aws_lambda import Code, Function, LayerVersion, Runtime, Tracing
+from aws_cdk.aws_logs import RetentionDays
+from constructs import Construct
+
+from src.amplify_add_on_stack import validate_branches
+from src.amplify_branch_credentials import (
+    CREDENTIALS_STACK_TAG,
+    AmplifyBranchCredentials,
+    credentials_function_parameter_name,
+    credentials_version_parameter_prefix,
+)
+from src.amplify_branch_distribution import (
+    DISTRIBUTION_STACK_TAG,
+    distribution_parameter_prefix,
+    staging_distribution_parameter_prefix,
+)
+from src.nag_suppressions import CDK_GENERATED_ROLE, apply_nag_suppressions
+
+dirname = os.path.dirname(__file__)
+
+
+class CustomAmplifyCredentialsStack(Stack):
+    """Basic auth credentials of the branches, deployed before their distributions.
+
+    The secrets and the function reading them are published in parameters,
+    which the distribution stack resolves on each deployment. The credentials
+    stack only changes with the branches or the credentials settings.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        branches: list,
+        distribution_stack_name: str,
+        combined_credentials_secret: bool = False,
+        credentials_rotation_days: int = None,
+        **kwargs,
+    ):
+        super().__init__(scope, id, **kwargs)
+
+        validate_branches(branches)
+
+        # Lambda Baic Execution Permissions
+        lambda_exec_policy = iam.ManagedPolicy.from_managed_policy_arn(
+            self,
+            "lambda-exec-policy-00",
+            managed_policy_arn="arn:aws:iam::aws:policy/service-role/AWSLambdaBasicExecutionRole",
+        )
+
+        # Amplify Credential Retrieval Lambda Execution Role
+        amplify_credentials_retrieval_function_role = iam.Role(
+            self,
+            "rAmplifyCredentialsRetrievalFunctionRole",
+            description="Role used by amplify_credentials_retrieval_function lambda function",
+            assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+        )
+
+        amplify_credentials_retrieval_function_role.add_managed_policy(
+            lambda_exec_policy
+        )
+
+        # Structured logging and embedded metric format metrics of the functions
+        telemetry_layer = LayerVersion(
+            self,
+            "rTelemetryLayer",
+            description="Structured logs and invocation metrics of the functions",
+            code=Code.from_asset(path=os.path.join(dirname, "layers/telemetry")),
+            compatible_runtimes=[Runtime.PYTHON_3_9],
+        )
+
+        # Custom resource function reading the credentials of a branch and
+        # enabling basic auth on it, invoked by CloudFormation directly. The
+        # distribution stack invokes it too, to read the credentials only.
+        amplify_credentials_retrieval_function = Function(
+            self,
+            "rAmplifyCredentialsRetrievalFunction",
+            description="custom function to read amplify auth secrets and apply them to the branch",  # noqa 501
+            runtime=Runtime.PYTHON_3_9,
+            handler="lambda_function.lambda_handler",
+            code=Code.from_asset(
+                path=os.path.join(dirname, "functions/password_retrieval")
+            ),
+            timeout=Duration.seconds(30),
+            memory_size=128,
+            role=amplify_credentials_retrieval_function_role,
+            layers=[telemetry_layer],
+            tracing=Tracing.ACTIVE,
+            log_retention=RetentionDays.SIX_MONTHS,
+        )
+
+        ssm.StringParameter(
+            self,
+            "rCredentialsFunctionParameter",
+            description="Custom resource function reading the credentials of the branches",
+            parameter_name=credentials_function_parameter_name(self.stack_name),
+            string_value=amplify_credentials_retrieval_function.function_arn,
+        )
+
+        # Credentials secrets of the stack are found by tag, a statement per
+        # secret would exceed the role policy size limit with many branches
+        credentials_secrets_arn = (
+            f"arn:aws:secretsmanager:{Aws.REGION}:{Aws.ACCOUNT_ID}:secret:*"
+        )
+        credentials_secrets_condition = {
+            "StringEquals": {
+                f"secretsmanager:ResourceTag/{CREDENTIALS_STACK_TAG}": self.stack_name
+            }
+        }
+
+        amplify_credentials_retrieval_function_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=[
+                    "secretsmanager:DescribeSecret",
+                    "secretsmanager:GetSecretValue",
+                ],
+                resources=[credentials_secrets_arn],
+                conditions=credentials_secrets_condition,
+            )
+        )
+
+        credentials_rotation_function = None
+        credentials_rotation_nag_suppressions = []
+        if credentials_rotation_days:
+            # Lookup table of the distributions the rotated credentials are sent by
+            lookup_prefix = distribution_parameter_prefix(distribution_stack_name)
+            staging_lookup_prefix = staging_distribution_parameter_prefix(
+                distribution_stack_name
+            )
+            # Versions of the rotated credentials read by the distribution stack
+            version_prefix = credentials_version_parameter_prefix(self.stack_name)
+
+            # Credentials Rotation Lambda Execution Role
+            credentials_rotation_function_role = iam.Role(
+                self,
+                "rCredentialsRotationFunctionRole",
+                description="Role used by credentials_rotation lambda function",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+            )
+
+            credentials_rotation_function_role.add_managed_policy(lambda_exec_policy)
+
+            credentials_rotation_function_custom_policy = iam.ManagedPolicy(
+                self,
+                "rCredentialsRotationFunctionCustomPolicy",
+                statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=[
+                            "secretsmanager:DescribeSecret",
+                            "secretsmanager:GetSecretValue",
+                            "secretsmanager:PutSecretValue",
+                            "secretsmanager:UpdateSecretVersionStage",
+                        ],
+                        resources=[credentials_secrets_arn],
+                        conditions=credentials_secrets_condition,
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["secretsmanager:GetRandomPassword"],
+                        resources=["*"],
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=[
+                            "cloudfront:GetDistributionConfig",
+                            "cloudfront:UpdateDistribution",
+                        ],
+                        resources=[
+                            f"arn:aws:cloudfront::{Aws.ACCOUNT_ID}:distribution/*"
+                        ],
+                        # Distribution ids are only known to the distribution
+                        # stack, deployed after this one, which tags them
+                        conditions={
+                            "StringEquals": {
+                                f"aws:ResourceTag/{DISTRIBUTION_STACK_TAG}": distribution_stack_name
+                            }
+                        },
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["amplify:UpdateBranch"],
+                        resources=[
+                            f"arn:aws:amplify:{Aws.REGION}:{Aws.ACCOUNT_ID}:apps/{app_id}/branches/*"
+                            for app_id in sorted(
+                                {branch["app_id"] for branch in branches}
+                            )
+                        ],
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["ssm:GetParameter"],
+                        resources=[
+                            f"arn:aws:ssm:{Aws.REGION}:{Aws.ACCOUNT_ID}:parameter{prefix}/*"
+                            for prefix in (lookup_prefix, staging_lookup_prefix)
+                        ],
+                    ),
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=["ssm:PutParameter"],
+                        resources=[
+                            f"arn:aws:ssm:{Aws.REGION}:{Aws.ACCOUNT_ID}:parameter{version_prefix}/*"
+                        ],
+                    ),
+                ],
+            )
+
+            credentials_rotation_function_role.add_managed_policy(
+                credentials_rotation_function_custom_policy
+            )
+
+            # Function rotating the credentials of a branch in place
+            credentials_rotation_function = Function(
+                self,
+                "rCredentialsRotationFunction",
+                description="custom function to rotate amplify basic auth credentials",
+                runtime=Runtime.PYTHON_3_9,
+                handler="lambda_function.lambda_handler",
+                code=Code.from_asset(
+                    path=os.path.join(dirname, "functions/credentials_rotation")
+                ),
+                timeout=Duration.minutes(3),
+                memory_size=128,
+                role=credentials_rotation_function_role,
+                tracing=Tracing.ACTIVE,
+                log_retention=RetentionDays.SIX_MONTHS,
+                environment={
+                    "DISTRIBUTION_PARAMETER_PREFIX": lookup_prefix,
+                    "STAGING_DISTRIBUTION_PARAMETER_PREFIX": staging_lookup_prefix,
+                    "CREDENTIALS_VERSION_PARAMETER_PREFIX": version_prefix,
+                },
+            )
+
+            credentials_rotation_function.add_permission(
+                "rSecretsManagerInvoke",
+                principal=iam.ServicePrincipal("secretsmanager.amazonaws.com"),
+                source_account=Aws.ACCOUNT_ID,
+            )
+
+            credentials_rotation_nag_suppressions = [
+                (
+                    credentials_rotation_function_custom_policy,
+                    {
+                        "AwsSolutions-IAM5": "secrets and distributions are restricted to those tagged with their stack, "
+                        "parameters to the lookup tables and credentials versions, GetRandomPassword has no resource",
+                    },
+                    False,
+                ),
+                (
+                    credentials_rotation_function_role,
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
+                ),
+            ]
+
+        # Same construct ids as the branch distributions, one per branch
+        self.branch_credentials = [
+            AmplifyBranchCredentials(
+                self,
+                f"{branch['app_id']}-{branch['branch_name'].replace('/', '-')}",
+                app_id=branch["app_id"],
+                branch_name=branch["branch_name"],
+                credentials_service_token=amplify_credentials_retrieval_function.function_arn,
+                credentials_reader_role=amplify_credentials_retrieval_function_role,
+                combined_credentials_secret=combined_credentials_secret,
+                credentials_rotation_function=credentials_rotation_function,
+                credentials_rotation_days=credentials_rotation_days,
+            )
+            for branch in branches
+        ]
+
+        # Branches of the stack whose basic auth is set by the credentials function
+        amplify_credentials_retrieval_function_role.add_to_policy(
+            iam.PolicyStatement(
+                effect=iam.Effect.ALLOW,
+                actions=["amplify:GetBranch", "amplify:UpdateBranch"],
+                resources=[branch.branch_arn for branch in self.branch_credentials],
+            )
+        )
+
+        # Stack Suppressions
+        apply_nag_suppressions(
+            self,
+            [
+                (
+                    amplify_credentials_retrieval_function_role,
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
+                ),
+                (
+                    "LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole",
+                    {"AwsSolutions-IAM4": CDK_GENERATED_ROLE},
+                    False,
+                ),
+                (
+                    "LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole/DefaultPolicy",
+                    {"AwsSolutions-IAM5": CDK_GENERATED_ROLE},
+                    False,
+                ),
+                *credentials_rotation_nag_suppressions,
+                *(
+                    row
+                    for branch in self.branch_credentials
+                    for row in branch.nag_suppressions
+                ),
+            ],
+        )
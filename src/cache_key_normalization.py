@@ -0,0 +1,89 @@
+import json
+import os
+
+import aws_cdk.aws_cloudfront as cloudfront
+from constructs import Construct
+
+FUNCTION_PATH = os.path.join(
+    os.path.dirname(__file__), "functions", "cache_key_normalization", "index.js"
+)
+
+# Options of the cache key normalization function, strip_query_params entries
+# ending with * match every query parameter starting with them
+DEFAULT_CACHE_KEY_NORMALIZATION = {
+    "strip_query_params": ["utm_*", "fbclid", "gclid", "msclkid", "_ga", "_gl"],
+    "sort_query_params": True,
+    "index_document": "index.html",
+    "trailing_slash": None,
+}
+TRAILING_SLASH_OPTIONS = (None, "add", "remove")
+
+# CloudFront Functions code size limit in bytes
+FUNCTION_CODE_LIMIT = 10240
+
+
+def normalization_options(options):
+    """Options of the function, defaults completed with the configured ones."""
+    unknown = set(options) - set(DEFAULT_CACHE_KEY_NORMALIZATION)
+    if unknown:
+        raise ValueError(
+            f"Unknown cache key normalization options {sorted(unknown)}, "
+            f"expected some of {sorted(DEFAULT_CACHE_KEY_NORMALIZATION)}"
+        )
+    options = {**DEFAULT_CACHE_KEY_NORMALIZATION, **options}
+
+    if options["trailing_slash"] not in TRAILING_SLASH_OPTIONS:
+        raise ValueError(
+            f"Unknown trailing_slash option '{options['trailing_slash']}', "
+            f"expected one of {list(TRAILING_SLASH_OPTIONS)}"
+        )
+    if options["index_document"] and "/" in options["index_document"]:
+        raise ValueError("index_document is a file name, without /")
+
+    # Query parameters are matched case insensitively
+    options["strip_query_params"] = [
+        name.lower() for name in options["strip_query_params"]
+    ]
+    return options
+
+
+def function_code(options):
+    """Code of the function, with its options rendered in."""
+    with open(FUNCTION_PATH) as f:
+        code = f.read().replace(
+            "__CONFIG__", json.dumps(normalization_options(options), sort_keys=True)
+        )
+
+    if len(code.encode("utf-8")) > FUNCTION_CODE_LIMIT:
+        raise ValueError(
+            f"Cache key normalization function is larger than {FUNCTION_CODE_LIMIT} bytes, "
+            "shorten strip_query_params"
+        )
+    return code
+
+
+class CacheKeyNormalizationFunction(Construct):
+    """Viewer request function shared by the behaviors of every branch distribution.
+
+    Strips tracking query parameters, sorts the remaining ones and normalizes
+    index documents and trailing slashes, so that requests for the same content
+    share a cache entry.
+    """
+
+    def __init__(self, scope: Construct, id: str, options: dict):
+        super().__init__(scope, id)
+
+        self.function = cloudfront.Function(
+            self,
+            "rFunction",
+            comment="Normalizes the cache key of Amplify distribution requests",
+            code=cloudfront.FunctionCode.from_inline(function_code(options)),
+        )
+
+    def associations(self):
+        return [
+            cloudfront.FunctionAssociation(
+                function=self.function,
+                event_type=cloudfront.FunctionEventType.VIEWER_REQUEST,
+            )
+        ]
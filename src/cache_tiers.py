@@ -0,0 +1,184 @@
+import aws_cdk.aws_cloudfront as cloudfront
+from aws_cdk import Duration
+from constructs import Construct
+
+# Headers CloudFront must never take from the viewer, the Authorization header
+# sent to Amplify is set as a custom origin header
+RESERVED_HEADERS = {"authorization", "host"}
+
+# Cache tiers available to the distribution behaviors.
+# TTLs are in seconds, forwarded values are sent to Amplify without being part
+# of the cache key.
+CACHE_TIERS = {
+    # Same TTLs as the CloudFront CachingOptimized managed policy
+    "default": {
+        "min_ttl": 1,
+        "default_ttl": 86400,
+        "max_ttl": 31536000,
+        "cache_query_strings": False,
+        "forward_query_strings": False,
+        "forward_cookies": False,
+        "forward_headers": [],
+        "allow_all_methods": False,
+    },
+    # Content-hashed assets, the URL changes whenever the content does
+    "immutable": {
+        "min_ttl": 31536000,
+        "default_ttl": 31536000,
+        "max_ttl": 31536000,
+        "cache_query_strings": False,
+        "forward_query_strings": False,
+        "forward_cookies": False,
+        "forward_headers": [],
+        "allow_all_methods": False,
+    },
+    # Documents served under stable URLs. The short TTL bounds staleness while the
+    # long max TTL keeps expired copies at the edge, so that the
+    # stale-while-revalidate and stale-if-error directives sent by Amplify apply.
+    "html": {
+        "min_ttl": 0,
+        "default_ttl": 60,
+        "max_ttl": 86400,
+        "cache_query_strings": False,
+        "forward_query_strings": False,
+        "forward_cookies": False,
+        "forward_headers": [],
+        "allow_all_methods": False,
+    },
+    # Documents whose content depends on the query string, such as search
+    # results or paginated lists, cached once per query string with the TTLs of
+    # the html tier. Stripping and sorting query parameters with the cache key
+    # normalization function merges their cache keys.
+    "query": {
+        "min_ttl": 0,
+        "default_ttl": 60,
+        "max_ttl": 86400,
+        "cache_query_strings": True,
+        "forward_query_strings": False,
+        "forward_cookies": False,
+        "forward_headers": [],
+        "allow_all_methods": False,
+    },
+    # API-like paths, never cached and forwarded with the viewer's request details
+    "dynamic": {
+        "min_ttl": 0,
+        "default_ttl": 0,
+        "max_ttl": 0,
+        "cache_query_strings": False,
+        "forward_query_strings": True,
+        "forward_cookies": True,
+        "forward_headers": [
+            "Accept",
+            "Accept-Language",
+            "Content-Type",
+            "Origin",
+            "Referer",
+        ],
+        "allow_all_methods": True,
+    },
+}
+
+
+def validate_cache_behaviors(cache_behaviors, default_cache_tier):
+    """Fail synth when a behavior references an unknown or unsafe cache tier."""
+    for path_pattern, tier_name in {
+        "default": default_cache_tier,
+        **cache_behaviors,
+    }.items():
+        if tier_name not in CACHE_TIERS:
+            raise ValueError(
+                f"Unknown cache tier '{tier_name}' for path pattern '{path_pattern}', "
+                f"expected one of {sorted(CACHE_TIERS)}"
+            )
+
+    for tier_name, tier in CACHE_TIERS.items():
+        reserved = RESERVED_HEADERS.intersection(
+            header.lower() for header in tier["forward_headers"]
+        )
+        if reserved:
+            raise ValueError(
+                f"Cache tier '{tier_name}' must not forward viewer headers {sorted(reserved)}"
+            )
+
+
+class CacheTierPolicies(Construct):
+    """Cache and origin request policies for the cache tiers in use.
+
+    function_associations are added to the behaviors of every tier.
+    """
+
+    def __init__(
+        self, scope: Construct, id: str, tier_names, function_associations=None
+    ):
+        super().__init__(scope, id)
+
+        self.function_associations = function_associations
+
+        self.cache_policies = {}
+        self.origin_request_policies = {}
+
+        for tier_name in sorted(set(tier_names)):
+            tier = CACHE_TIERS[tier_name]
+            caching_enabled = tier["max_ttl"] > 0
+
+            self.cache_policies[tier_name] = cloudfront.CachePolicy(
+                self,
+                f"rCachePolicy-{tier_name}",
+                comment=f"Amplify distribution {tier_name} cache tier",
+                min_ttl=Duration.seconds(tier["min_ttl"]),
+                default_ttl=Duration.seconds(tier["default_ttl"]),
+                max_ttl=Duration.seconds(tier["max_ttl"]),
+                query_string_behavior=(
+                    cloudfront.CacheQueryStringBehavior.all()
+                    if tier["cache_query_strings"]
+                    else cloudfront.CacheQueryStringBehavior.none()
+                ),
+                header_behavior=cloudfront.CacheHeaderBehavior.none(),
+                cookie_behavior=cloudfront.CacheCookieBehavior.none(),
+                # CloudFront rejects compression settings on policies with caching disabled
+                enable_accept_encoding_brotli=caching_enabled,
+                enable_accept_encoding_gzip=caching_enabled,
+            )
+
+            self.origin_request_policies[tier_name] = cloudfront.OriginRequestPolicy(
+                self,
+                f"rOriginRequestPolicy-{tier_name}",
+                comment=f"Amplify distribution {tier_name} cache tier",
+                query_string_behavior=(
+                    cloudfront.OriginRequestQueryStringBehavior.all()
+                    if tier["forward_query_strings"]
+                    else cloudfront.OriginRequestQueryStringBehavior.none()
+                ),
+                cookie_behavior=(
+                    cloudfront.OriginRequestCookieBehavior.all()
+                    if tier["forward_cookies"]
+                    else cloudfront.OriginRequestCookieBehavior.none()
+                ),
+                header_behavior=(
+                    cloudfront.OriginRequestHeaderBehavior.allow_list(
+                        *tier["forward_headers"]
+                    )
+                    if tier["forward_headers"]
+                    else cloudfront.OriginRequestHeaderBehavior.none()
+                ),
+            )
+
+    def behavior_options(self, tier_name, origin, function_associations=None):
+        """Behavior of a tier, function_associations replace the shared ones when given."""
+        return cloudfront.BehaviorOptions(
+            origin=origin,
+            cache_policy=self.cache_policies[tier_name],
+            origin_request_policy=self.origin_request_policies[tier_name],
+            compress=True,
+            function_associations=(
+                self.function_associations
+                if function_associations is None
+                else function_associations
+            ),
+            allowed_methods=(
+                cloudfront.AllowedMethods.ALLOW_ALL
+                if CACHE_TIERS[tier_name]["allow_all_methods"]
+                else cloudfront.AllowedMethods.ALLOW_GET_HEAD
+            ),
+            viewer_protocol_policy=cloudfront.ViewerProtocolPolicy.REDIRECT_TO_HTTPS,
+        )
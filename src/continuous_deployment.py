@@ -0,0 +1,134 @@
+import aws_cdk.aws_cloudfront as cloudfront
+from aws_cdk import CfnResource
+from constructs import Construct
+
+# Options of the staging distribution, config holds the distribution settings
+# that differ from the primary distribution's
+STAGING_DISTRIBUTION_DEFAULTS = {
+    "weight": 0.05,
+    "header": None,
+    "header_value": "true",
+    "session_stickiness": True,
+    "config": {},
+}
+# Settings the staging distribution can try, named as the context values
+STAGING_CONFIG_KEYS = {
+    "cache_behaviors",
+    "default_cache_tier",
+    "cache_key_normalization",
+    "origin_shield_region",
+    "origin_connection_attempts",
+    "origin_connection_timeout",
+    "origin_keepalive_timeout",
+    "origin_read_timeout",
+    "error_caching_ttls",
+}
+# Settings the staging distribution can turn off with false, CDK drops null
+# values nested in context objects
+STAGING_DISABLEABLE_KEYS = {"cache_key_normalization", "origin_shield_region"}
+# CloudFront sends at most 15% of the requests to a staging distribution, and
+# only selects it by a header whose name starts with aws-cf-cd-
+MAX_STAGING_WEIGHT = 0.15
+STAGING_HEADER_PREFIX = "aws-cf-cd-"
+# Seconds a viewer keeps being served by the same distribution
+SESSION_IDLE_TTL = 300
+SESSION_MAXIMUM_TTL = 600
+
+
+def validate_staging_distribution(staging_distribution):
+    """Return the staging distribution options completed with defaults, failing synth on invalid ones."""
+    unknown = set(staging_distribution) - set(STAGING_DISTRIBUTION_DEFAULTS)
+    if unknown:
+        raise ValueError(
+            f"Unknown staging distribution options {sorted(unknown)}, "
+            f"expected some of {sorted(STAGING_DISTRIBUTION_DEFAULTS)}"
+        )
+    options = {**STAGING_DISTRIBUTION_DEFAULTS, **staging_distribution}
+
+    unknown = set(options["config"]) - STAGING_CONFIG_KEYS
+    if unknown:
+        raise ValueError(
+            f"Staging distribution config cannot set {sorted(unknown)}, "
+            f"expected some of {sorted(STAGING_CONFIG_KEYS)}"
+        )
+
+    options["config"] = {
+        name: None if value is False and name in STAGING_DISABLEABLE_KEYS else value
+        for name, value in options["config"].items()
+    }
+
+    header = options["header"]
+    if header is not None:
+        if not header.lower().startswith(STAGING_HEADER_PREFIX):
+            raise ValueError(
+                f"Staging distribution header {header} must start with {STAGING_HEADER_PREFIX}"
+            )
+    elif (
+        not isinstance(options["weight"], (int, float))
+        or not 0 < options["weight"] <= MAX_STAGING_WEIGHT
+    ):
+        raise ValueError(
+            f"Staging distribution weight must be above 0 and at most {MAX_STAGING_WEIGHT}"
+        )
+    return options
+
+
+def traffic_config(options):
+    """Traffic configuration of the continuous deployment policy."""
+    if options["header"] is not None:
+        return {
+            "Type": "SingleHeader",
+            "SingleHeaderConfig": {
+                "Header": options["header"],
+                "Value": options["header_value"],
+            },
+        }
+
+    weight_config = {"Weight": options["weight"]}
+    if options["session_stickiness"]:
+        weight_config["SessionStickinessConfig"] = {
+            "IdleTTL": SESSION_IDLE_TTL,
+            "MaximumTTL": SESSION_MAXIMUM_TTL,
+        }
+    return {"Type": "SingleWeight", "SingleWeightConfig": weight_config}
+
+
+class ContinuousDeployment(Construct):
+    """Continuous deployment policy sending a slice of the primary distribution's traffic to a staging one.
+
+    CloudFormation has no L2 construct for the policy, and the staging flag
+    and policy id are set on the distributions as property overrides.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        primary_distribution: cloudfront.Distribution,
+        staging_distribution: cloudfront.Distribution,
+        options: dict,
+    ):
+        super().__init__(scope, id)
+
+        staging_distribution.node.default_child.add_property_override(
+            "DistributionConfig.Staging", True
+        )
+
+        self.policy = CfnResource(
+            self,
+            "rPolicy",
+            type="AWS::CloudFront::ContinuousDeploymentPolicy",
+            properties={
+                "ContinuousDeploymentPolicyConfig": {
+                    "Enabled": True,
+                    "StagingDistributionDnsNames": [
+                        staging_distribution.distribution_domain_name
+                    ],
+                    "TrafficConfig": traffic_config(options),
+                }
+            },
+        )
+
+        primary_distribution.node.default_child.add_property_override(
+            "DistributionConfig.ContinuousDeploymentPolicyId", self.policy.ref
+        )
@@ -0,0 +1,89 @@
+import re
+from collections import defaultdict
+from urllib.parse import quote
+
+WILDCARD_PATH = "/*"
+INDEX_DOCUMENT = "index.html"
+
+# Assets whose file name embeds a content hash (e.g. main.3f2a9c1b.js) or that
+# live under a build tool's hashed output directory never change in place.
+DEFAULT_IMMUTABLE_PATH_PATTERN = (
+    r"(^/_next/static/|^/_nuxt/|[.-][0-9a-f]{8,}\.[a-z0-9]+$)"  # noqa E501
+)
+
+
+def changed_paths(previous_manifest, current_manifest, immutable_pattern=None):
+    """Return the URL paths affected by the difference between two manifests.
+
+    Manifests map file paths to content hashes. Added, removed and modified
+    files are all reported, since CloudFront may hold a cached copy or a cached
+    error response for any of them. Paths matching immutable_pattern are skipped.
+    """
+    pattern = (
+        re.compile(immutable_pattern, re.IGNORECASE) if immutable_pattern else None
+    )
+    paths = set()
+
+    for path in previous_manifest.keys() | current_manifest.keys():
+        if previous_manifest.get(path) == current_manifest.get(path):
+            continue
+
+        path = "/" + path.lstrip("/")
+        if pattern and pattern.search(path):
+            continue
+
+        paths.add(path)
+        paths.update(_index_aliases(path))
+
+    return paths
+
+
+def _index_aliases(path):
+    # Amplify serves /docs/index.html for /docs/ and /docs as well
+    prefix, _, name = path.rpartition("/")
+    if name != INDEX_DOCUMENT:
+        return []
+
+    if not prefix:
+        return ["/"]
+
+    return [f"{prefix}/", prefix]
+
+
+def collapse_paths(paths, threshold):
+    """Replace groups of at least threshold sibling paths with a wildcard."""
+    siblings = defaultdict(list)
+    for path in paths:
+        parent = path[: path.rstrip("/").rfind("/") + 1]
+        siblings[parent].append(path)
+
+    collapsed = set()
+    for parent, children in siblings.items():
+        # Collapsing the root would be a full invalidation, which is decided separately
+        if parent != "/" and len(children) >= threshold:
+            collapsed.add(f"{parent}*")
+        else:
+            collapsed.update(children)
+
+    wildcards = sorted(p[:-1] for p in collapsed if p.endswith("*"))
+    return sorted(
+        p
+        for p in collapsed
+        if not any(p != f"{w}*" and p.startswith(w) for w in wildcards)
+    )
+
+
+def plan_batches(paths, max_paths, max_wildcards, batch_size):
+    """Split paths into invalidation batches, falling back to a full invalidation.
+
+    Returns a list of path lists, one per CreateInvalidation request.
+    """
+    if not paths:
+        return []
+
+    wildcard_count = sum(1 for path in paths if path.endswith("*"))
+    if len(paths) > max_paths or wildcard_count > max_wildcards:
+        return [[WILDCARD_PATH]]
+
+    encoded = [quote(path, safe="/*-._~") for path in paths]
+    return [encoded[i : i + batch_size] for i in range(0, len(encoded), batch_size)]
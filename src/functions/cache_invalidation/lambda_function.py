@@ -1,24 +1,433 @@
+import hashlib
+import json
 import os
-import uuid
+import random
+import re
+import urllib.request
+from collections import defaultdict
+from datetime import datetime
 
-import boto3
+import invalidation_slots
+import telemetry
 from botocore.exceptions import ClientError
+from invalidation_paths import (
+    DEFAULT_IMMUTABLE_PATH_PATTERN,
+    WILDCARD_PATH,
+    changed_paths,
+    collapse_paths,
+    plan_batches,
+)
 
-# Setup the client
-service_client = boto3.client("cloudfront")
+# Setup the clients, calls are timed by the telemetry layer
+service_client = telemetry.client("cloudfront")
+dynamodb_client = telemetry.client("dynamodb")
+s3_client = telemetry.client("s3")
+sqs_client = telemetry.client("sqs")
+ssm_client = telemetry.client("ssm")
 
+AMPLIFY_ORIGIN_SUFFIX = ".amplifyapp.com"
 
+# Characters SSM does not accept in parameter names
+PARAMETER_NAME_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+# Distribution ids already read from the lookup table parameters
+distribution_ids = {}
+
+# Deployments waiting for invalidation slots are queued again after 15s, 30s,
+# 1 min ... up to the 15 minutes SQS allows, each delay jittered so that
+# throttled deployments do not all retry at once
+REQUEUE_FIRST_DELAY = 15
+REQUEUE_MAX_DELAY = 900
+MAX_REQUEUES = 12
+
+# Time a branch can take in the worst case, mostly the 10 seconds the deployed
+# manifest fetch may wait for a slow origin. Branches left when less time
+# remains are returned as failures and retried, without repeating the others.
+BRANCH_TIME_RESERVE_MS = 30000
+
+
+class SlotsUnavailable(Exception):
+    """The distribution has too many invalidation paths in progress."""
+
+
+class AmplifyOriginNotFound(Exception):
+    """The distribution has no Amplify origin to fetch the manifest from."""
+
+
+@telemetry.instrument
 def lambda_handler(event, context):
+    # Records are Amplify deployment events buffered by the invalidation queue,
+    # only the latest deployment of each branch needs to be reflected in the cache
+    message_ids = defaultdict(list)
+    deployment_events = []
+    for record in event["Records"]:
+        deployment_event = json.loads(record["body"])
+        message_ids[_branch_key(deployment_event)].append(record["messageId"])
+        deployment_events.append(deployment_event)
+
+    failures = []
+    deployments = latest_deployments(deployment_events)
+    for index, deployment in enumerate(deployments):
+        if context.get_remaining_time_in_millis() < BRANCH_TIME_RESERVE_MS:
+            telemetry.log(
+                "Function about to time out, leaving branches to a retry",
+                level="WARNING",
+                branches=len(deployments) - index,
+            )
+            for unhandled in deployments[index:]:
+                failures.extend(message_ids[_branch_key(unhandled)])
+            break
+
+        distribution_id = lookup_distribution_id(
+            deployment["detail"]["appId"], deployment["detail"]["branchName"]
+        )
+        if distribution_id is None:
+            # The rule matches app ids and branch names independently
+            telemetry.log(
+                "No distribution configured for the branch, skipping",
+                level="WARNING",
+                app_id=deployment["detail"]["appId"],
+                branch_name=deployment["detail"]["branchName"],
+            )
+            continue
+
+        try:
+            invalidate_deployment(distribution_id, deployment)
+        except SlotsUnavailable as e:
+            attempt = deployment.get("requeue_attempt", 0) + 1
+            if attempt > MAX_REQUEUES:
+                telemetry.log(
+                    "Invalidation slots still unavailable, giving up",
+                    level="ERROR",
+                    app_id=deployment["detail"]["appId"],
+                    branch_name=deployment["detail"]["branchName"],
+                    error=str(e),
+                )
+                failures.extend(message_ids[_branch_key(deployment)])
+                continue
+            requeue(deployment, attempt, str(e))
+        except ClientError as e:
+            # The events of the branch are retried, then sent to the dead
+            # letter queue, without failing the other branches of the batch
+            telemetry.log(
+                "Invalidation failed",
+                level="ERROR",
+                app_id=deployment["detail"]["appId"],
+                branch_name=deployment["detail"]["branchName"],
+                error=e.response["Error"]["Message"],
+            )
+            failures.extend(message_ids[_branch_key(deployment)])
+        except AmplifyOriginNotFound as e:
+            telemetry.log(
+                "Invalidation failed",
+                level="ERROR",
+                app_id=deployment["detail"]["appId"],
+                branch_name=deployment["detail"]["branchName"],
+                error=str(e),
+            )
+            failures.extend(message_ids[_branch_key(deployment)])
+
+    return {
+        "batchItemFailures": [{"itemIdentifier": message_id} for message_id in failures]
+    }
+
+
+def requeue(deployment, attempt, reason):
+    """Queue the deployment again once slots may be available.
+
+    The events of the batch are then deleted, the invalidations already
+    submitted are found in progress when the deployment comes back.
+    """
+    delay = min(REQUEUE_MAX_DELAY, REQUEUE_FIRST_DELAY * 2 ** (attempt - 1))
+    delay = int(random.uniform(delay / 2, delay))  # nosec B311
+    sqs_client.send_message(
+        QueueUrl=os.environ["INVALIDATION_QUEUE_URL"],
+        MessageBody=json.dumps({**deployment, "requeue_attempt": attempt}),
+        DelaySeconds=delay,
+    )
+    telemetry.log(
+        "Invalidation slots unavailable, deployment queued again",
+        level="WARNING",
+        app_id=deployment["detail"]["appId"],
+        branch_name=deployment["detail"]["branchName"],
+        attempt=attempt,
+        delay=delay,
+        reason=reason,
+    )
+
+
+def lookup_distribution_id(app_id, branch_name):
+    """Return the distribution of a branch, or None if it is not protected."""
+    name = (
+        f"{os.environ['DISTRIBUTION_PARAMETER_PREFIX']}/"
+        f"{branch_parameter_path(app_id, branch_name)}"
+    )
+    if name not in distribution_ids:
+        try:
+            distribution_ids[name] = ssm_client.get_parameter(Name=name)["Parameter"][
+                "Value"
+            ]
+        except ssm_client.exceptions.ParameterNotFound:
+            # Misses are not cached, the distribution of the branch may be
+            # deployed while the function is warm
+            return None
+
+    return distribution_ids[name]
+
+
+def branch_parameter_path(app_id, branch_name):
+    """Parameter name suffix of a branch, encoded as by the stacks."""
+    return "/".join(
+        PARAMETER_NAME_UNSAFE.sub(
+            lambda match: "".join(f"_{byte:02x}" for byte in match[0].encode()),
+            name,
+        )
+        for name in (app_id, branch_name.replace("/", "-"))
+    )
+
+
+def _branch_key(deployment_event):
+    return (
+        deployment_event["detail"]["appId"],
+        deployment_event["detail"]["branchName"],
+    )
+
+
+def latest_deployments(deployment_events):
+    """Merge deployment events, keeping the most recent one per app and branch."""
+    latest = {}
+    for deployment_event in deployment_events:
+        key = _branch_key(deployment_event)
+        if key not in latest or deployment_event["time"] > latest[key]["time"]:
+            latest[key] = deployment_event
+
+    return list(latest.values())
+
+
+def invalidate_deployment(distribution_id, deployment):
+    detail = deployment["detail"]
+    manifest_key = f"{detail['appId']}/{detail['branchName']}.json"
+    deployed_at = datetime.fromisoformat(deployment["time"].replace("Z", "+00:00"))
+
+    current_manifest = fetch_deployed_manifest(distribution_id)
+    previous_manifest = load_manifest(manifest_key)
+
+    if current_manifest is None or previous_manifest is None:
+        paths = [WILDCARD_PATH]
+    else:
+        paths = collapse_paths(
+            changed_paths(
+                previous_manifest,
+                current_manifest,
+                os.environ.get(
+                    "IMMUTABLE_PATH_PATTERN", DEFAULT_IMMUTABLE_PATH_PATTERN
+                ),
+            ),
+            int(os.environ.get("COLLAPSE_THRESHOLD", "10")),
+        )
+
+    batches = plan_batches(
+        paths,
+        max_paths=int(os.environ.get("MAX_INVALIDATION_PATHS", "3000")),
+        max_wildcards=int(os.environ.get("MAX_WILDCARD_PATHS", "15")),
+        batch_size=int(os.environ.get("INVALIDATION_BATCH_SIZE", "1000")),
+    )
+    pending = in_progress_invalidations(distribution_id, deployed_at)
+
+    # Invalidations after which the cache reflects the deployment
+    invalidation_ids = []
+    submitted = 0
+    for batch in batches:
+        covering = [
+            invalidation_id
+            for invalidation_id, paths in pending.items()
+            if _covers(paths, batch)
+        ]
+        if covering:
+            telemetry.log(
+                "Skipping paths already being invalidated",
+                paths=len(batch),
+                invalidation_id=covering[0],
+            )
+            invalidation_ids.append(covering[0])
+            continue
+
+        invalidation_ids.append(
+            create_invalidation(
+                distribution_id, batch, _caller_reference(deployment, batch)
+            )
+        )
+        submitted += 1
+
+    telemetry.log(
+        "Submitted cache invalidation requests",
+        app_id=detail["appId"],
+        branch_name=detail["branchName"],
+        job_id=detail.get("jobId"),
+        submitted=submitted,
+        paths=sum(len(batch) for batch in batches),
+    )
+
+    # Only remember the manifest once the cache reflects it
+    if current_manifest is not None:
+        save_manifest(manifest_key, current_manifest)
+
+    track_invalidations(distribution_id, deployment, sorted(set(invalidation_ids)))
+
+
+def track_invalidations(distribution_id, deployment, invalidation_ids):
+    """Ask the invalidation tracker to follow the invalidations until they complete."""
+    sqs_client.send_message(
+        QueueUrl=os.environ["TRACKING_QUEUE_URL"],
+        MessageBody=json.dumps(
+            {
+                "distribution_id": distribution_id,
+                "invalidation_ids": invalidation_ids,
+                "app_id": deployment["detail"]["appId"],
+                "branch_name": deployment["detail"]["branchName"],
+                "job_id": deployment["detail"].get("jobId"),
+                "deployed_at": deployment["time"],
+                "attempt": 0,
+            }
+        ),
+        DelaySeconds=int(os.environ.get("TRACKING_FIRST_DELAY", "15")),
+    )
+
+
+def create_invalidation(distribution_id, batch, caller_reference):
+    """Submit a batch once it holds invalidation slots, returning its invalidation id.
+
+    The invalidation tracker returns the slots once the invalidation completed.
+    """
+    table_name = os.environ["INVALIDATION_SLOTS_TABLE"]
+    if not invalidation_slots.acquire(
+        dynamodb_client,
+        table_name,
+        distribution_id,
+        caller_reference,
+        batch,
+        max_wildcards=int(os.environ.get("MAX_WILDCARD_PATHS", "15")),
+        max_paths=int(os.environ.get("MAX_INVALIDATION_PATHS", "3000")),
+    ):
+        raise SlotsUnavailable(f"{len(batch)} paths wait for slots")
 
     try:
-        service_client.create_invalidation(
-            DistributionId=os.environ["DISTRIBUTION_ID"],
+        response = service_client.create_invalidation(
+            DistributionId=distribution_id,
             InvalidationBatch={
-                "Paths": {"Quantity": 1, "Items": ["/*"]},
-                "CallerReference": str(uuid.uuid4()),
+                "Paths": {"Quantity": len(batch), "Items": batch},
+                "CallerReference": caller_reference,
             },
         )
-
-        print("Cache invalidation request submitted successfully")
     except ClientError as e:
-        print(e.response["Error"]["Message"])
+        invalidation_slots.release(
+            dynamodb_client,
+            table_name,
+            distribution_id,
+            caller_reference,
+            *invalidation_slots.weights(batch),
+        )
+        # Invalidations submitted without slots, e.g. from the console, fill
+        # the quota too
+        if e.response["Error"]["Code"] == "TooManyInvalidationsInProgress":
+            raise SlotsUnavailable(e.response["Error"]["Message"]) from e
+        raise
+
+    return response["Invalidation"]["Id"]
+
+
+def in_progress_invalidations(distribution_id, since):
+    """Return the paths of the invalidations in progress created after since, by id.
+
+    Invalidations created before the deployment finished may let edges re-cache
+    the previous version, so they never count as equivalent.
+    """
+    summaries = service_client.list_invalidations(DistributionId=distribution_id)[
+        "InvalidationList"
+    ].get("Items", [])
+
+    return {
+        summary["Id"]: set(
+            service_client.get_invalidation(
+                DistributionId=distribution_id, Id=summary["Id"]
+            )["Invalidation"]["InvalidationBatch"]["Paths"].get("Items", [])
+        )
+        for summary in summaries
+        if summary["Status"] == "InProgress" and summary["CreateTime"] >= since
+    }
+
+
+def _covers(pending_paths, batch):
+    return WILDCARD_PATH in pending_paths or pending_paths.issuperset(batch)
+
+
+def _caller_reference(deployment, batch):
+    # Deterministic so that a retried batch of events does not create a duplicate
+    digest = hashlib.sha256()
+    digest.update(deployment["id"].encode("utf-8"))
+    for path in batch:
+        digest.update(path.encode("utf-8"))
+    return digest.hexdigest()
+
+
+def fetch_deployed_manifest(distribution_id):
+    """Download the deployment manifest published by the Amplify build.
+
+    The request is sent straight to the Amplify origin with the same custom
+    headers CloudFront uses, so it is neither cached nor blocked by basic auth.
+    Returns None when the manifest cannot be retrieved, and raises
+    AmplifyOriginNotFound when the distribution has no Amplify origin.
+    """
+    config = service_client.get_distribution_config(Id=distribution_id)[
+        "DistributionConfig"
+    ]
+    origin = next(
+        (
+            item
+            for item in config["Origins"]["Items"]
+            if item["DomainName"].endswith(AMPLIFY_ORIGIN_SUFFIX)
+        ),
+        None,
+    )
+    if origin is None:
+        raise AmplifyOriginNotFound(
+            f"Distribution {distribution_id} has no {AMPLIFY_ORIGIN_SUFFIX} origin"
+        )
+    headers = {
+        header["HeaderName"]: header["HeaderValue"]
+        for header in origin.get("CustomHeaders", {}).get("Items", [])
+    }
+
+    request = urllib.request.Request(
+        f"https://{origin['DomainName']}{os.environ['MANIFEST_PATH']}",
+        headers=headers,
+    )
+
+    try:
+        with urllib.request.urlopen(request, timeout=10) as response:  # nosec B310
+            return json.load(response)
+    except (OSError, ValueError) as e:
+        telemetry.log(
+            "Deployment manifest unavailable, invalidating everything",
+            level="WARNING",
+            error=str(e),
+        )
+        return None
+
+
+def load_manifest(key):
+    try:
+        response = s3_client.get_object(Bucket=os.environ["MANIFEST_BUCKET"], Key=key)
+    except s3_client.exceptions.NoSuchKey:
+        return None
+
+    return json.load(response["Body"])
+
+
+def save_manifest(key, manifest):
+    s3_client.put_object(
+        Bucket=os.environ["MANIFEST_BUCKET"],
+        Key=key,
+        Body=json.dumps(manifest).encode("utf-8"),
+        ContentType="application/json",
+    )
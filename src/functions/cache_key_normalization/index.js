@@ -0,0 +1,56 @@
+// Viewer request function normalizing the requests that make up the cache key.
+// CloudFront Functions run ECMAScript 5.1, the configuration is rendered into
+// CONFIG by src/cache_key_normalization.py.
+var CONFIG = __CONFIG__;
+
+function isStripped(name) {
+    var lowerName = name.toLowerCase();
+    for (var i = 0; i < CONFIG.strip_query_params.length; i++) {
+        var pattern = CONFIG.strip_query_params[i];
+        if (pattern.charAt(pattern.length - 1) === '*') {
+            if (lowerName.indexOf(pattern.slice(0, -1)) === 0) {
+                return true;
+            }
+        } else if (lowerName === pattern) {
+            return true;
+        }
+    }
+    return false;
+}
+
+function normalizeQuerystring(querystring) {
+    var names = Object.keys(querystring).filter(function (name) {
+        return !isStripped(name);
+    });
+    if (CONFIG.sort_query_params) {
+        names.sort();
+    }
+
+    var normalized = {};
+    names.forEach(function (name) {
+        normalized[name] = querystring[name];
+    });
+    return normalized;
+}
+
+function normalizeUri(uri) {
+    var index = CONFIG.index_document;
+    if (index && uri.slice(-index.length - 1) === '/' + index) {
+        uri = uri.slice(0, -index.length);
+    }
+
+    var lastSegment = uri.slice(uri.lastIndexOf('/') + 1);
+    if (CONFIG.trailing_slash === 'add' && lastSegment && lastSegment.indexOf('.') < 0) {
+        uri = uri + '/';
+    } else if (CONFIG.trailing_slash === 'remove' && uri.length > 1 && !lastSegment) {
+        uri = uri.slice(0, -1);
+    }
+    return uri;
+}
+
+function handler(event) {
+    var request = event.request;
+    request.uri = normalizeUri(request.uri);
+    request.querystring = normalizeQuerystring(request.querystring);
+    return request;
+}
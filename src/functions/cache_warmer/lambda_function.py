@@ -0,0 +1,89 @@
+import json
+import os
+import urllib.request
+
+import boto3
+from botocore.exceptions import ClientError
+from warmer import WARM_HEADERS, sitemap_paths, summarize, warm
+
+# Setup the clients
+service_client = boto3.client("cloudfront")
+
+
+def lambda_handler(event, context):
+    # Records are sent by the invalidation tracker once the invalidations of a
+    # deployment completed
+    for record in event["Records"]:
+        message = json.loads(record["body"])
+        distribution_id = message["distribution_id"]
+
+        domain_name = service_client.get_distribution(Id=distribution_id)[
+            "Distribution"
+        ]["DomainName"]
+        base_url = f"https://{domain_name}"
+        headers = warm_headers()
+        results = warm(
+            base_url,
+            warm_paths(base_url, headers),
+            concurrency=int(os.environ.get("WARM_CONCURRENCY", "8")),
+            timeout=int(os.environ.get("WARM_TIMEOUT", "10")),
+            retries=int(os.environ.get("WARM_RETRIES", "2")),
+            headers=headers,
+        )
+
+        for result in results:
+            print(
+                f"Warmed {result['url']} status {result['status']} in "
+                f"{1000 * result['seconds']:.0f} ms after {result['attempts']} attempt(s)"
+            )
+        summary = summarize(results)
+        print(
+            f"Warmed {message['app_id']}/{message['branch_name']}: "
+            f"{json.dumps(summary)}"
+        )
+        if summary["blocked"]:
+            print(
+                f"{summary['blocked']} warm requests were refused with a 403, "
+                "check that the web ACL of the distribution allows the cache warmer"
+            )
+
+
+def warm_headers():
+    """Header exempting the warm requests from the web ACL, none without its token."""
+    secret_name = os.environ.get("WARM_TOKEN_SECRET_NAME")
+    if not secret_name:
+        return {}
+
+    # The token is kept in the region of the web ACL, read on each message so
+    # that a recreated secret is picked up
+    secrets_client = boto3.client(
+        "secretsmanager", region_name=os.environ["WARM_TOKEN_SECRET_REGION"]
+    )
+    try:
+        token = secrets_client.get_secret_value(SecretId=secret_name)["SecretString"]
+    except ClientError as e:
+        if e.response["Error"]["Code"] != "ResourceNotFoundException":
+            raise
+        print(f"Secret {secret_name} not found, warming without the web ACL token")
+        return {}
+    return {os.environ["WARM_TOKEN_HEADER"]: token}
+
+
+def warm_paths(base_url, headers):
+    """Hot paths followed by the paths of the sitemap, up to WARM_MAX_URLS."""
+    paths = json.loads(os.environ.get("WARM_PATHS", '["/"]'))
+
+    sitemap_path = os.environ.get("WARM_SITEMAP_PATH")
+    if sitemap_path:
+        try:
+            request = urllib.request.Request(
+                base_url + sitemap_path, headers={**WARM_HEADERS, **headers}
+            )
+            with urllib.request.urlopen(request, timeout=10) as response:  # nosec B310
+                paths.extend(sitemap_paths(response.read()))
+        except OSError as e:
+            print(
+                f"Sitemap {sitemap_path} unavailable, warming the hot paths only: {e}"
+            )
+
+    return list(dict.fromkeys(paths))[: int(os.environ.get("WARM_MAX_URLS", "200"))]
@@ -0,0 +1,101 @@
+import re
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit
+
+# Compressed variants are cached separately, the warmer requests the one most
+# browsers accept
+WARM_HEADERS = {
+    "Accept-Encoding": "br, gzip",
+    "User-Agent": "amplify-waf-cache-warmer",
+}
+
+SITEMAP_LOC = re.compile(rb"<loc>\s*([^<\s]+)\s*</loc>")
+
+
+def sitemap_paths(sitemap):
+    """Return the paths of the URLs listed in a sitemap document.
+
+    Sitemaps usually name the custom domain of the app, only the paths are
+    kept so that they are requested through the distribution.
+    """
+    paths = []
+    for match in SITEMAP_LOC.finditer(sitemap):
+        url = urlsplit(match.group(1).decode("utf-8", "replace").replace("&amp;", "&"))
+        paths.append((url.path or "/") + (f"?{url.query}" if url.query else ""))
+    return paths
+
+
+def fetch(url, timeout, retries, backoff=0.5, headers=None):
+    """Request a URL, retrying server errors and timeouts.
+
+    Returns a dict with the url, the final status (None when no response was
+    received), the number of attempts and the duration of the last attempt.
+    """
+    request = urllib.request.Request(url, headers={**WARM_HEADERS, **(headers or {})})
+    for attempt in range(1, retries + 2):
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(
+                request, timeout=timeout
+            ) as response:  # nosec B310
+                # The object is only cached once its whole body was sent
+                while response.read(65536):
+                    pass
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except OSError as e:
+            print(f"Fetching {url} failed: {e}")
+            status = None
+        elapsed = time.perf_counter() - started
+
+        # Client errors other than throttling are not worth retrying
+        if status is not None and status < 500 and status != 429:
+            break
+        if attempt <= retries:
+            time.sleep(backoff * 2 ** (attempt - 1))
+
+    return {"url": url, "status": status, "attempts": attempt, "seconds": elapsed}
+
+
+def warm(base_url, paths, concurrency=8, timeout=10, retries=2, headers=None):
+    """Fetch each path once through base_url, concurrency requests at a time."""
+    urls = [base_url.rstrip("/") + path for path in dict.fromkeys(paths)]
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        return list(
+            executor.map(
+                lambda url: fetch(url, timeout, retries, headers=headers), urls
+            )
+        )
+
+
+def percentile(values, fraction):
+    """Nearest-rank percentile of values, None when there are none."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def summarize(results):
+    """Counts and p50/p99 fetch times of the results.
+
+    Requests refused with a 403, usually by the web ACL, are counted as
+    blocked as well as failed.
+    """
+    seconds = [result["seconds"] for result in results]
+    return {
+        "urls": len(results),
+        "failed": sum(
+            1
+            for result in results
+            if result["status"] is None or result["status"] >= 400
+        ),
+        "blocked": sum(1 for result in results if result["status"] == 403),
+        "retried": sum(1 for result in results if result["attempts"] > 1),
+        "p50_ms": round(1000 * percentile(seconds, 0.5)) if seconds else None,
+        "p99_ms": round(1000 * percentile(seconds, 0.99)) if seconds else None,
+    }
@@ -0,0 +1,314 @@
+import base64
+import json
+import os
+import re
+import time
+import urllib.error
+import urllib.request
+
+import boto3
+
+# Setup the clients
+secrets_client = boto3.client("secretsmanager")
+cloudfront_client = boto3.client("cloudfront")
+amplify_client = boto3.client("amplify")
+ssm_client = boto3.client("ssm")
+
+AMPLIFY_ORIGIN_SUFFIX = ".amplifyapp.com"
+
+# Characters SSM does not accept in parameter names
+PARAMETER_NAME_UNSAFE = re.compile(r"[^A-Za-z0-9_.-]")
+
+# Tags set on the credentials secrets by the stack
+APP_ID_TAG = "amplify-waf:app-id"
+BRANCH_NAME_TAG = "amplify-waf:branch-name"
+CREDENTIAL_TAG = "amplify-waf:credential"
+
+# Same generation rules as the secrets created by the stack. Only passwords
+# are rotated, the username of a branch never changes so that a single secret
+# of the branch is rotated at a time.
+PASSWORD_OPTIONS = {
+    "password": {"PasswordLength": 32, "ExcludeCharacters": ":"},
+    "credentials": {"PasswordLength": 32, "ExcludeCharacters": ':"\\'},
+}
+
+
+def lambda_handler(event, context):
+    secret_id = event["SecretId"]
+    token = event["ClientRequestToken"]
+    step = event["Step"]
+
+    metadata = secrets_client.describe_secret(SecretId=secret_id)
+    versions = metadata.get("VersionIdsToStages", {})
+    if token not in versions:
+        raise ValueError(f"Secret version {token} has no stage for rotation")
+    if "AWSCURRENT" in versions[token]:
+        print(f"Secret version {token} already set as AWSCURRENT")
+        return
+    if "AWSPENDING" not in versions[token]:
+        raise ValueError(f"Secret version {token} not set as AWSPENDING for rotation")
+
+    tags = {tag["Key"]: tag["Value"] for tag in metadata.get("Tags", [])}
+    branch = {
+        "app_id": tags[APP_ID_TAG],
+        "branch_name": tags[BRANCH_NAME_TAG],
+        "credential": tags[CREDENTIAL_TAG],
+    }
+    if branch["credential"] not in PASSWORD_OPTIONS:
+        raise ValueError(
+            f"Secret {secret_id} holds a {branch['credential']}, not rotated"
+        )
+
+    print(f"Running {step} for {branch['app_id']}/{branch['branch_name']}")
+    if step == "createSecret":
+        create_secret(secret_id, token, branch["credential"])
+    elif step == "setSecret":
+        set_secret(secret_id, token, branch)
+    elif step == "testSecret":
+        test_secret(secret_id, token, branch)
+    elif step == "finishSecret":
+        finish_secret(secret_id, token, versions, branch)
+    else:
+        raise ValueError(f"Invalid rotation step {step}")
+
+
+def create_secret(secret_id, token, credential):
+    """Store a new value of the secret as AWSPENDING."""
+    try:
+        secrets_client.get_secret_value(
+            SecretId=secret_id, VersionId=token, VersionStage="AWSPENDING"
+        )
+        return
+    except secrets_client.exceptions.ResourceNotFoundException:
+        pass
+
+    value = secrets_client.get_random_password(**PASSWORD_OPTIONS[credential])[
+        "RandomPassword"
+    ]
+    if credential == "credentials":
+        # Only the password of a combined secret is regenerated
+        current = json.loads(
+            secrets_client.get_secret_value(
+                SecretId=secret_id, VersionStage="AWSCURRENT"
+            )["SecretString"]
+        )
+        value = json.dumps({**current, "password": value})
+
+    secrets_client.put_secret_value(
+        SecretId=secret_id,
+        ClientRequestToken=token,
+        SecretString=value,
+        VersionStages=["AWSPENDING"],
+    )
+
+
+def set_secret(secret_id, token, branch):
+    """Apply the pending credentials to the origin header and the Amplify branch.
+
+    Both are updated in place, so cached objects stay at the edge and no stack
+    deployment is involved. Amplify accepts a single set of credentials, the
+    distribution is updated first so that the Amplify change lands as edge
+    locations start sending the new header. Until every edge location has the
+    new configuration, cache misses served by the others can be refused.
+    """
+    apply_credentials(
+        branch,
+        secrets_client.get_secret_value(
+            SecretId=secret_id, VersionId=token, VersionStage="AWSPENDING"
+        )["SecretString"],
+    )
+
+
+def apply_credentials(branch, value):
+    """Send the credentials holding a value of the rotated secret to the branch and from its distributions."""
+    distribution_id = lookup_distribution_id(branch["app_id"], branch["branch_name"])
+    response = cloudfront_client.get_distribution_config(Id=distribution_id)
+    credentials = encoded_credentials(value, branch, response["DistributionConfig"])
+    update_authorization_header(distribution_id, response, credentials)
+
+    # The staging distribution sends the same header to the same origin
+    staging_distribution_id = lookup_staging_distribution_id(
+        branch["app_id"], branch["branch_name"]
+    )
+    if staging_distribution_id:
+        update_authorization_header(
+            staging_distribution_id,
+            cloudfront_client.get_distribution_config(Id=staging_distribution_id),
+            credentials,
+        )
+
+    amplify_client.update_branch(
+        appId=branch["app_id"],
+        branchName=branch["branch_name"],
+        enableBasicAuth=True,
+        basicAuthCredentials=credentials,
+    )
+
+
+def update_authorization_header(distribution_id, response, credentials):
+    """Send the credentials from the distribution of a get_distribution_config response."""
+    # The ETag guards against a deployment of the distribution stack since
+    # the configuration was read
+    config = response["DistributionConfig"]
+    header = amplify_authorization_header(config)
+    if header["HeaderValue"] != f"Basic {credentials}":
+        header["HeaderValue"] = f"Basic {credentials}"
+        cloudfront_client.update_distribution(
+            Id=distribution_id, IfMatch=response["ETag"], DistributionConfig=config
+        )
+
+
+def test_secret(secret_id, token, branch):
+    """Check that the Amplify branch accepts the pending credentials.
+
+    When it does not, the current credentials are applied again before
+    failing, so that the branch and its distributions keep matching the
+    AWSCURRENT version read by the distribution stack.
+    """
+    try:
+        check_pending_credentials(secret_id, token, branch)
+    except Exception:
+        print(
+            f"Pending credentials of {branch['app_id']}/{branch['branch_name']} "
+            "refused, applying the current credentials again"
+        )
+        apply_credentials(
+            branch,
+            secrets_client.get_secret_value(
+                SecretId=secret_id, VersionStage="AWSCURRENT"
+            )["SecretString"],
+        )
+        raise
+
+
+def check_pending_credentials(secret_id, token, branch):
+    """Request the Amplify branch with the pending credentials, raising when it refuses them."""
+    distribution_id = lookup_distribution_id(branch["app_id"], branch["branch_name"])
+    config = cloudfront_client.get_distribution_config(Id=distribution_id)[
+        "DistributionConfig"
+    ]
+    pending = encoded_credentials(
+        secrets_client.get_secret_value(
+            SecretId=secret_id, VersionId=token, VersionStage="AWSPENDING"
+        )["SecretString"],
+        branch,
+        config,
+    )
+    formatted_branch = branch["branch_name"].replace("/", "-")
+    request = urllib.request.Request(
+        f"https://{formatted_branch}.{branch['app_id']}{AMPLIFY_ORIGIN_SUFFIX}/",
+        headers={"Authorization": f"Basic {pending}"},
+        method="HEAD",
+    )
+
+    # Amplify takes a few seconds to apply new basic auth credentials, so a 401
+    # is retried like server errors and timeouts. Only a 2xx or 3xx response
+    # shows that the credentials are accepted.
+    for attempt in range(6):
+        try:
+            with urllib.request.urlopen(request, timeout=10):  # nosec B310
+                return
+        except urllib.error.HTTPError as e:
+            if 300 <= e.code < 400:
+                return
+            if e.code != 401 and e.code < 500:
+                raise ValueError(
+                    f"Amplify branch answers {e.code} to the pending credentials"
+                ) from e
+            error = f"answers {e.code}"
+        except OSError as e:
+            # Connection errors and timeouts
+            error = f"is unreachable ({e})"
+        time.sleep(2**attempt)
+
+    raise ValueError(f"Amplify branch {error} with the pending credentials")
+
+
+def finish_secret(secret_id, token, versions, branch):
+    """Promote the pending version to AWSCURRENT and publish it for the distribution stack.
+
+    The distribution reads the credentials again on its next deployment when
+    the published version changes, so that its template keeps the rotated
+    header.
+    """
+    current_version = next(
+        version for version, stages in versions.items() if "AWSCURRENT" in stages
+    )
+    secrets_client.update_secret_version_stage(
+        SecretId=secret_id,
+        VersionStage="AWSCURRENT",
+        MoveToVersionId=token,
+        RemoveFromVersionId=current_version,
+    )
+    ssm_client.put_parameter(
+        Name=(
+            f"{os.environ['CREDENTIALS_VERSION_PARAMETER_PREFIX']}/"
+            f"{branch_parameter_path(branch['app_id'], branch['branch_name'])}"
+        ),
+        Value=token,
+        Type="String",
+        Overwrite=True,
+    )
+
+
+def encoded_credentials(value, branch, config):
+    """Return the base64 encoded credentials including a value of the rotated secret.
+
+    The username of separate secrets is read from the origin header of the
+    distribution config, it is not rotated.
+    """
+    if branch["credential"] == "credentials":
+        credentials = json.loads(value)
+        username, password = credentials["username"], credentials["password"]
+    else:
+        encoded = amplify_authorization_header(config)["HeaderValue"].split(" ")[-1]
+        username = base64.b64decode(encoded).decode("utf-8").partition(":")[0]
+        password = value
+
+    return base64.b64encode(bytes(f"{username}:{password}", "utf-8")).decode("utf-8")
+
+
+def amplify_authorization_header(config):
+    origin = next(
+        item
+        for item in config["Origins"]["Items"]
+        if item["DomainName"].endswith(AMPLIFY_ORIGIN_SUFFIX)
+    )
+    return next(
+        header
+        for header in origin["CustomHeaders"]["Items"]
+        if header["HeaderName"] == "Authorization"
+    )
+
+
+def lookup_distribution_id(app_id, branch_name):
+    return ssm_client.get_parameter(
+        Name=(
+            f"{os.environ['DISTRIBUTION_PARAMETER_PREFIX']}/"
+            f"{branch_parameter_path(app_id, branch_name)}"
+        )
+    )["Parameter"]["Value"]
+
+
+def lookup_staging_distribution_id(app_id, branch_name):
+    """Staging distribution id of the branch, None when it has none."""
+    try:
+        return ssm_client.get_parameter(
+            Name=(
+                f"{os.environ['STAGING_DISTRIBUTION_PARAMETER_PREFIX']}/"
+                f"{branch_parameter_path(app_id, branch_name)}"
+            )
+        )["Parameter"]["Value"]
+    except ssm_client.exceptions.ParameterNotFound:
+        return None
+
+
+def branch_parameter_path(app_id, branch_name):
+    """Parameter name suffix of a branch, encoded as by the stacks."""
+    return "/".join(
+        PARAMETER_NAME_UNSAFE.sub(
+            lambda match: "".join(f"_{byte:02x}" for byte in match[0].encode()),
+            name,
+        )
+        for name in (app_id, branch_name.replace("/", "-"))
+    )
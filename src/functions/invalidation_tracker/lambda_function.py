@@ -0,0 +1,135 @@
+import json
+import os
+import time
+from datetime import datetime, timezone
+
+import boto3
+import invalidation_slots
+
+# Setup the clients
+service_client = boto3.client("cloudfront")
+dynamodb_client = boto3.client("dynamodb")
+sqs_client = boto3.client("sqs")
+
+# Checks are delayed by 15s, 30s, 1 min ... up to the 15 minutes SQS allows,
+# about 1h45 in total before the deployment is reported as failed
+FIRST_DELAY = 15
+MAX_DELAY = 900
+MAX_ATTEMPTS = 12
+
+METRICS_NAMESPACE = "AmplifyWaf"
+
+
+def lambda_handler(event, context):
+    # Records are sent by the cache invalidation function, and by this function
+    # while the invalidations are in progress
+    failures = []
+    for record in event["Records"]:
+        message = json.loads(record["body"])
+        try:
+            track(message)
+        except Exception as e:
+            # Retried, then sent to the dead letter queue
+            print(
+                f"Tracking invalidations of {message['app_id']}/{message['branch_name']} failed: {e}"
+            )
+            failures.append({"itemIdentifier": record["messageId"]})
+
+    return {"batchItemFailures": failures}
+
+
+def track(message):
+    invalidations = [
+        service_client.get_invalidation(
+            DistributionId=message["distribution_id"], Id=invalidation_id
+        )["Invalidation"]
+        for invalidation_id in message["invalidation_ids"]
+    ]
+    in_progress = sorted(
+        invalidation["Id"]
+        for invalidation in invalidations
+        if invalidation["Status"] != "Completed"
+    )
+    for invalidation in invalidations:
+        if invalidation["Status"] == "Completed":
+            release_slots(message["distribution_id"], invalidation)
+
+    if in_progress:
+        attempt = message["attempt"] + 1
+        if attempt >= MAX_ATTEMPTS:
+            raise RuntimeError(
+                f"invalidations {in_progress} still in progress after {attempt} checks"
+            )
+        sqs_client.send_message(
+            QueueUrl=os.environ["TRACKING_QUEUE_URL"],
+            MessageBody=json.dumps(
+                {**message, "invalidation_ids": in_progress, "attempt": attempt}
+            ),
+            DelaySeconds=backoff_delay(attempt),
+        )
+        return
+
+    deployed_at = datetime.fromisoformat(message["deployed_at"].replace("Z", "+00:00"))
+    seconds = (datetime.now(timezone.utc) - deployed_at).total_seconds()
+    print(
+        f"Deployment {message.get('job_id')} of {message['app_id']}/{message['branch_name']} "
+        f"fresh in the cache {seconds:.0f}s after it succeeded"
+    )
+    put_deploy_to_fresh_metric(message, seconds)
+
+    if os.environ.get("WARM_QUEUE_URL"):
+        sqs_client.send_message(
+            QueueUrl=os.environ["WARM_QUEUE_URL"], MessageBody=json.dumps(message)
+        )
+
+
+def release_slots(distribution_id, invalidation):
+    """Return the invalidation slots held by a completed invalidation.
+
+    Invalidations tracked by several deployments, or submitted without slots,
+    are released once or not at all.
+    """
+    batch = invalidation["InvalidationBatch"]
+    invalidation_slots.release(
+        dynamodb_client,
+        os.environ["INVALIDATION_SLOTS_TABLE"],
+        distribution_id,
+        batch["CallerReference"],
+        *invalidation_slots.weights(batch["Paths"].get("Items", [])),
+    )
+
+
+def backoff_delay(attempt):
+    return min(MAX_DELAY, FIRST_DELAY * 2**attempt)
+
+
+def put_deploy_to_fresh_metric(message, seconds):
+    """Publish the metric in the embedded metric format, no API call is needed.
+
+    Completion is noticed at the first check after it happened, the value is an
+    upper bound within the current backoff delay.
+    """
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": METRICS_NAMESPACE,
+                            "Dimensions": [["StackName"]],
+                            "Metrics": [
+                                {"Name": "DeployToFreshSeconds", "Unit": "Seconds"}
+                            ],
+                        }
+                    ],
+                },
+                "StackName": os.environ["STACK_NAME"],
+                "DeployToFreshSeconds": seconds,
+                "AppId": message["app_id"],
+                "BranchName": message["branch_name"],
+                "JobId": message.get("job_id"),
+                "Checks": message["attempt"] + 1,
+            }
+        )
+    )
@@ -0,0 +1,166 @@
+import ipaddress
+import socket
+import time
+
+# Addresses accepted by a single WAF IP set
+IP_SET_MAX_ADDRESSES = 10000
+
+# Networks parsed before they are merged into the result, bounds the memory
+# used on top of the merged ranges whatever the size of the block list
+MERGE_CHUNK_SIZE = 50000
+
+LOCK_RETRIES = 5
+
+
+def parse_ranges(lines):
+    """Yield (version, first, last) integer address ranges from block list lines.
+
+    Lines hold an IP address or CIDR, anything after a # is a comment.
+    Host bits set in a CIDR are ignored. Invalid lines are skipped.
+    """
+    for line in lines:
+        if isinstance(line, bytes):
+            line = line.decode("utf-8", "replace")
+        entry = line.split("#", 1)[0].strip()
+        if not entry:
+            continue
+
+        try:
+            yield parse_range(entry)
+        except (OSError, ValueError):
+            print(f"Skipping invalid block list entry {entry}")
+
+
+def parse_range(entry):
+    # inet_pton is much faster than the ipaddress module on large lists and
+    # rejects the shorthand forms inet_aton accepts
+    address, _, prefix_length = entry.partition("/")
+    family, version, bits = (
+        (socket.AF_INET6, 6, 128) if ":" in address else (socket.AF_INET, 4, 32)
+    )
+    value = int.from_bytes(socket.inet_pton(family, address), "big")
+    prefix_length = int(prefix_length) if prefix_length else bits
+    if not 0 <= prefix_length <= bits:
+        raise ValueError(f"Invalid prefix length in {entry}")
+
+    host_mask = (1 << (bits - prefix_length)) - 1
+    first = value & ~host_mask
+    return version, first, first | host_mask
+
+
+def merge_ranges(ranges, chunk_size=MERGE_CHUNK_SIZE):
+    """Deduplicate and merge address ranges.
+
+    Ranges are read chunk by chunk, each sorted chunk is merged into the sorted
+    result, so only the merged ranges and one chunk are held in memory.
+    Returns the merged ranges of each IP version.
+    """
+    merged = {4: [], 6: []}
+    chunk = []
+    for address_range in ranges:
+        chunk.append(address_range)
+        if len(chunk) >= chunk_size:
+            _merge_chunk(merged, chunk)
+            chunk = []
+    _merge_chunk(merged, chunk)
+    return merged
+
+
+def _merge_chunk(merged, chunk):
+    chunk.sort()
+    for version in merged:
+        ranges = [(first, last) for v, first, last in chunk if v == version]
+        if ranges:
+            merged[version] = _merge_sorted(merged[version], ranges)
+
+
+def _merge_sorted(left, right):
+    result = []
+    i = j = 0
+    while i < len(left) or j < len(right):
+        if j == len(right) or (i < len(left) and left[i] <= right[j]):
+            first, last = left[i]
+            i += 1
+        else:
+            first, last = right[j]
+            j += 1
+
+        # Adjacent ranges are merged as well, they may form a larger CIDR
+        if result and first <= result[-1][1] + 1:
+            if last > result[-1][1]:
+                result[-1] = (result[-1][0], last)
+        else:
+            result.append((first, last))
+    return result
+
+
+def to_cidrs(version, ranges):
+    """Convert merged ranges to the smallest list of CIDRs covering them."""
+    address = ipaddress.IPv4Address if version == 4 else ipaddress.IPv6Address
+    for first, last in ranges:
+        for network in ipaddress.summarize_address_range(address(first), address(last)):
+            # WAF rejects /0, which is split in two halves
+            if network.prefixlen == 0:
+                yield from (str(subnet) for subnet in network.subnets())
+            else:
+                yield str(network)
+
+
+def shard_addresses(addresses, shard_count):
+    """Split addresses across shard_count IP sets, failing when they do not fit."""
+    if len(addresses) > shard_count * IP_SET_MAX_ADDRESSES:
+        raise ValueError(
+            f"{len(addresses)} merged addresses do not fit in {shard_count} IP set(s) "
+            f"of {IP_SET_MAX_ADDRESSES} addresses"
+        )
+
+    return [
+        addresses[index * IP_SET_MAX_ADDRESSES : (index + 1) * IP_SET_MAX_ADDRESSES]
+        for index in range(shard_count)
+    ]
+
+
+def update_ip_set(client, ip_set, addresses, scope):
+    """Replace the addresses of an IP set, retrying on concurrent modifications."""
+    for attempt in range(LOCK_RETRIES):
+        lock_token = client.get_ip_set(
+            Name=ip_set["Name"], Scope=scope, Id=ip_set["Id"]
+        )["LockToken"]
+        try:
+            client.update_ip_set(
+                Name=ip_set["Name"],
+                Scope=scope,
+                Id=ip_set["Id"],
+                Addresses=addresses,
+                LockToken=lock_token,
+            )
+            return
+        except client.exceptions.WAFOptimisticLockException:
+            print(f"IP set {ip_set['Name']} changed concurrently, retrying")
+            time.sleep(2**attempt)
+
+    raise RuntimeError(f"IP set {ip_set['Name']} kept changing, giving up")
+
+
+def load_block_list(client, lines, ip_sets, scope="CLOUDFRONT"):
+    """Load a block list into IP set shards.
+
+    ip_sets maps an IP version (4 or 6) to the list of its IP sets, each with a
+    Name and an Id. Every shard is rewritten, shards left over are emptied.
+    Returns the number of addresses loaded for each IP version.
+    """
+    merged = merge_ranges(parse_ranges(lines))
+
+    # Shards are checked before any update, a partial load would be inconsistent
+    shards = {
+        version: shard_addresses(
+            list(to_cidrs(version, merged[version])), len(ip_sets[version])
+        )
+        for version in ip_sets
+    }
+
+    for version, version_ip_sets in ip_sets.items():
+        for ip_set, addresses in zip(version_ip_sets, shards[version]):
+            update_ip_set(client, ip_set, addresses, scope)
+
+    return {version: sum(map(len, shards[version])) for version in shards}
@@ -0,0 +1,32 @@
+import json
+import os
+from urllib.parse import unquote_plus
+
+import boto3
+from block_list import load_block_list
+
+# Setup the clients
+waf_client = boto3.client("wafv2")
+s3_client = boto3.client("s3")
+
+
+def lambda_handler(event, context):
+    # IP set shards of each IP version, created by the web ACL stack
+    ip_sets = {
+        int(version): version_ip_sets
+        for version, version_ip_sets in json.loads(os.environ["IP_SETS"]).items()
+    }
+
+    # Each uploaded object is a complete block list, the last one wins
+    for record in event["Records"]:
+        bucket = record["s3"]["bucket"]["name"]
+        key = unquote_plus(record["s3"]["object"]["key"])
+        print(f"Loading block list s3://{bucket}/{key}")
+
+        body = s3_client.get_object(Bucket=bucket, Key=key)["Body"]
+        loaded = load_block_list(waf_client, body.iter_lines(), ip_sets)
+
+        print(
+            f"Loaded {loaded.get(4, 0)} IPv4 and {loaded.get(6, 0)} IPv6 addresses "
+            f"from s3://{bucket}/{key}"
+        )
@@ -1,32 +1,145 @@
 import base64
-import os
+import hashlib
+import hmac
+import json
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
 
-import boto3
+import telemetry
 
-# Setup the client
-service_client = boto3.client("secretsmanager")
+# Setup the clients, calls are timed by the telemetry layer
+service_client = telemetry.client("secretsmanager")
+amplify_client = telemetry.client("amplify")
 
+# Resource type of the distribution stacks, which read the credentials only
+ORIGIN_AUTHORIZATION_RESOURCE_TYPE = "Custom::AmplifyOriginAuthorization"
 
+
+@telemetry.instrument
 def lambda_handler(event, context):
-    current_username = service_client.get_secret_value(
-        SecretId=os.environ["USERNAME_SECRET_ARN"], VersionStage="AWSCURRENT"
+    # Invoked directly by CloudFormation, the result is sent to the response
+    # URL whatever happens so that the stack never waits for a timeout
+    properties = event["ResourceProperties"]
+    physical_resource_id = event.get(
+        "PhysicalResourceId", f"{properties['AppId']}/{properties['BranchName']}"
     )
+    try:
+        data = apply_credentials(event)
+    except Exception as e:
+        telemetry.log("Custom resource request failed", level="ERROR", error=str(e))
+        log_stream_name = getattr(context, "log_stream_name", None)
+        send_response(
+            event, "FAILED", physical_resource_id, reason=f"{e} ({log_stream_name})"
+        )
+        return
 
-    current_password = service_client.get_secret_value(
-        SecretId=os.environ["CREDENTIALS_SECRET_ARN"], VersionStage="AWSCURRENT"
-    )
+    send_response(event, "SUCCESS", physical_resource_id, data)
 
-    credentials_suffix = (
-        f"{current_username['SecretString']}:{current_password['SecretString']}"
-    )
+
+def apply_credentials(event):
+    """Enable basic auth on the branch with its credentials.
+
+    Returns the Authorization header CloudFront sends to the branch. Origin
+    authorization resources only get the header.
+    """
+    # Basic auth stays enabled when the branch resource is removed
+    if event["RequestType"] == "Delete":
+        return {}
+
+    # The function is shared by every branch, each resource names its own secrets
+    properties = event["ResourceProperties"]
+    if "Credentials" in properties:
+        # Secrets published by the credentials stack for distribution stacks
+        properties = {**properties, **json.loads(properties["Credentials"])}
+    username, password = get_credentials(properties)
+
+    credentials_suffix = f"{username}:{password}"
 
     # Encode suffix in base64
     bytes_encoded_suffix = base64.b64encode(bytes(credentials_suffix, "utf-8"))
     encoded_suffix = bytes_encoded_suffix.decode("utf-8")
 
-    return {
-        "Data": {
-            "EncodedSuffix": f"Basic {encoded_suffix}",  # For CloudFront Authorization header
-            "EncodedCredentials": encoded_suffix,  # For Amplify Basic Auth credentials
-        },
-    }
+    # Distribution stacks only read the header, the branch belongs to the
+    # credentials stack
+    if event["ResourceType"] == ORIGIN_AUTHORIZATION_RESOURCE_TYPE:
+        return {"EncodedSuffix": f"Basic {encoded_suffix}"}
+
+    # Most deployments leave the credentials untouched, the branch is only
+    # updated when its credentials differ
+    branch = amplify_client.get_branch(
+        appId=properties["AppId"], branchName=properties["BranchName"]
+    )["branch"]
+    updated = not branch["enableBasicAuth"] or not hmac.compare_digest(
+        _digest(branch.get("basicAuthCredentials", "")), _digest(encoded_suffix)
+    )
+    if updated:
+        amplify_client.update_branch(
+            appId=properties["AppId"],
+            branchName=properties["BranchName"],
+            enableBasicAuth=True,
+            basicAuthCredentials=encoded_suffix,
+        )
+
+    telemetry.log(
+        "Credentials applied" if updated else "Credentials unchanged",
+        request_type=event["RequestType"],
+        logical_resource_id=event.get("LogicalResourceId"),
+        app_id=properties["AppId"],
+        branch_name=properties["BranchName"],
+    )
+
+    # For CloudFront Authorization header
+    return {"EncodedSuffix": f"Basic {encoded_suffix}"}
+
+
+def _digest(value):
+    return hashlib.sha256(value.encode("utf-8")).digest()
+
+
+def send_response(event, status, physical_resource_id, data=None, reason=None):
+    """Send the result of the request to CloudFormation."""
+    body = json.dumps(
+        {
+            "Status": status,
+            "Reason": reason or "See the function logs",
+            "PhysicalResourceId": physical_resource_id,
+            "StackId": event["StackId"],
+            "RequestId": event["RequestId"],
+            "LogicalResourceId": event["LogicalResourceId"],
+            # Credentials are not shown by describe calls
+            "NoEcho": True,
+            "Data": data or {},
+        }
+    ).encode("utf-8")
+    request = urllib.request.Request(
+        event["ResponseURL"],
+        data=body,
+        method="PUT",
+        headers={"Content-Type": "", "Content-Length": str(len(body))},
+    )
+    with urllib.request.urlopen(request, timeout=10):  # nosec B310
+        pass
+
+
+def get_credentials(properties):
+    """Return the username and password named by the resource properties."""
+    # Username and password stored together as a JSON secret, a single call
+    if "CredentialsSecretArn" in properties:
+        credentials = json.loads(get_secret(properties["CredentialsSecretArn"]))
+        return credentials["username"], credentials["password"]
+
+    # Separate secrets are fetched concurrently
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        username, password = executor.map(
+            get_secret,
+            [properties["UsernameSecretArn"], properties["PasswordSecretArn"]],
+        )
+    return username, password
+
+
+def get_secret(secret_id):
+    # Never served from memory, a warm container would otherwise write the
+    # value from before a rotation back to the branch and the distribution
+    return service_client.get_secret_value(
+        SecretId=secret_id, VersionStage="AWSCURRENT"
+    )["SecretString"]
@@ -0,0 +1,145 @@
+"""Semaphore bounding the invalidation paths in progress on each distribution.
+
+CloudFront rejects invalidations with TooManyInvalidationsInProgress beyond
+15 wildcard paths or 3,000 file paths in progress on a distribution. The
+invalidation function takes a lease on those slots before each
+CreateInvalidation and the invalidation tracker returns it once the
+invalidation completed.
+
+Each distribution has one item in the slots table holding the slots in use
+and the leases holding them, so that taking a lease is a single conditional
+write whichever function, or how many concurrent invocations, compete for it.
+Leases are named after the caller reference of their invalidation, taking or
+returning one twice has no effect.
+"""
+
+import time
+
+# CloudFront quotas of paths in progress per distribution
+MAX_WILDCARD_SLOTS = 15
+MAX_PATH_SLOTS = 3000
+
+# Leases not returned by then are reclaimed, longer than the invalidation
+# tracker follows an invalidation
+LEASE_SECONDS = 2 * 3600
+
+LEASE_PREFIX = "Lease-"
+
+
+def weights(paths):
+    """Return the wildcard and file path slots used by a list of paths."""
+    wildcards = sum(1 for path in paths if path.endswith("*"))
+    return wildcards, len(paths) - wildcards
+
+
+def acquire(
+    client,
+    table_name,
+    distribution_id,
+    lease_id,
+    paths,
+    max_wildcards=MAX_WILDCARD_SLOTS,
+    max_paths=MAX_PATH_SLOTS,
+):
+    """Take the slots of an invalidation, returning False when they are in use.
+
+    Expired leases are reclaimed before giving up.
+    """
+    wildcards, files = weights(paths)
+    if wildcards > max_wildcards or files > max_paths:
+        raise ValueError(
+            f"{wildcards} wildcard and {files} file paths exceed the slots of a distribution"
+        )
+
+    for _ in range(2):
+        try:
+            client.update_item(
+                TableName=table_name,
+                Key={"DistributionId": {"S": distribution_id}},
+                UpdateExpression=(
+                    "SET WildcardSlots = if_not_exists(WildcardSlots, :zero) + :wildcards, "
+                    "PathSlots = if_not_exists(PathSlots, :zero) + :paths, #lease = :lease"
+                ),
+                ConditionExpression=(
+                    "attribute_not_exists(#lease) "
+                    "AND (attribute_not_exists(WildcardSlots) OR WildcardSlots <= :wildcard_limit) "
+                    "AND (attribute_not_exists(PathSlots) OR PathSlots <= :path_limit)"
+                ),
+                ExpressionAttributeNames={"#lease": LEASE_PREFIX + lease_id},
+                ExpressionAttributeValues={
+                    ":zero": {"N": "0"},
+                    ":wildcards": {"N": str(wildcards)},
+                    ":paths": {"N": str(files)},
+                    ":wildcard_limit": {"N": str(max_wildcards - wildcards)},
+                    ":path_limit": {"N": str(max_paths - files)},
+                    ":lease": {
+                        "M": {
+                            "Wildcards": {"N": str(wildcards)},
+                            "Paths": {"N": str(files)},
+                            "Expires": {"N": str(int(time.time()) + LEASE_SECONDS)},
+                        }
+                    },
+                },
+            )
+            return True
+        except client.exceptions.ConditionalCheckFailedException:
+            leases = _leases(client, table_name, distribution_id)
+            # Taken by a previous attempt at the same invalidation
+            if lease_id in leases:
+                return True
+            if not reclaim_expired(client, table_name, distribution_id, leases):
+                return False
+
+    return False
+
+
+def release(client, table_name, distribution_id, lease_id, wildcards, files):
+    """Return the slots of a lease, returning False when it was already returned."""
+    try:
+        client.update_item(
+            TableName=table_name,
+            Key={"DistributionId": {"S": distribution_id}},
+            UpdateExpression=(
+                "SET WildcardSlots = WildcardSlots - :wildcards, PathSlots = PathSlots - :paths "
+                "REMOVE #lease"
+            ),
+            ConditionExpression="attribute_exists(#lease)",
+            ExpressionAttributeNames={"#lease": LEASE_PREFIX + lease_id},
+            ExpressionAttributeValues={
+                ":wildcards": {"N": str(wildcards)},
+                ":paths": {"N": str(files)},
+            },
+        )
+    except client.exceptions.ConditionalCheckFailedException:
+        return False
+    return True
+
+
+def reclaim_expired(client, table_name, distribution_id, leases):
+    """Return the slots of the expired leases, returning True if any was reclaimed."""
+    now = time.time()
+    reclaimed = False
+    for lease_id, (wildcards, files, expires) in leases.items():
+        if expires < now:
+            reclaimed |= release(
+                client, table_name, distribution_id, lease_id, wildcards, files
+            )
+    return reclaimed
+
+
+def _leases(client, table_name, distribution_id):
+    """Return the wildcards, paths and expiry of the leases of a distribution by id."""
+    item = client.get_item(
+        TableName=table_name,
+        Key={"DistributionId": {"S": distribution_id}},
+        ConsistentRead=True,
+    ).get("Item", {})
+    return {
+        name[len(LEASE_PREFIX) :]: (
+            int(value["M"]["Wildcards"]["N"]),
+            int(value["M"]["Paths"]["N"]),
+            int(value["M"]["Expires"]["N"]),
+        )
+        for name, value in item.items()
+        if name.startswith(LEASE_PREFIX)
+    }
@@ -0,0 +1,187 @@
+"""Structured logs and embedded metric format metrics of the Lambda functions.
+
+Metrics are printed as embedded metric format documents, CloudWatch extracts
+them from the log group of the function, no API call is made.
+"""
+
+import functools
+import json
+import os
+import time
+
+NAMESPACE = "AmplifyWaf"
+
+# A metric accepts at most 100 values per document
+MAX_VALUES = 100
+
+# Seconds spent importing boto3 and creating the clients, the bulk of the init
+# phase of the functions
+init_seconds = 0.0
+cold_start = True
+
+# Set for the duration of an invocation
+request_id = None
+sdk_calls = []
+
+
+def client(service_name, **kwargs):
+    """Create a boto3 client whose calls are timed and counted.
+
+    Clients are expected to be created at import time, their creation is
+    accounted as init time.
+    """
+    global init_seconds
+    started = time.perf_counter()
+    # Imported here so that its cost is accounted as init time too
+    import boto3
+
+    sdk_client = boto3.client(service_name, **kwargs)
+    # Parameter building is the first step of a call, before-call handlers may
+    # be skipped when another handler answers the call
+    sdk_client.meta.events.register("before-parameter-build.*.*", _call_started)
+    sdk_client.meta.events.register("after-call.*.*", _call_succeeded)
+    sdk_client.meta.events.register("after-call-error.*.*", _call_failed)
+    init_seconds += time.perf_counter() - started
+    return sdk_client
+
+
+def _operation(event_name):
+    _, service, operation = event_name.split(".", 2)
+    return f"{service}.{operation}"
+
+
+def _call_started(context, **kwargs):
+    context["telemetry_started"] = time.perf_counter()
+
+
+def _call_succeeded(event_name, parsed, context, **kwargs):
+    _record(event_name, context, parsed.get("Error", {}).get("Code") or "Success")
+
+
+def _call_failed(event_name, exception, context, **kwargs):
+    # No response was received, e.g. a connection error or timeout
+    _record(event_name, context, type(exception).__name__)
+
+
+def _record(event_name, context, outcome):
+    started = context.get("telemetry_started")
+    if started is None:
+        return
+    sdk_calls.append(
+        (_operation(event_name), outcome, 1000 * (time.perf_counter() - started))
+    )
+
+
+def log(message, level="INFO", **fields):
+    """Print a JSON log line with the invocation context."""
+    print(
+        json.dumps(
+            {
+                "level": level,
+                "message": message,
+                "request_id": request_id,
+                "cold_start": cold_start,
+                **fields,
+            },
+            default=str,
+        )
+    )
+
+
+def put_metrics(dimensions, metrics, **properties):
+    """Print an embedded metric format document.
+
+    dimensions maps dimension names to values, metrics maps metric names to
+    a (value or list of values, unit) pair.
+    """
+    print(
+        json.dumps(
+            {
+                "_aws": {
+                    "Timestamp": int(time.time() * 1000),
+                    "CloudWatchMetrics": [
+                        {
+                            "Namespace": NAMESPACE,
+                            "Dimensions": [list(dimensions)],
+                            "Metrics": [
+                                {"Name": name, "Unit": unit}
+                                for name, (_, unit) in metrics.items()
+                            ],
+                        }
+                    ],
+                },
+                **dimensions,
+                **{name: value for name, (value, _) in metrics.items()},
+                **properties,
+            },
+            default=str,
+        )
+    )
+
+
+def instrument(handler):
+    """Decorate a Lambda handler to publish its invocation metrics.
+
+    Each invocation publishes its duration, whether it was a cold start with
+    the init time, and the latency of its SDK calls by operation and outcome.
+    """
+
+    @functools.wraps(handler)
+    def wrapper(event, context):
+        global cold_start, request_id
+        request_id = getattr(context, "aws_request_id", None)
+        del sdk_calls[:]
+        started = time.perf_counter()
+        failed = False
+        try:
+            return handler(event, context)
+        except Exception:
+            failed = True
+            raise
+        finally:
+            publish(1000 * (time.perf_counter() - started), failed)
+            cold_start = False
+            request_id = None
+
+    return wrapper
+
+
+def publish(duration_ms, failed):
+    function_name = os.environ.get("AWS_LAMBDA_FUNCTION_NAME", "local")
+    metrics = {
+        "InvocationDuration": (duration_ms, "Milliseconds"),
+        "ColdStart": (int(cold_start), "Count"),
+        "SdkCalls": (len(sdk_calls), "Count"),
+        "SdkCallErrors": (
+            sum(1 for _, outcome, _ in sdk_calls if outcome != "Success"),
+            "Count",
+        ),
+    }
+    if cold_start:
+        metrics["InitDuration"] = (1000 * init_seconds, "Milliseconds")
+    put_metrics(
+        {"FunctionName": function_name},
+        metrics,
+        RequestId=request_id,
+        Failed=failed,
+    )
+
+    latencies = {}
+    for operation, outcome, latency in sdk_calls:
+        latencies.setdefault((operation, outcome), []).append(latency)
+    for (operation, outcome), values in sorted(latencies.items()):
+        for index in range(0, len(values), MAX_VALUES):
+            put_metrics(
+                {
+                    "FunctionName": function_name,
+                    "Operation": operation,
+                    "Outcome": outcome,
+                },
+                {
+                    "SdkCallLatency": (
+                        values[index : index + MAX_VALUES],
+                        "Milliseconds",
+                    ),
+                },
+                RequestId=request_id,
+            )
@@ -0,0 +1,509 @@
+from aws_cdk import Aws, Duration, Stack
+from aws_cdk import aws_cloudwatch as cloudwatch
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_lambda as lambda_
+from aws_cdk import aws_sqs as sqs
+from aws_cdk import custom_resources as custom
+from constructs import Construct
+
+from src.nag_suppressions import CDK_GENERATED_FUNCTION, CDK_GENERATED_ROLE
+from src.waf_rules import rule_metric_name
+
+# CloudFront publishes the metrics of every distribution in us-east-1, as WAF
+# does for the web ACLs of CloudFront distributions
+GLOBAL_METRICS_REGION = "us-east-1"
+
+# Alarms on CloudFront metrics, evaluated over 3 periods of 5 minutes
+ALARM_PERIOD = Duration.minutes(5)
+ALARM_EVALUATION_PERIODS = 3
+
+# Distribution metrics shown on the dashboard, the cache hit rate and origin
+# latency are only published with the additional metrics subscription
+DISTRIBUTION_WIDGETS = [
+    ("Requests", "Requests", "Sum", False),
+    ("Cache hit ratio (%)", "CacheHitRate", "Average", True),
+    ("Origin latency p90 (ms)", "OriginLatency", "p90", True),
+    ("4xx error rate (%)", "4xxErrorRate", "Average", False),
+    ("5xx error rate (%)", "5xxErrorRate", "Average", False),
+]
+# Published by the invalidation tracker in the embedded metric format
+CUSTOM_METRICS_NAMESPACE = "AmplifyWaf"
+# SDK calls of the cache invalidation function, as named by the telemetry layer
+CACHE_INVALIDATION_SDK_OPERATIONS = [
+    "ssm.GetParameter",
+    "cloudfront.GetDistributionConfig",
+    "s3.GetObject",
+    "cloudfront.ListInvalidations",
+    "cloudfront.GetInvalidation",
+    "dynamodb.UpdateItem",
+    "cloudfront.CreateInvalidation",
+    "s3.PutObject",
+    "sqs.SendMessage",
+]
+WAF_REQUEST_METRICS = ["AllowedRequests", "BlockedRequests", "CountedRequests"]
+WIDGETS_PER_ROW = 3
+
+
+def distribution_metric(distribution_id, metric_name, statistic, label=None):
+    return cloudwatch.Metric(
+        namespace="AWS/CloudFront",
+        metric_name=metric_name,
+        dimensions_map={"DistributionId": distribution_id, "Region": "Global"},
+        statistic=statistic,
+        label=label,
+        period=ALARM_PERIOD,
+        region=GLOBAL_METRICS_REGION,
+    )
+
+
+def dashboard_rows(widgets):
+    return [
+        widgets[index : index + WIDGETS_PER_ROW]
+        for index in range(0, len(widgets), WIDGETS_PER_ROW)
+    ]
+
+
+def telemetry_metric(function, metric_name, statistic):
+    """Metric published by a function through the telemetry layer."""
+    return cloudwatch.Metric(
+        namespace=CUSTOM_METRICS_NAMESPACE,
+        metric_name=metric_name,
+        dimensions_map={"FunctionName": function.function_name},
+        statistic=statistic,
+        label=f"{metric_name} {statistic}",
+    )
+
+
+def validate_alarm_thresholds(
+    additional_metrics, cache_hit_ratio_threshold, origin_latency_threshold
+):
+    """Fail synth on alarms CloudFront publishes no metric for."""
+    if not additional_metrics and (
+        cache_hit_ratio_threshold is not None or origin_latency_threshold is not None
+    ):
+        raise ValueError(
+            "Cache hit ratio and origin latency alarms require the CloudFront additional metrics"
+        )
+    if (
+        cache_hit_ratio_threshold is not None
+        and not 0 < cache_hit_ratio_threshold < 100
+    ):
+        raise ValueError("The cache hit ratio alarm threshold is a percentage")
+    if origin_latency_threshold is not None and origin_latency_threshold <= 0:
+        raise ValueError(
+            "The origin latency alarm threshold is a number of milliseconds"
+        )
+
+
+class DistributionAlarm(Construct):
+    """Alarm on a metric of a CloudFront distribution.
+
+    Alarms can only watch metrics of their own region, the alarm is created in
+    us-east-1 by an SDK call whatever the region of the stack. role is the role
+    of the shared SDK call function, granted access to the alarms beforehand.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        alarm_name: str,
+        description: str,
+        metric: cloudwatch.Metric,
+        comparison_operator: str,
+        threshold: float,
+        role: iam.IRole,
+    ):
+        super().__init__(scope, id)
+
+        statistic = metric.to_metric_config().metric_stat.statistic
+        statistic_parameter = (
+            {"ExtendedStatistic": statistic}
+            if statistic.startswith("p")
+            else {"Statistic": statistic}
+        )
+        put_alarm_call = custom.AwsSdkCall(
+            service="CloudWatch",
+            action="putMetricAlarm",
+            region=GLOBAL_METRICS_REGION,
+            parameters={
+                "AlarmName": alarm_name,
+                "AlarmDescription": description,
+                "Namespace": metric.namespace,
+                "MetricName": metric.metric_name,
+                "Dimensions": [
+                    {"Name": name, "Value": value}
+                    for name, value in metric.dimensions.items()
+                ],
+                **statistic_parameter,
+                "Period": ALARM_PERIOD.to_seconds(),
+                "EvaluationPeriods": ALARM_EVALUATION_PERIODS,
+                "DatapointsToAlarm": ALARM_EVALUATION_PERIODS,
+                "ComparisonOperator": comparison_operator,
+                "Threshold": threshold,
+                # Branches without traffic publish no data points
+                "TreatMissingData": "notBreaching",
+            },
+            physical_resource_id=custom.PhysicalResourceId.of(alarm_name),
+        )
+
+        self.custom_resource = custom.AwsCustomResource(
+            self,
+            "rAlarm",
+            role=role,
+            on_create=put_alarm_call,
+            on_update=put_alarm_call,
+            on_delete=custom.AwsSdkCall(
+                service="CloudWatch",
+                action="deleteAlarms",
+                region=GLOBAL_METRICS_REGION,
+                parameters={"AlarmNames": [alarm_name]},
+            ),
+        )
+
+
+class DistributionMonitoring(Construct):
+    """Dashboard and alarms of the branch distributions and of the cache invalidation function.
+
+    distributions are (id, label, distribution id) tuples, read from the lookup
+    table of the distribution stack. Each branch distribution gets an alarm on
+    drops of its cache hit ratio and one on regressions of its origin latency,
+    when their thresholds are set. staging_distributions maps the ids of the
+    branches with a staging distribution to its distribution id, graphed next
+    to the primary one without alarms.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        distributions: list,
+        cache_invalidation_function: lambda_.IFunction,
+        dead_letter_queue: sqs.IQueue,
+        additional_metrics: bool,
+        cache_hit_ratio_threshold: float = None,
+        origin_latency_threshold: float = None,
+        staging_distributions: dict = None,
+    ):
+        super().__init__(scope, id)
+
+        staging_distributions = staging_distributions or {}
+        self.nag_suppressions = []
+        alarms = {
+            "cache-hit-ratio": (
+                "CacheHitRate",
+                "Average",
+                "LessThanThreshold",
+                cache_hit_ratio_threshold,
+                "Cache hit ratio of {} dropped, more requests reach Amplify",
+            ),
+            "origin-latency": (
+                "OriginLatency",
+                "p90",
+                "GreaterThanThreshold",
+                origin_latency_threshold,
+                "Origin latency of {} regressed, cache misses are served slower",
+            ),
+        }
+        alarms = {name: alarm for name, alarm in alarms.items() if alarm[3] is not None}
+        if alarms:
+            # Role of the function shared by the SDK call custom resources, with
+            # a single policy for the alarms of every branch, each custom
+            # resource would otherwise add its own policy to the role
+            sdk_call_role = iam.Role(
+                self,
+                "rDistributionAlarmFunctionRole",
+                description="Role used by the custom resources of the distribution alarms",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                managed_policies=[
+                    iam.ManagedPolicy.from_aws_managed_policy_name(
+                        "service-role/AWSLambdaBasicExecutionRole"
+                    )
+                ],
+            )
+            alarm_policy = iam.Policy(
+                self,
+                "rDistributionAlarmPolicy",
+                statements=[
+                    iam.PolicyStatement(
+                        effect=iam.Effect.ALLOW,
+                        actions=[
+                            "cloudwatch:PutMetricAlarm",
+                            "cloudwatch:DeleteAlarms",
+                        ],
+                        resources=[
+                            f"arn:aws:cloudwatch:{GLOBAL_METRICS_REGION}:{Aws.ACCOUNT_ID}:alarm:{Aws.STACK_NAME}-*"
+                        ],
+                    )
+                ],
+                roles=[sdk_call_role],
+            )
+            self.nag_suppressions.extend(
+                [
+                    (
+                        alarm_policy,
+                        {
+                            "AwsSolutions-IAM5": "alarms are restricted to the ones named after the stack",
+                        },
+                        False,
+                    ),
+                    (sdk_call_role, {"AwsSolutions-IAM4": CDK_GENERATED_ROLE}, False),
+                    (
+                        "AWS679f53fac002430cb0da5b7982bd2287",
+                        {"AwsSolutions-L1": CDK_GENERATED_FUNCTION},
+                        False,
+                    ),
+                ]
+            )
+
+        for branch_id, label, distribution_id in distributions:
+            for name, (
+                metric_name,
+                statistic,
+                comparison_operator,
+                threshold,
+                description,
+            ) in alarms.items():
+                alarm = DistributionAlarm(
+                    self,
+                    f"r{branch_id}-{name}",
+                    alarm_name=f"{Aws.STACK_NAME}-{branch_id}-{name}",
+                    description=description.format(label),
+                    metric=distribution_metric(
+                        distribution_id,
+                        metric_name,
+                        statistic,
+                    ),
+                    comparison_operator=comparison_operator,
+                    threshold=threshold,
+                    role=sdk_call_role,
+                )
+                alarm.custom_resource.node.add_dependency(alarm_policy)
+
+        annotations = {
+            "CacheHitRate": cache_hit_ratio_threshold,
+            "OriginLatency": origin_latency_threshold,
+        }
+        distribution_widgets = [
+            cloudwatch.GraphWidget(
+                title=title,
+                region=GLOBAL_METRICS_REGION,
+                left=[
+                    distribution_metric(
+                        distribution_id, metric_name, statistic, label=label
+                    )
+                    for _, label, distribution_id in distributions
+                ],
+                left_annotations=(
+                    [
+                        cloudwatch.HorizontalAnnotation(
+                            value=annotations[metric_name], label="Alarm threshold"
+                        )
+                    ]
+                    if annotations.get(metric_name) is not None
+                    else None
+                ),
+                width=8,
+            )
+            for title, metric_name, statistic, additional in DISTRIBUTION_WIDGETS
+            if additional_metrics or not additional
+        ]
+
+        # Primary and staging distributions of each branch side by side, the
+        # staging distribution only receives the slice of traffic routed to it
+        staging_widgets = [
+            cloudwatch.GraphWidget(
+                title=f"Staging comparison, {title[0].lower()}{title[1:]}",
+                region=GLOBAL_METRICS_REGION,
+                left=[
+                    distribution_metric(
+                        compared_id, metric_name, statistic, label=compared_label
+                    )
+                    for branch_id, label, distribution_id in distributions
+                    if branch_id in staging_distributions
+                    for compared_label, compared_id in (
+                        (label, distribution_id),
+                        (f"{label} staging", staging_distributions[branch_id]),
+                    )
+                ],
+                width=8,
+            )
+            for title, metric_name, statistic, additional in DISTRIBUTION_WIDGETS
+            if staging_distributions and (additional_metrics or not additional)
+        ]
+
+        cache_invalidation_errors_alarm = cloudwatch.Alarm(
+            self,
+            "rCacheInvalidationErrorsAlarm",
+            alarm_description="Cache invalidation function failed, deployments may be served stale",
+            metric=cache_invalidation_function.metric_errors(
+                period=ALARM_PERIOD, statistic="Sum"
+            ),
+            threshold=1,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+
+        # Deployments whose invalidation or tracking kept failing
+        dead_letter_queue_alarm = cloudwatch.Alarm(
+            self,
+            "rDeadLetterQueueAlarm",
+            alarm_description="Deployments failed to be invalidated or to complete, they may be served stale",
+            metric=dead_letter_queue.metric_approximate_number_of_messages_visible(
+                period=ALARM_PERIOD, statistic="Maximum"
+            ),
+            threshold=1,
+            evaluation_periods=1,
+            comparison_operator=cloudwatch.ComparisonOperator.GREATER_THAN_OR_EQUAL_TO_THRESHOLD,
+            treat_missing_data=cloudwatch.TreatMissingData.NOT_BREACHING,
+        )
+
+        deploy_to_fresh_widget = cloudwatch.GraphWidget(
+            title="Deployment to fresh cache (s)",
+            left=[
+                cloudwatch.Metric(
+                    namespace=CUSTOM_METRICS_NAMESPACE,
+                    metric_name="DeployToFreshSeconds",
+                    dimensions_map={"StackName": Stack.of(self).stack_name},
+                    statistic=statistic,
+                    label=statistic,
+                    period=Duration.hours(1),
+                )
+                for statistic in ("p50", "p90", "Maximum")
+            ],
+            width=8,
+        )
+
+        cloudwatch.Dashboard(
+            self,
+            "rDashboard",
+            dashboard_name=Stack.of(self).stack_name,
+            widgets=[
+                *dashboard_rows([*distribution_widgets, deploy_to_fresh_widget]),
+                *dashboard_rows(staging_widgets),
+                [
+                    cloudwatch.GraphWidget(
+                        title="Cache invalidation duration (ms)",
+                        left=[
+                            cache_invalidation_function.metric_duration(
+                                statistic=statistic, label=statistic
+                            )
+                            for statistic in ("p50", "p99", "Maximum")
+                        ],
+                        width=8,
+                    ),
+                    cloudwatch.GraphWidget(
+                        title="Cache invalidation invocations and errors",
+                        left=[
+                            cache_invalidation_function.metric_invocations(),
+                            cache_invalidation_function.metric_errors(),
+                        ],
+                        width=8,
+                    ),
+                    cloudwatch.AlarmStatusWidget(
+                        title="Alarms",
+                        alarms=[
+                            cache_invalidation_errors_alarm,
+                            dead_letter_queue_alarm,
+                        ],
+                        width=8,
+                    ),
+                ],
+                [
+                    cloudwatch.GraphWidget(
+                        title="Cache invalidation cold starts and init (ms)",
+                        left=[
+                            telemetry_metric(
+                                cache_invalidation_function,
+                                "InitDuration",
+                                "Maximum",
+                            )
+                        ],
+                        right=[
+                            telemetry_metric(
+                                cache_invalidation_function, "ColdStart", "Sum"
+                            )
+                        ],
+                        width=8,
+                    ),
+                    cloudwatch.GraphWidget(
+                        title="Cache invalidation p90 SDK call latency (ms)",
+                        left=[
+                            cloudwatch.Metric(
+                                namespace=CUSTOM_METRICS_NAMESPACE,
+                                metric_name="SdkCallLatency",
+                                dimensions_map={
+                                    "FunctionName": cache_invalidation_function.function_name,
+                                    "Operation": operation,
+                                    "Outcome": "Success",
+                                },
+                                statistic="p90",
+                                label=operation,
+                            )
+                            for operation in CACHE_INVALIDATION_SDK_OPERATIONS
+                        ],
+                        width=16,
+                    ),
+                ],
+            ],
+        )
+
+
+class WebAclDashboard(Construct):
+    """Dashboard of the requests allowed, blocked and counted by each web ACL rule.
+
+    Widgets follow the rules built from the same managed rule groups, rate
+    limits and block list as the web ACL, in evaluation order.
+    """
+
+    def __init__(
+        self,
+        scope: Construct,
+        id: str,
+        web_acl_metric_name: str,
+        rules: list,
+    ):
+        super().__init__(scope, id)
+
+        def rule_widget(title, rule_metric):
+            return cloudwatch.GraphWidget(
+                title=title,
+                region=GLOBAL_METRICS_REGION,
+                left=[
+                    cloudwatch.Metric(
+                        namespace="AWS/WAFV2",
+                        metric_name=metric_name,
+                        # WAF metrics are keyed by the metric names of the
+                        # web ACL and rules, not their names
+                        dimensions_map={
+                            "WebACL": web_acl_metric_name,
+                            "Rule": rule_metric,
+                        },
+                        statistic="Sum",
+                        label=metric_name.replace("Requests", ""),
+                        period=ALARM_PERIOD,
+                        region=GLOBAL_METRICS_REGION,
+                    )
+                    for metric_name in WAF_REQUEST_METRICS
+                ],
+                stacked=True,
+                width=8,
+            )
+
+        cloudwatch.Dashboard(
+            self,
+            "rDashboard",
+            dashboard_name=Stack.of(self).stack_name,
+            widgets=dashboard_rows(
+                [
+                    rule_widget("All requests", "ALL"),
+                    *(
+                        rule_widget(
+                            f"{priority}. {rule['name']}", rule_metric_name(rule)
+                        )
+                        for priority, rule in enumerate(rules, start=1)
+                    ),
+                ]
+            ),
+        )
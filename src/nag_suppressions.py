@@ -0,0 +1,39 @@
+from cdk_nag import NagSuppressions
+
+CDK_GENERATED_ROLE = "CDK generated service role and policy"
+CDK_GENERATED_FUNCTION = "CDK generated custom resource"
+
+
+def apply_nag_suppressions(scope, table):
+    """Register a table of cdk-nag suppressions in a single pass.
+
+    Each row is (target, {rule id: reason}, apply_to_children), where target is
+    a construct or the path of construct ids below scope. Rows for the same
+    target are merged so that each construct is visited once, and paths are
+    resolved directly instead of searching the whole construct tree.
+    """
+    merged = {}
+    for target, rules, apply_to_children in table:
+        if isinstance(target, str):
+            target = find_construct(scope, target)
+
+        _, merged_rules, _ = merged.setdefault(
+            (target.node.path, apply_to_children), (target, {}, apply_to_children)
+        )
+        merged_rules.update(rules)
+
+    for target, rules, apply_to_children in merged.values():
+        NagSuppressions.add_resource_suppressions(
+            target,
+            suppressions=[
+                {"id": rule_id, "reason": reason} for rule_id, reason in rules.items()
+            ],
+            apply_to_children=apply_to_children,
+        )
+
+
+def find_construct(scope, path):
+    construct = scope
+    for construct_id in path.split("/"):
+        construct = construct.node.find_child(construct_id)
+    return construct
@@ -0,0 +1,152 @@
+import aws_cdk.aws_cloudfront as cloudfront
+import aws_cdk.aws_cloudfront_origins as origins
+from aws_cdk import Duration
+from aws_cdk import aws_s3 as s3
+from constructs import Construct
+
+# Status codes CloudFront accepts custom error responses for
+ERROR_RESPONSE_STATUS_CODES = {400, 403, 404, 405, 414, 416, 500, 501, 502, 503, 504}
+# Status codes an origin group fails over on
+FAILOVER_STATUS_CODES = {400, 403, 404, 416, 500, 502, 503, 504}
+MAX_ERROR_CACHING_TTL = 31536000
+
+# Options of the fallback origin, error_page_path is served for the failover
+# status codes when the fallback origin has no copy of the requested path
+ORIGIN_FALLBACK_DEFAULTS = {
+    "status_codes": [500, 502, 503, 504],
+    "error_page_path": None,
+}
+# Paths served by the fallback origin directly, without trying Amplify first
+FALLBACK_PATH_PREFIX = "/_fallback/"
+
+# Seconds Amplify may take to refuse connections before the fallback origin is
+# tried, beyond which viewers wait noticeably on each cache miss
+MAX_FAILOVER_DELAY = 10
+
+
+def validate_error_caching_ttls(error_caching_ttls):
+    """Return the error caching TTLs by status code, failing synth on invalid ones."""
+    ttls = {}
+    for status_code, ttl in error_caching_ttls.items():
+        if (
+            not str(status_code).isdigit()
+            or int(status_code) not in ERROR_RESPONSE_STATUS_CODES
+        ):
+            raise ValueError(
+                f"CloudFront does not cache error responses with status {status_code}, "
+                f"expected one of {sorted(ERROR_RESPONSE_STATUS_CODES)}"
+            )
+        if not isinstance(ttl, int) or not 0 <= ttl <= MAX_ERROR_CACHING_TTL:
+            raise ValueError(
+                f"Error caching TTL of status {status_code} must be an integer between 0 and {MAX_ERROR_CACHING_TTL}"
+            )
+        ttls[int(status_code)] = ttl
+    return ttls
+
+
+def validate_origin_fallback(origin_fallback):
+    """Return the fallback origin options completed with defaults, failing synth on invalid ones."""
+    unknown = set(origin_fallback) - set(ORIGIN_FALLBACK_DEFAULTS)
+    if unknown:
+        raise ValueError(
+            f"Unknown origin fallback options {sorted(unknown)}, "
+            f"expected some of {sorted(ORIGIN_FALLBACK_DEFAULTS)}"
+        )
+    options = {**ORIGIN_FALLBACK_DEFAULTS, **origin_fallback}
+
+    invalid = set(options["status_codes"]) - FAILOVER_STATUS_CODES
+    if not options["status_codes"] or invalid:
+        raise ValueError(
+            f"Origin fallback status codes must be some of {sorted(FAILOVER_STATUS_CODES)}"
+        )
+    error_page_path = options["error_page_path"]
+    if error_page_path and not error_page_path.startswith(FALLBACK_PATH_PREFIX):
+        raise ValueError(
+            f"Origin fallback error page {error_page_path} must be under {FALLBACK_PATH_PREFIX}"
+        )
+    return options
+
+
+def error_responses(error_caching_ttls, fallback_status_codes=(), error_page_path=None):
+    """Custom error responses of a distribution.
+
+    Error responses are cached for their configured TTL, CloudFront caches the
+    others for 10 seconds. With an error page, the status codes the fallback
+    origin is tried for are answered with it when the fallback fails too.
+    """
+    status_codes = set(error_caching_ttls)
+    if error_page_path:
+        status_codes.update(fallback_status_codes)
+
+    responses = []
+    for status_code in sorted(status_codes):
+        page = {}
+        if error_page_path and status_code in fallback_status_codes:
+            page = {
+                "response_page_path": error_page_path,
+                "response_http_status": status_code,
+            }
+        ttl = error_caching_ttls.get(status_code)
+        responses.append(
+            cloudfront.ErrorResponse(
+                http_status=status_code,
+                ttl=Duration.seconds(ttl) if ttl is not None else None,
+                **page,
+            )
+        )
+    return responses
+
+
+class OriginFallbackBucket(Construct):
+    """Bucket holding the static copies served when Amplify fails.
+
+    Each branch reads the copy under its app id and branch name, through an
+    origin group that tries Amplify first.
+    """
+
+    def __init__(self, scope: Construct, id: str, options: dict):
+        super().__init__(scope, id)
+
+        self.status_codes = options["status_codes"]
+        self.error_page_path = options["error_page_path"]
+
+        self.bucket = s3.Bucket(
+            self,
+            "rBucket",
+            block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+            encryption=s3.BucketEncryption.S3_MANAGED,
+            enforce_ssl=True,
+        )
+
+        # A single identity for the distributions of every branch, each origin
+        # would otherwise create its own and add it to the bucket policy
+        self.origin_access_identity = cloudfront.OriginAccessIdentity(
+            self,
+            "rOriginAccessIdentity",
+            comment="Amplify distributions fallback origin",
+        )
+        self.bucket.grant_read(self.origin_access_identity)
+
+        self.nag_suppressions = [
+            (
+                self.bucket,
+                {
+                    "AwsSolutions-S1": "bucket only stores static copies uploaded by the user",
+                },
+                False,
+            ),
+        ]
+
+    def origin(self, app_id, branch_name):
+        return origins.S3Origin(
+            self.bucket,
+            origin_path=f"/{app_id}/{branch_name.replace('/', '-')}",
+            origin_access_identity=self.origin_access_identity,
+        )
+
+    def failover_origin(self, primary_origin, fallback_origin):
+        return origins.OriginGroup(
+            primary_origin=primary_origin,
+            fallback_origin=fallback_origin,
+            fallback_status_codes=self.status_codes,
+        )
@@ -0,0 +1,82 @@
+from aws_cdk import aws_wafv2 as waf
+
+# Destinations of the web ACL logs, WAF delivers to a single destination
+LOG_DESTINATIONS = ("cloudwatch", "firehose")
+
+# Actions a logging filter can keep, terminating actions of the web ACL and
+# requests counted by a rule or excluded from a rule group
+LOG_FILTER_ACTIONS = (
+    "ALLOW",
+    "BLOCK",
+    "COUNT",
+    "CAPTCHA",
+    "CHALLENGE",
+    "EXCLUDED_AS_COUNT",
+)
+
+# Request fields replaced by REDACTED in the logs, other names are headers
+REDACTED_REQUEST_FIELDS = {
+    "uri_path": {"uri_path": {}},
+    "query_string": {"query_string": {}},
+    "method": {"method": {}},
+}
+REDACTED_FIELDS_LIMIT = 100
+
+
+def validate_waf_logging(destination, log_filter, redacted_fields):
+    """Fail synth when the logging configuration of the web ACL is invalid."""
+    if destination not in LOG_DESTINATIONS:
+        raise ValueError(
+            f"Unknown WAF log destination '{destination}', expected one of {list(LOG_DESTINATIONS)}"
+        )
+
+    unknown = set(log_filter) - {"keep_actions", "keep_labels"}
+    if unknown:
+        raise ValueError(f"Unknown options {sorted(unknown)} for the WAF log filter")
+    unknown = set(log_filter.get("keep_actions", [])) - set(LOG_FILTER_ACTIONS)
+    if unknown:
+        raise ValueError(
+            f"Unknown actions {sorted(unknown)} in the WAF log filter, "
+            f"expected some of {list(LOG_FILTER_ACTIONS)}"
+        )
+
+    if len(redacted_fields) > REDACTED_FIELDS_LIMIT:
+        raise ValueError(
+            f"WAF logs redact at most {REDACTED_FIELDS_LIMIT} fields, got {len(redacted_fields)}"
+        )
+
+
+def logging_filter(log_filter):
+    """Filter keeping the requests with one of the actions or labels, None to keep all.
+
+    WAF has no random sampling: requests not kept are dropped from the logs but
+    still appear in the sampled requests of the web ACL.
+    """
+    conditions = [
+        {"ActionCondition": {"Action": action}}
+        for action in log_filter.get("keep_actions", [])
+    ] + [
+        {"LabelNameCondition": {"LabelName": label}}
+        for label in log_filter.get("keep_labels", [])
+    ]
+    if not conditions:
+        return None
+
+    return {
+        "DefaultBehavior": "DROP",
+        "Filters": [
+            {"Behavior": "KEEP", "Requirement": "MEETS_ANY", "Conditions": conditions}
+        ],
+    }
+
+
+def redacted_fields(fields):
+    """Request fields and headers whose values are not logged."""
+    return [
+        waf.CfnLoggingConfiguration.FieldToMatchProperty(
+            **REDACTED_REQUEST_FIELDS.get(
+                field, {"single_header": {"Name": field.lower()}}
+            )
+        )
+        for field in fields
+    ] or None
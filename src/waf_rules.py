@@ -0,0 +1,428 @@
+import re
+
+from aws_cdk import Aws
+from aws_cdk import aws_wafv2 as waf
+
+# Web ACL capacity units included in the base price of a CloudFront web ACL
+WCU_LIMIT = 1500
+
+# AWS managed rule groups available to the web ACL.
+# wcu is the capacity the rule group consumes, cost ranks how expensive the
+# group is to evaluate for each request: IP lists are a lookup on the source
+# address, inspection groups match patterns against the request and Bot Control
+# is billed for every request it inspects.
+MANAGED_RULE_GROUPS = {
+    "AWSManagedRulesAmazonIpReputationList": {
+        "rule_name": "AWS-AmazonIpReputationList",
+        "wcu": 25,
+        "cost": 1,
+    },
+    "AWSManagedRulesAnonymousIpList": {
+        "rule_name": "AWS-ManagedRulesAnonymousIpList",
+        "wcu": 50,
+        "cost": 1,
+    },
+    "AWSManagedRulesKnownBadInputsRuleSet": {
+        "rule_name": "AWS-ManagedRulesKnownBadInputsRuleSet",
+        "wcu": 200,
+        "cost": 2,
+    },
+    "AWSManagedRulesAdminProtectionRuleSet": {
+        "rule_name": "AWS-AdminProtection",
+        "wcu": 100,
+        "cost": 2,
+    },
+    "AWSManagedRulesCommonRuleSet": {
+        "rule_name": "AWS-ManagedRulesCommonRuleSet",
+        "wcu": 700,
+        "cost": 3,
+    },
+    "AWSManagedRulesBotControlRuleSet": {
+        "rule_name": "AWS-BotControl",
+        "wcu": 50,
+        "cost": 10,
+    },
+}
+
+# Rule groups of the web ACL when none are configured
+DEFAULT_MANAGED_RULE_GROUPS = {name: {} for name in MANAGED_RULE_GROUPS}
+
+# Requests excluded from a rule group by its scope-down statement, each kind is
+# matched by one regex statement on the given request field
+SCOPE_DOWN_EXCLUSIONS = {
+    "exclude_path_prefixes": {
+        "field": "uri_path",
+        "text_transformation": "NONE",
+        "pattern": "^({})",
+    },
+    # Extensions are matched case insensitively
+    "exclude_extensions": {
+        "field": "uri_path",
+        "text_transformation": "LOWERCASE",
+        "pattern": "\\.({})$",
+    },
+    "exclude_methods": {
+        "field": "method",
+        "text_transformation": "NONE",
+        "pattern": "^({})$",
+    },
+}
+REGEX_MATCH_WCU = 3
+TEXT_TRANSFORMATION_WCU = 10
+REGEX_MAX_LENGTH = 200
+
+# Custom rules, a block list lookup is the cheapest check of the web ACL and
+# rate-based rules only count requests per source address
+BLOCK_LIST_RULE_NAME = "BlockList"
+IP_SET_REFERENCE_WCU = 1
+IP_SET_COST = 0
+RATE_BASED_WCU = 2
+BYTE_MATCH_WCU = 2
+RATE_BASED_COST = 1
+RATE_LIMIT_RANGE = (100, 2000000000)
+RATE_LIMIT_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+# The cache warmer fetches pages from Lambda, whose hosting provider addresses
+# are blocked by the anonymous IP list and whose user agent is flagged by Bot
+# Control. Its requests carry a token header allowed before any other rule.
+CACHE_WARMER_RULE_NAME = "CacheWarmer"
+CACHE_WARMER_HEADER = "x-amplify-waf-warmer"
+
+
+def cache_warmer_token_secret_name(web_acl_stack_name):
+    """Name of the secret holding the token of the cache warmer requests."""
+    return f"amplify-waf/{web_acl_stack_name}/cache-warmer-token"
+
+
+def ordered_rules(
+    managed_rule_groups,
+    rate_limits=(),
+    block_list_ip_sets=(),
+    cache_warmer_token=None,
+):
+    """Return the rules of the web ACL, allow rules then cheapest to evaluate first.
+
+    Requests blocked by a cheap rule are never evaluated by the ones after it,
+    which keeps them out of the costlier inspection and Bot Control rules.
+    Each rule is a dict with its name, cost, wcu, action (None for rule
+    groups) and a statement builder.
+    """
+    rules = [
+        {
+            "name": MANAGED_RULE_GROUPS[name]["rule_name"],
+            "metric_name": f"{name}Metrics",
+            "cost": MANAGED_RULE_GROUPS[name]["cost"],
+            "wcu": rule_group_wcu(name, options),
+            "action": None,
+            "statement": lambda name=name, options=options: _managed_rule_group_statement(
+                name, options
+            ),
+        }
+        for name, options in managed_rule_groups.items()
+    ]
+
+    rules.extend(
+        {
+            "name": f"RateLimit-{rate_limit['name']}",
+            "metric_name": f"RateLimit{rate_limit['name']}Metrics",
+            "cost": RATE_BASED_COST,
+            "wcu": RATE_BASED_WCU
+            + (BYTE_MATCH_WCU if rate_limit.get("path_prefix") else 0),
+            "action": "block",
+            "statement": lambda rate_limit=rate_limit: _rate_based_statement(
+                rate_limit
+            ),
+        }
+        for rate_limit in rate_limits
+    )
+
+    if block_list_ip_sets:
+        rules.append(
+            {
+                "name": BLOCK_LIST_RULE_NAME,
+                "metric_name": f"{BLOCK_LIST_RULE_NAME}Metrics",
+                "cost": IP_SET_COST,
+                "wcu": IP_SET_REFERENCE_WCU * len(block_list_ip_sets),
+                "action": "block",
+                "statement": lambda: _block_list_statement(block_list_ip_sets),
+            }
+        )
+
+    if cache_warmer_token:
+        rules.append(
+            {
+                "name": CACHE_WARMER_RULE_NAME,
+                "metric_name": f"{CACHE_WARMER_RULE_NAME}Metrics",
+                "cost": 0,
+                "wcu": BYTE_MATCH_WCU,
+                "action": "allow",
+                "statement": lambda: _cache_warmer_statement(cache_warmer_token),
+            }
+        )
+
+    return sorted(
+        rules,
+        key=lambda rule: (
+            rule["action"] != "allow",
+            rule["cost"],
+            rule["wcu"],
+            rule["name"],
+        ),
+    )
+
+
+def validate_waf_rules(
+    managed_rule_groups,
+    rate_limits=(),
+    block_list_ip_set_count=0,
+    cache_warmer=False,
+):
+    """Fail synth when a rule is invalid or the web ACL exceeds its WCU budget."""
+    for name, options in managed_rule_groups.items():
+        if name not in MANAGED_RULE_GROUPS:
+            raise ValueError(
+                f"Unknown managed rule group '{name}', "
+                f"expected one of {sorted(MANAGED_RULE_GROUPS)}"
+            )
+
+        unknown = set(options) - {"scope_down"}
+        if unknown:
+            raise ValueError(
+                f"Unknown options {sorted(unknown)} for managed rule group '{name}'"
+            )
+
+        for kind, values in options.get("scope_down", {}).items():
+            if kind not in SCOPE_DOWN_EXCLUSIONS:
+                raise ValueError(
+                    f"Unknown scope-down exclusion '{kind}' for managed rule group '{name}', "
+                    f"expected one of {sorted(SCOPE_DOWN_EXCLUSIONS)}"
+                )
+            if len(_exclusion_pattern(kind, values)) > REGEX_MAX_LENGTH:
+                raise ValueError(
+                    f"Scope-down exclusion '{kind}' of managed rule group '{name}' is longer "
+                    f"than the {REGEX_MAX_LENGTH} characters accepted by a WAF regex"
+                )
+
+    names = set()
+    for rate_limit in rate_limits:
+        unknown = set(rate_limit) - {"name", "limit", "path_prefix"}
+        if unknown:
+            raise ValueError(
+                f"Unknown options {sorted(unknown)} for rate limit {rate_limit}"
+            )
+        if not RATE_LIMIT_NAME_PATTERN.match(str(rate_limit.get("name", ""))):
+            raise ValueError(
+                f"Rate limit {rate_limit} needs a name of letters, digits, - and _"
+            )
+        if rate_limit["name"] in names:
+            raise ValueError(
+                f"Rate limit {rate_limit['name']} is configured more than once"
+            )
+        names.add(rate_limit["name"])
+
+        if not RATE_LIMIT_RANGE[0] <= rate_limit.get("limit", 0) <= RATE_LIMIT_RANGE[1]:
+            raise ValueError(
+                f"Rate limit {rate_limit['name']} must allow between {RATE_LIMIT_RANGE[0]} "
+                f"and {RATE_LIMIT_RANGE[1]} requests per 5 minutes"
+            )
+        if not rate_limit.get("path_prefix", "/").startswith("/"):
+            raise ValueError(
+                f"Path prefix of rate limit {rate_limit['name']} must start with /"
+            )
+
+    capacity = {
+        rule["name"]: rule["wcu"]
+        for rule in ordered_rules(
+            managed_rule_groups,
+            rate_limits,
+            [None] * block_list_ip_set_count,
+            cache_warmer,
+        )
+    }
+    total = sum(capacity.values())
+    if total > WCU_LIMIT:
+        breakdown = ", ".join(f"{rule} {wcu}" for rule, wcu in capacity.items())
+        raise ValueError(
+            f"Web ACL rules use {total} WCU, above the limit of {WCU_LIMIT}: {breakdown}"
+        )
+
+    return total
+
+
+def rule_group_wcu(name, options):
+    """Capacity of a rule group including its scope-down statement."""
+    wcu = MANAGED_RULE_GROUPS[name]["wcu"]
+    for kind, values in options.get("scope_down", {}).items():
+        if values:
+            wcu += REGEX_MATCH_WCU
+            if SCOPE_DOWN_EXCLUSIONS[kind]["text_transformation"] != "NONE":
+                wcu += TEXT_TRANSFORMATION_WCU
+    return wcu
+
+
+def _exclusion_pattern(kind, values):
+    if kind == "exclude_extensions":
+        values = [value.lstrip(".").lower() for value in values]
+    return SCOPE_DOWN_EXCLUSIONS[kind]["pattern"].format(
+        "|".join(re.escape(value) for value in values)
+    )
+
+
+def scope_down_statement(scope_down):
+    """Statement matching the requests a rule group inspects, None for all of them."""
+    exclusions = [
+        waf.CfnWebACL.StatementProperty(
+            regex_match_statement=waf.CfnWebACL.RegexMatchStatementProperty(
+                field_to_match=waf.CfnWebACL.FieldToMatchProperty(
+                    **{SCOPE_DOWN_EXCLUSIONS[kind]["field"]: {}}
+                ),
+                regex_string=_exclusion_pattern(kind, values),
+                text_transformations=[
+                    waf.CfnWebACL.TextTransformationProperty(
+                        priority=0,
+                        type=SCOPE_DOWN_EXCLUSIONS[kind]["text_transformation"],
+                    )
+                ],
+            )
+        )
+        for kind, values in sorted(scope_down.items())
+        if values
+    ]
+    if not exclusions:
+        return None
+
+    # An OR statement needs at least two statements
+    excluded = (
+        exclusions[0]
+        if len(exclusions) == 1
+        else waf.CfnWebACL.StatementProperty(
+            or_statement=waf.CfnWebACL.OrStatementProperty(statements=exclusions)
+        )
+    )
+    return waf.CfnWebACL.StatementProperty(
+        not_statement=waf.CfnWebACL.NotStatementProperty(statement=excluded)
+    )
+
+
+def web_acl_metric_name():
+    """CloudWatch metric name of the web ACL, its WebACL metrics dimension."""
+    return f"WebAclMetrics-{Aws.STACK_NAME}"
+
+
+def rule_metric_name(rule):
+    """CloudWatch metric name of a rule, unique to the stack."""
+    return f"{rule['metric_name']}-{Aws.STACK_NAME}"
+
+
+def web_acl_rules(
+    managed_rule_groups,
+    rate_limits=(),
+    block_list_ip_sets=(),
+    cache_warmer_token=None,
+):
+    """Web ACL rules, in evaluation order.
+
+    block_list_ip_sets are the ARNs of the IP sets whose addresses are blocked,
+    requests with the cache_warmer_token header are allowed.
+    """
+    return [
+        waf.CfnWebACL.RuleProperty(
+            name=rule["name"],
+            priority=priority,
+            action=(
+                waf.CfnWebACL.RuleActionProperty(**{rule["action"]: {}})
+                if rule["action"]
+                else None
+            ),
+            override_action=(
+                None
+                if rule["action"]
+                else waf.CfnWebACL.OverrideActionProperty(none={})
+            ),
+            statement=rule["statement"](),
+            visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
+                cloud_watch_metrics_enabled=True,
+                metric_name=rule_metric_name(rule),
+                sampled_requests_enabled=True,
+            ),
+        )
+        for priority, rule in enumerate(
+            ordered_rules(
+                managed_rule_groups,
+                rate_limits,
+                block_list_ip_sets,
+                cache_warmer_token,
+            ),
+            start=1,
+        )
+    ]
+
+
+def _managed_rule_group_statement(name, options):
+    return waf.CfnWebACL.StatementProperty(
+        managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
+            name=name,
+            vendor_name="AWS",
+            scope_down_statement=scope_down_statement(options.get("scope_down", {})),
+        )
+    )
+
+
+def _rate_based_statement(rate_limit):
+    # Each path prefix gets its own rule, so requests are counted per source
+    # address and path prefix
+    path_prefix = rate_limit.get("path_prefix")
+    return waf.CfnWebACL.StatementProperty(
+        rate_based_statement=waf.CfnWebACL.RateBasedStatementProperty(
+            aggregate_key_type="IP",
+            limit=rate_limit["limit"],
+            scope_down_statement=(
+                waf.CfnWebACL.StatementProperty(
+                    byte_match_statement=waf.CfnWebACL.ByteMatchStatementProperty(
+                        field_to_match=waf.CfnWebACL.FieldToMatchProperty(uri_path={}),
+                        positional_constraint="STARTS_WITH",
+                        search_string=path_prefix,
+                        text_transformations=[
+                            waf.CfnWebACL.TextTransformationProperty(
+                                priority=0, type="NONE"
+                            )
+                        ],
+                    )
+                )
+                if path_prefix
+                else None
+            ),
+        )
+    )
+
+
+def _block_list_statement(ip_set_arns):
+    statements = [
+        waf.CfnWebACL.StatementProperty(
+            ip_set_reference_statement=waf.CfnWebACL.IPSetReferenceStatementProperty(
+                arn=arn
+            )
+        )
+        for arn in ip_set_arns
+    ]
+    # An OR statement needs at least two statements
+    if len(statements) == 1:
+        return statements[0]
+    return waf.CfnWebACL.StatementProperty(
+        or_statement=waf.CfnWebACL.OrStatementProperty(statements=statements)
+    )
+
+
+def _cache_warmer_statement(token):
+    return waf.CfnWebACL.StatementProperty(
+        byte_match_statement=waf.CfnWebACL.ByteMatchStatementProperty(
+            field_to_match=waf.CfnWebACL.FieldToMatchProperty(
+                single_header={"Name": CACHE_WARMER_HEADER}
+            ),
+            positional_constraint="EXACTLY",
+            search_string=token,
+            text_transformations=[
+                waf.CfnWebACL.TextTransformationProperty(priority=0, type="NONE")
+            ],
+        )
+    )
@@ -1,116 +1,228 @@
-from aws_cdk import Aws, CfnOutput, Fn, Stack
+import json
+import os
+
+from aws_cdk import Aws, CfnOutput, Duration, Fn, Stack
+from aws_cdk import aws_iam as iam
+from aws_cdk import aws_kinesisfirehose as firehose
 from aws_cdk import aws_logs as logs
+from aws_cdk import aws_s3 as s3
+from aws_cdk import aws_s3_notifications as s3n
+from aws_cdk import aws_secretsmanager as secretsmanager
 from aws_cdk import aws_wafv2 as waf
+from aws_cdk.aws_lambda import Code, Function, Runtime, Tracing
 from constructs import Construct
 
+from src.monitoring import WebAclDashboard
+from src.nag_suppressions import CDK_GENERATED_ROLE, apply_nag_suppressions
+from src.waf_logging import logging_filter, redacted_fields, validate_waf_logging
+from src.waf_rules import (
+    CACHE_WARMER_HEADER,
+    DEFAULT_MANAGED_RULE_GROUPS,
+    cache_warmer_token_secret_name,
+    ordered_rules,
+    validate_waf_rules,
+    web_acl_metric_name,
+    web_acl_rules,
+)
+
+dirname = os.path.dirname(__file__)
+
+# Web ACLs of CloudFront distributions are created in us-east-1
+WEB_ACL_REGION = "us-east-1"
+
 
 class CustomWebAclStack(Stack):
     def __init__(
         self,
         scope: Construct,
         id: str,
+        managed_rule_groups: dict = None,
+        rate_limits: list = None,
+        block_list_ip_set_shards: int = 0,
+        log_destination: str = None,
+        log_filter: dict = None,
+        log_redacted_fields: list = None,
+        cache_warmer: bool = False,
         **kwargs,
     ):
         super().__init__(scope, id, **kwargs)
-        waf_rules = [
-            # 1, AWS Bot Control rule group
-            waf.CfnWebACL.RuleProperty(
-                name="AWS-BotControl",
-                priority=1,
-                override_action=waf.CfnWebACL.OverrideActionProperty(none={}),
-                statement=waf.CfnWebACL.StatementProperty(
-                    managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
-                        name="AWSManagedRulesBotControlRuleSet", vendor_name="AWS"
-                    )
-                ),
-                visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
-                    cloud_watch_metrics_enabled=True,
-                    metric_name=f"AWSManagedRulesBotControlRuleSetMetrics-{Aws.STACK_NAME}",
-                    sampled_requests_enabled=True,
-                ),
-            ),
-            # 2 Amazon IP reputation list managed rule group
-            waf.CfnWebACL.RuleProperty(
-                name="AWS-AmazonIpReputationList",
-                priority=2,
-                override_action=waf.CfnWebACL.OverrideActionProperty(none={}),
-                statement=waf.CfnWebACL.StatementProperty(
-                    managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
-                        name="AWSManagedRulesAmazonIpReputationList", vendor_name="AWS"
-                    )
-                ),
-                visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
-                    cloud_watch_metrics_enabled=True,
-                    metric_name=f"AWSManagedRulesAmazonIpReputationListMetrics-{Aws.STACK_NAME}",
-                    sampled_requests_enabled=True,
+        managed_rule_groups = managed_rule_groups or DEFAULT_MANAGED_RULE_GROUPS
+        rate_limits = rate_limits or []
+        block_list_ip_set_shards = block_list_ip_set_shards or 0
+        log_destination = log_destination or "cloudwatch"
+        log_filter = log_filter or {}
+        log_redacted_fields = log_redacted_fields or []
+        validate_waf_rules(
+            managed_rule_groups,
+            rate_limits,
+            2 * block_list_ip_set_shards,
+            cache_warmer,
+        )
+        validate_waf_logging(log_destination, log_filter, log_redacted_fields)
+
+        nag_suppressions = []
+        cache_warmer_token = None
+        if cache_warmer:
+            # Token of the cache warmer requests, read by the cache warmer
+            # functions of every group of stacks from this region
+            cache_warmer_token_secret = secretsmanager.Secret(
+                self,
+                "rCacheWarmerTokenSecret",
+                secret_name=cache_warmer_token_secret_name(self.stack_name),
+                description="Token of the cache warmer requests allowed by the web ACL",
+                generate_secret_string=secretsmanager.SecretStringGenerator(
+                    exclude_punctuation=True, password_length=32
                 ),
-            ),
-            # 3, Anonymous IP list managed rule group
-            waf.CfnWebACL.RuleProperty(
-                name="AWS-ManagedRulesAnonymousIpList",
-                priority=3,
-                override_action=waf.CfnWebACL.OverrideActionProperty(none={}),
-                statement=waf.CfnWebACL.StatementProperty(
-                    managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
-                        name="AWSManagedRulesAnonymousIpList", vendor_name="AWS"
+            )
+            cache_warmer_token = cache_warmer_token_secret.secret_value.unsafe_unwrap()
+            # The token is not written to the logs
+            if CACHE_WARMER_HEADER not in log_redacted_fields:
+                log_redacted_fields = [*log_redacted_fields, CACHE_WARMER_HEADER]
+            nag_suppressions.append(
+                (
+                    cache_warmer_token_secret,
+                    {
+                        "AwsSolutions-SMG4": "user to rotate the token by recreating the secret",
+                    },
+                    False,
+                )
+            )
+
+        block_list_ip_sets = []
+        if block_list_ip_set_shards:
+            # IP sets hold a single IP version and a limited number of addresses,
+            # the block list is spread across shards of each version
+            ip_sets = {
+                version: [
+                    waf.CfnIPSet(
+                        self,
+                        f"rBlockListIpSet-ipv{version}-{index}",
+                        name=f"{self.stack_name}-block-list-ipv{version}-{index}",
+                        description="Addresses blocked by the web ACL, loaded from the block list bucket",
+                        addresses=[],
+                        ip_address_version=f"IPV{version}",
+                        scope="CLOUDFRONT",
                     )
-                ),
-                visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
-                    cloud_watch_metrics_enabled=True,
-                    metric_name=f"AWSManagedRulesAnonymousIpListMetrics-{Aws.STACK_NAME}",
-                    sampled_requests_enabled=True,
-                ),
-            ),
-            # 4, AWS general rules (Core rule set)
-            waf.CfnWebACL.RuleProperty(
-                name="AWS-ManagedRulesCommonRuleSet",
-                priority=4,
-                override_action=waf.CfnWebACL.OverrideActionProperty(none={}),
-                statement=waf.CfnWebACL.StatementProperty(
-                    managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
-                        name="AWSManagedRulesCommonRuleSet", vendor_name="AWS"
+                    for index in range(block_list_ip_set_shards)
+                ]
+                for version in (4, 6)
+            }
+            block_list_ip_sets = [
+                ip_set.attr_arn
+                for version_ip_sets in ip_sets.values()
+                for ip_set in version_ip_sets
+            ]
+
+            block_list_bucket = s3.Bucket(
+                self,
+                "rBlockListBucket",
+                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+            )
+
+            # IP Set Loader Lambda Execution Role
+            ip_set_loader_function_role = iam.Role(
+                self,
+                "rIpSetLoaderFunctionRole",
+                description="Role used by ip_set_loader lambda function",
+                assumed_by=iam.ServicePrincipal("lambda.amazonaws.com"),
+                managed_policies=[
+                    iam.ManagedPolicy.from_aws_managed_policy_name(
+                        "service-role/AWSLambdaBasicExecutionRole"
                     )
+                ],
+            )
+            ip_set_loader_function_role.add_to_policy(
+                iam.PolicyStatement(
+                    effect=iam.Effect.ALLOW,
+                    actions=["wafv2:GetIPSet", "wafv2:UpdateIPSet"],
+                    resources=block_list_ip_sets,
+                )
+            )
+            block_list_bucket.grant_read(ip_set_loader_function_role)
+
+            # Function loading uploaded block lists into the IP sets
+            ip_set_loader_function = Function(
+                self,
+                "rIpSetLoaderFunction",
+                description="custom function to load a block list into the web acl ip sets",
+                runtime=Runtime.PYTHON_3_9,
+                handler="lambda_function.lambda_handler",
+                code=Code.from_asset(
+                    path=os.path.join(dirname, "functions/ip_set_loader")
                 ),
-                visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
-                    cloud_watch_metrics_enabled=True,
-                    metric_name=f"AWSManagedRulesCommonRuleSetMetrics-{Aws.STACK_NAME}",
-                    sampled_requests_enabled=True,
-                ),
-            ),
-            # 5, AWS Known Bad inputs rules
-            waf.CfnWebACL.RuleProperty(
-                name="AWS-ManagedRulesKnownBadInputsRuleSet",
-                priority=5,
-                override_action=waf.CfnWebACL.OverrideActionProperty(none={}),
-                statement=waf.CfnWebACL.StatementProperty(
-                    managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
-                        name="AWSManagedRulesKnownBadInputsRuleSet",
-                        vendor_name="AWS",
-                    )
+                timeout=Duration.minutes(5),
+                memory_size=512,
+                role=ip_set_loader_function_role,
+                tracing=Tracing.ACTIVE,
+                log_retention=logs.RetentionDays.SIX_MONTHS,
+                environment={
+                    "IP_SETS": json.dumps(
+                        {
+                            version: [
+                                {"Name": ip_set.name, "Id": ip_set.attr_id}
+                                for ip_set in version_ip_sets
+                            ]
+                            for version, version_ip_sets in ip_sets.items()
+                        }
+                    ),
+                },
+                # Uploads are applied one at a time, each list replaces the previous one
+                reserved_concurrent_executions=1,
+            )
+
+            block_list_bucket.add_event_notification(
+                s3.EventType.OBJECT_CREATED,
+                s3n.LambdaDestination(ip_set_loader_function),
+            )
+
+            CfnOutput(
+                self,
+                "oBlockListBucket",
+                description="Bucket where block lists are uploaded",
+                value=block_list_bucket.bucket_name,
+            )
+
+            nag_suppressions = [
+                (
+                    block_list_bucket,
+                    {
+                        "AwsSolutions-S1": "bucket only stores block lists uploaded by the user",
+                    },
+                    False,
                 ),
-                visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
-                    cloud_watch_metrics_enabled=True,
-                    metric_name=f"AWSManagedRulesKnownBadInputsRuleSetMetrics-{Aws.STACK_NAME}",
-                    sampled_requests_enabled=True,
+                (
+                    ip_set_loader_function_role,
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
                 ),
-            ),
-            # 6, Admin protection managed rule group
-            waf.CfnWebACL.RuleProperty(
-                name="AWS-AdminProtection",
-                priority=6,
-                override_action=waf.CfnWebACL.OverrideActionProperty(none={}),
-                statement=waf.CfnWebACL.StatementProperty(
-                    managed_rule_group_statement=waf.CfnWebACL.ManagedRuleGroupStatementProperty(
-                        name="AWSManagedRulesAdminProtectionRuleSet", vendor_name="AWS"
-                    )
+                (
+                    "BucketNotificationsHandler050a0587b7544547bf325f094a3db834/Role",
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
                 ),
-                visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
-                    cloud_watch_metrics_enabled=True,
-                    metric_name=f"AWSManagedRulesAdminProtectionRuleSetMetrics-{Aws.STACK_NAME}",
-                    sampled_requests_enabled=True,
+                (
+                    "LogRetentionaae0aa3c5b4d4f87b02d85b201efdd8a/ServiceRole",
+                    {
+                        "AwsSolutions-IAM4": CDK_GENERATED_ROLE,
+                        "AwsSolutions-IAM5": CDK_GENERATED_ROLE,
+                    },
+                    True,
                 ),
-            ),
-        ]
+            ]
+
+        # Cache warmer exemption, then block list, rate-based and managed rules,
+        # cheapest to evaluate first
+        waf_rules = web_acl_rules(
+            managed_rule_groups, rate_limits, block_list_ip_sets, cache_warmer_token
+        )
 
         # Define Web Application Firewall ACL
         web_acl = waf.CfnWebACL(
@@ -121,28 +233,151 @@ class CustomWebAclStack(Stack):
             visibility_config=waf.CfnWebACL.VisibilityConfigProperty(
                 cloud_watch_metrics_enabled=True,
                 sampled_requests_enabled=True,
-                metric_name=f"WebAclMetrics-{Aws.STACK_NAME}",
+                metric_name=web_acl_metric_name(),
             ),
             rules=waf_rules,
         )
 
-        # Web ACL log group
-        web_acl_lg = logs.LogGroup(
-            self,
-            "rAmplifWebAclLogGroup",
-            retention=logs.RetentionDays.SIX_MONTHS,
-            log_group_name=f"aws-waf-logs-{Aws.STACK_NAME}",
-        )
+        if log_destination == "firehose":
+            # Bulk log delivery to S3, partitioned by action and date
+            web_acl_log_bucket = s3.Bucket(
+                self,
+                "rWebAclLogBucket",
+                block_public_access=s3.BlockPublicAccess.BLOCK_ALL,
+                encryption=s3.BucketEncryption.S3_MANAGED,
+                enforce_ssl=True,
+                lifecycle_rules=[s3.LifecycleRule(expiration=Duration.days(180))],
+            )
 
+            web_acl_log_delivery_role = iam.Role(
+                self,
+                "rWebAclLogDeliveryRole",
+                description="Role used by the delivery stream of the web acl logs",
+                assumed_by=iam.ServicePrincipal("firehose.amazonaws.com"),
+            )
+            web_acl_log_bucket.grant_read_write(web_acl_log_delivery_role)
+
+            # WAF only delivers to streams whose name starts with aws-waf-logs-
+            web_acl_log_destination = firehose.CfnDeliveryStream(
+                self,
+                "rWebAclLogDeliveryStream",
+                delivery_stream_name=f"aws-waf-logs-{Aws.STACK_NAME}",
+                delivery_stream_type="DirectPut",
+                delivery_stream_encryption_configuration_input=firehose.CfnDeliveryStream.DeliveryStreamEncryptionConfigurationInputProperty(
+                    key_type="AWS_OWNED_CMK"
+                ),
+                extended_s3_destination_configuration=firehose.CfnDeliveryStream.ExtendedS3DestinationConfigurationProperty(
+                    bucket_arn=web_acl_log_bucket.bucket_arn,
+                    role_arn=web_acl_log_delivery_role.role_arn,
+                    prefix="action=!{partitionKeyFromQuery:action}/"
+                    "year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/",
+                    error_output_prefix="errors/!{firehose:error-output-type}/"
+                    "year=!{timestamp:yyyy}/month=!{timestamp:MM}/day=!{timestamp:dd}/",
+                    compression_format="GZIP",
+                    # Dynamic partitioning buffers at least 64 MB per partition
+                    buffering_hints=firehose.CfnDeliveryStream.BufferingHintsProperty(
+                        interval_in_seconds=300, size_in_m_bs=64
+                    ),
+                    dynamic_partitioning_configuration=firehose.CfnDeliveryStream.DynamicPartitioningConfigurationProperty(
+                        enabled=True,
+                        retry_options=firehose.CfnDeliveryStream.RetryOptionsProperty(
+                            duration_in_seconds=300
+                        ),
+                    ),
+                    processing_configuration=firehose.CfnDeliveryStream.ProcessingConfigurationProperty(
+                        enabled=True,
+                        processors=[
+                            firehose.CfnDeliveryStream.ProcessorProperty(
+                                type="MetadataExtraction",
+                                parameters=[
+                                    firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                        parameter_name="MetadataExtractionQuery",
+                                        parameter_value="{action:.action}",
+                                    ),
+                                    firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                        parameter_name="JsonParsingEngine",
+                                        parameter_value="JQ-1.6",
+                                    ),
+                                ],
+                            ),
+                            # One record per line, as expected by tools/waf_log_analyzer.py
+                            firehose.CfnDeliveryStream.ProcessorProperty(
+                                type="AppendDelimiterToRecord",
+                                parameters=[
+                                    firehose.CfnDeliveryStream.ProcessorParameterProperty(
+                                        parameter_name="Delimiter",
+                                        parameter_value="\\n",
+                                    )
+                                ],
+                            ),
+                        ],
+                    ),
+                ),
+            )
+            web_acl_log_destination.node.add_dependency(web_acl_log_delivery_role)
+            web_acl_log_destination_arn = web_acl_log_destination.attr_arn
+
+            CfnOutput(
+                self,
+                "oWebAclLogBucket",
+                description="Bucket where the web acl logs are delivered",
+                value=web_acl_log_bucket.bucket_name,
+            )
+
+            nag_suppressions.extend(
+                [
+                    (
+                        web_acl_log_bucket,
+                        {
+                            "AwsSolutions-S1": "bucket only stores the web acl logs delivered by firehose",
+                        },
+                        False,
+                    ),
+                    (
+                        web_acl_log_delivery_role,
+                        {"AwsSolutions-IAM5": CDK_GENERATED_ROLE},
+                        True,
+                    ),
+                ]
+            )
+        else:
+            # Web ACL log group
+            web_acl_lg = logs.LogGroup(
+                self,
+                "rAmplifWebAclLogGroup",
+                retention=logs.RetentionDays.SIX_MONTHS,
+                log_group_name=f"aws-waf-logs-{Aws.STACK_NAME}",
+            )
+            web_acl_log_destination_arn = Fn.select(
+                0, Fn.split(":*", web_acl_lg.log_group_arn)
+            )
+
+        # Requests dropped by the filter are not ingested, redacted fields are
+        # replaced by REDACTED in the records
         waf.CfnLoggingConfiguration(
             self,
             "rAmplifWebAclLoggingConfig",
-            log_destination_configs=[
-                Fn.select(0, Fn.split(":*", web_acl_lg.log_group_arn))
-            ],
+            log_destination_configs=[web_acl_log_destination_arn],
             resource_arn=web_acl.attr_arn,
+            logging_filter=logging_filter(log_filter),
+            redacted_fields=redacted_fields(log_redacted_fields),
+        )
+
+        # Widgets are built from the same rules as the web ACL
+        WebAclDashboard(
+            self,
+            "rMonitoring",
+            web_acl_metric_name=web_acl_metric_name(),
+            rules=ordered_rules(
+                managed_rule_groups,
+                rate_limits,
+                block_list_ip_sets,
+                cache_warmer_token,
+            ),
         )
 
         self.custom_web_acl = web_acl
 
+        apply_nag_suppressions(self, nag_suppressions)
+
         CfnOutput(self, "oWebAclId", value=web_acl.attr_arn)
@@ -0,0 +1,167 @@
+"""Cache warmer against a local HTTP server standing in for CloudFront."""
+
+import os
+import socket
+import sys
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "cache_warmer",
+    ),
+)
+import warmer  # noqa: E402
+
+
+class EdgeStub(BaseHTTPRequestHandler):
+    """Answers each path with the statuses queued for it, then 200."""
+
+    statuses = {}
+    requests = []
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            # Header names are case insensitive, urllib capitalizes them
+            self.requests.append(
+                (self.path, {k.lower(): v for k, v in self.headers.items()})
+            )
+            queued = self.statuses.get(self.path, [])
+            status = queued.pop(0) if queued else 200
+
+        body = b"x" * 1000
+        self.send_response(status)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def edge():
+    EdgeStub.statuses = {}
+    EdgeStub.requests = []
+    server = ThreadingHTTPServer(("127.0.0.1", 0), EdgeStub)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield f"http://127.0.0.1:{server.server_port}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(warmer.time, "sleep", lambda seconds: None)
+
+
+def test_warm_fetches_each_path_once_with_the_warm_headers(edge):
+    results = warmer.warm(
+        edge,
+        ["/", "/docs/", "/", "/pricing/?plan=pro"],
+        concurrency=2,
+        headers={"x-amplify-waf-warmer": "token"},
+    )
+
+    assert [result["url"] for result in results] == [
+        f"{edge}/",
+        f"{edge}/docs/",
+        f"{edge}/pricing/?plan=pro",
+    ]
+    assert all(result["status"] == 200 for result in results)
+    assert sorted(path for path, _ in EdgeStub.requests) == [
+        "/",
+        "/docs/",
+        "/pricing/?plan=pro",
+    ]
+    for _, headers in EdgeStub.requests:
+        assert headers["accept-encoding"] == "br, gzip"
+        assert headers["user-agent"] == "amplify-waf-cache-warmer"
+        assert headers["x-amplify-waf-warmer"] == "token"
+
+
+def test_fetch_retries_server_errors_and_throttling(edge):
+    EdgeStub.statuses = {"/": [503, 429]}
+
+    result = warmer.fetch(f"{edge}/", timeout=5, retries=2)
+
+    assert result["status"] == 200
+    assert result["attempts"] == 3
+
+
+def test_fetch_gives_up_after_the_retries(edge):
+    EdgeStub.statuses = {"/": [503, 503, 503, 503]}
+
+    result = warmer.fetch(f"{edge}/", timeout=5, retries=2)
+
+    assert result["status"] == 503
+    assert result["attempts"] == 3
+
+
+def test_fetch_does_not_retry_client_errors(edge):
+    EdgeStub.statuses = {"/": [403]}
+
+    result = warmer.fetch(f"{edge}/", timeout=5, retries=2)
+
+    assert result["status"] == 403
+    assert result["attempts"] == 1
+
+
+def test_fetch_reports_unreachable_urls_without_status():
+    # A port just released by the system is not listened on
+    with socket.socket() as unused:
+        unused.bind(("127.0.0.1", 0))
+        port = unused.getsockname()[1]
+
+    result = warmer.fetch(f"http://127.0.0.1:{port}/", timeout=1, retries=1)
+
+    assert result["status"] is None
+    assert result["attempts"] == 2
+
+
+def test_summarize_counts_blocked_requests_as_failures(edge):
+    EdgeStub.statuses = {"/blocked/": [403], "/flaky/": [503]}
+
+    summary = warmer.summarize(
+        warmer.warm(edge, ["/", "/blocked/", "/flaky/"], retries=1)
+    )
+
+    assert summary["urls"] == 3
+    assert summary["failed"] == 1
+    assert summary["blocked"] == 1
+    assert summary["retried"] == 1
+    assert 0 <= summary["p50_ms"] <= summary["p99_ms"]
+
+
+def test_percentile_uses_the_nearest_rank():
+    values = list(range(1, 101))
+
+    assert warmer.percentile(values, 0.5) == 50
+    assert warmer.percentile(values, 0.99) == 99
+    assert warmer.percentile([7], 0.99) == 7
+    assert warmer.percentile([], 0.5) is None
+
+
+def test_sitemap_paths_keeps_the_paths_and_queries():
+    sitemap = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9">
+  <url><loc>https://www.example.com/</loc></url>
+  <url><loc> https://www.example.com/docs/intro </loc></url>
+  <url><loc>https://www.example.com/search?q=a&amp;page=2</loc></url>
+  <url><loc>https://www.example.com</loc></url>
+</urlset>"""
+
+    assert warmer.sitemap_paths(sitemap) == [
+        "/",
+        "/docs/intro",
+        "/search?q=a&page=2",
+        "/",
+    ]
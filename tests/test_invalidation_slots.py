@@ -0,0 +1,136 @@
+"""Invalidation slots semaphore against a local DynamoDB stand-in."""
+
+import os
+import sys
+import time
+import types
+
+import boto3
+import pytest
+from moto import mock_aws
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "layers",
+        "invalidation_slots",
+        "python",
+    ),
+)
+import invalidation_slots  # noqa: E402
+
+TABLE_NAME = "invalidation-slots"
+DISTRIBUTION_ID = "E123"
+
+
+@pytest.fixture
+def dynamodb():
+    with mock_aws():
+        client = boto3.client(
+            "dynamodb",
+            region_name="us-east-1",
+            aws_access_key_id="test",
+            aws_secret_access_key="test",
+        )
+        # Same key as the slots table of the automation stack
+        client.create_table(
+            TableName=TABLE_NAME,
+            KeySchema=[{"AttributeName": "DistributionId", "KeyType": "HASH"}],
+            AttributeDefinitions=[
+                {"AttributeName": "DistributionId", "AttributeType": "S"}
+            ],
+            BillingMode="PAY_PER_REQUEST",
+        )
+        yield client
+
+
+def slots_in_use(client):
+    item = client.get_item(
+        TableName=TABLE_NAME, Key={"DistributionId": {"S": DISTRIBUTION_ID}}
+    ).get("Item", {})
+    return (
+        int(item.get("WildcardSlots", {"N": "0"})["N"]),
+        int(item.get("PathSlots", {"N": "0"})["N"]),
+    )
+
+
+def acquire(client, lease_id, paths, **limits):
+    return invalidation_slots.acquire(
+        client, TABLE_NAME, DISTRIBUTION_ID, lease_id, paths, **limits
+    )
+
+
+def test_weights_count_wildcards_and_files():
+    assert invalidation_slots.weights(["/*", "/docs/*", "/index.html"]) == (2, 1)
+    assert invalidation_slots.weights([]) == (0, 0)
+
+
+def test_acquire_takes_the_slots_of_the_paths(dynamodb):
+    assert acquire(dynamodb, "a", ["/*", "/index.html", "/about.html"])
+    assert acquire(dynamodb, "b", ["/docs/*"])
+
+    assert slots_in_use(dynamodb) == (2, 2)
+
+
+def test_acquire_is_idempotent_per_lease(dynamodb):
+    assert acquire(dynamodb, "a", ["/*"], max_wildcards=1)
+    assert acquire(dynamodb, "a", ["/*"], max_wildcards=1)
+
+    assert slots_in_use(dynamodb) == (1, 0)
+
+
+def test_acquire_refuses_slots_beyond_the_quota(dynamodb):
+    assert acquire(dynamodb, "a", ["/a/*", "/b/*"], max_wildcards=3)
+    assert not acquire(dynamodb, "b", ["/c/*", "/d/*"], max_wildcards=3)
+    assert acquire(dynamodb, "c", ["/c/*"], max_wildcards=3)
+
+    assert acquire(dynamodb, "d", ["/e.html"], max_paths=2)
+    assert not acquire(dynamodb, "e", ["/f.html", "/g.html"], max_paths=2)
+    assert slots_in_use(dynamodb) == (3, 1)
+
+
+def test_acquire_rejects_batches_larger_than_a_distribution_holds(dynamodb):
+    with pytest.raises(ValueError, match="exceed the slots"):
+        acquire(dynamodb, "a", ["/a/*", "/b/*"], max_wildcards=1)
+
+
+def test_release_returns_the_slots_once(dynamodb):
+    assert acquire(dynamodb, "a", ["/*", "/index.html"], max_wildcards=1)
+
+    assert invalidation_slots.release(dynamodb, TABLE_NAME, DISTRIBUTION_ID, "a", 1, 1)
+    assert not invalidation_slots.release(
+        dynamodb, TABLE_NAME, DISTRIBUTION_ID, "a", 1, 1
+    )
+
+    assert slots_in_use(dynamodb) == (0, 0)
+    assert acquire(dynamodb, "b", ["/*"], max_wildcards=1)
+
+
+def test_acquire_reclaims_expired_leases(dynamodb, monkeypatch):
+    # Only the clock of the semaphore is moved, not the one of the SDK
+    now = time.time()
+    monkeypatch.setattr(
+        invalidation_slots,
+        "time",
+        types.SimpleNamespace(time=lambda: now - invalidation_slots.LEASE_SECONDS - 60),
+    )
+    assert acquire(dynamodb, "expired", ["/*"], max_wildcards=1)
+    monkeypatch.setattr(invalidation_slots, "time", time)
+    assert acquire(dynamodb, "live", ["/docs/*"], max_wildcards=2)
+
+    assert acquire(dynamodb, "next", ["/assets/*"], max_wildcards=2)
+
+    leases = invalidation_slots._leases(dynamodb, TABLE_NAME, DISTRIBUTION_ID)
+    assert sorted(leases) == ["live", "next"]
+    assert slots_in_use(dynamodb) == (2, 0)
+
+
+def test_acquire_keeps_live_leases(dynamodb):
+    assert acquire(dynamodb, "live", ["/*"], max_wildcards=1)
+
+    assert not acquire(dynamodb, "next", ["/docs/*"], max_wildcards=1)
+    assert sorted(
+        invalidation_slots._leases(dynamodb, TABLE_NAME, DISTRIBUTION_ID)
+    ) == ["live"]
@@ -0,0 +1,196 @@
+"""Block list loader against a stubbed WAFv2 client."""
+
+import os
+import sys
+
+import boto3
+import pytest
+from botocore.stub import Stubber
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "ip_set_loader",
+    ),
+)
+import block_list  # noqa: E402
+
+SCOPE = "CLOUDFRONT"
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(block_list.time, "sleep", lambda seconds: None)
+
+
+@pytest.fixture
+def waf_client():
+    return boto3.client(
+        "wafv2",
+        region_name="us-east-1",
+        aws_access_key_id="test",
+        aws_secret_access_key="test",
+    )
+
+
+def ip_set(name):
+    return {"Name": name, "Id": f"{name}-id"}
+
+
+def expect_update(stubber, ip_set, addresses, lock_token="token", error=None):
+    stubber.add_response(
+        "get_ip_set",
+        {
+            "IPSet": {
+                "Name": ip_set["Name"],
+                "Id": ip_set["Id"],
+                "ARN": f"arn:aws:wafv2:us-east-1:111111111111:global/ipset/{ip_set['Name']}/{ip_set['Id']}",
+                "IPAddressVersion": "IPV4",
+                "Addresses": [],
+            },
+            "LockToken": lock_token,
+        },
+        {"Name": ip_set["Name"], "Scope": SCOPE, "Id": ip_set["Id"]},
+    )
+    update_params = {
+        "Name": ip_set["Name"],
+        "Scope": SCOPE,
+        "Id": ip_set["Id"],
+        "Addresses": addresses,
+        "LockToken": lock_token,
+    }
+    if error:
+        stubber.add_client_error(
+            "update_ip_set", service_error_code=error, expected_params=update_params
+        )
+    else:
+        stubber.add_response("update_ip_set", {"NextLockToken": "next"}, update_params)
+
+
+def test_parse_ranges_skips_comments_and_invalid_entries():
+    lines = [
+        b"192.0.2.1\n",
+        "# comment only\n",
+        "198.51.100.7/24  # host bits are ignored\n",
+        "\n",
+        "not-an-address\n",
+        "10.0.0.0/33\n",
+        "2001:db8::1/64\n",
+    ]
+
+    assert list(block_list.parse_ranges(lines)) == [
+        (4, 0xC0000201, 0xC0000201),
+        (4, 0xC6336400, 0xC63364FF),
+        (6, 0x20010DB8 << 96, (0x20010DB8 << 96) | (2**64 - 1)),
+    ]
+
+
+def test_merge_ranges_dedupes_overlapping_and_adjacent_ranges_across_chunks():
+    ranges = block_list.parse_ranges(
+        [
+            "10.0.0.0/25",
+            "10.0.0.128/25",
+            "10.0.0.5",
+            "10.0.0.0/24",
+            "10.0.2.0/24",
+            "10.0.1.0/24",
+            "192.0.2.1",
+            "192.0.2.1",
+            "2001:db8::/48",
+            "2001:db8:1::/48",
+        ]
+    )
+
+    merged = block_list.merge_ranges(ranges, chunk_size=3)
+
+    assert [
+        list(block_list.to_cidrs(version, merged[version])) for version in (4, 6)
+    ] == [
+        ["10.0.0.0/23", "10.0.2.0/24", "192.0.2.1/32"],
+        ["2001:db8::/47"],
+    ]
+
+
+def test_to_cidrs_summarizes_ranges_and_splits_slash_zero():
+    merged = block_list.merge_ranges(
+        block_list.parse_ranges(["10.0.0.0/24", "10.0.1.0/25", "0.0.0.0/0"])
+    )
+    assert list(block_list.to_cidrs(4, merged[4])) == ["0.0.0.0/1", "128.0.0.0/1"]
+
+    merged = block_list.merge_ranges(
+        block_list.parse_ranges(["10.0.0.0/24", "10.0.1.0/25"])
+    )
+    assert list(block_list.to_cidrs(4, merged[4])) == ["10.0.0.0/24", "10.0.1.0/25"]
+
+
+def test_shard_addresses_fills_shards_in_order_and_pads_with_empty_ones(monkeypatch):
+    monkeypatch.setattr(block_list, "IP_SET_MAX_ADDRESSES", 2)
+
+    assert block_list.shard_addresses(["a", "b", "c"], 3) == [["a", "b"], ["c"], []]
+
+
+def test_shard_addresses_rejects_overflow(monkeypatch):
+    monkeypatch.setattr(block_list, "IP_SET_MAX_ADDRESSES", 2)
+
+    with pytest.raises(ValueError, match="5 merged addresses do not fit in 2"):
+        block_list.shard_addresses(["a", "b", "c", "d", "e"], 2)
+
+
+def test_load_block_list_writes_every_shard(waf_client, monkeypatch):
+    monkeypatch.setattr(block_list, "IP_SET_MAX_ADDRESSES", 2)
+    ip_sets = {4: [ip_set("v4-0"), ip_set("v4-1")], 6: [ip_set("v6-0")]}
+
+    with Stubber(waf_client) as stubber:
+        expect_update(stubber, ip_sets[4][0], ["10.0.0.0/24", "10.0.2.0/24"])
+        expect_update(stubber, ip_sets[4][1], ["10.0.4.0/24"])
+        expect_update(stubber, ip_sets[6][0], [])
+        loaded = block_list.load_block_list(
+            waf_client, ["10.0.0.0/24", "10.0.2.0/24", "10.0.4.0/24"], ip_sets
+        )
+        stubber.assert_no_pending_responses()
+
+    assert loaded == {4: 3, 6: 0}
+
+
+def test_load_block_list_updates_nothing_when_a_version_overflows(
+    waf_client, monkeypatch
+):
+    monkeypatch.setattr(block_list, "IP_SET_MAX_ADDRESSES", 1)
+    ip_sets = {4: [ip_set("v4-0")], 6: [ip_set("v6-0")]}
+
+    with Stubber(waf_client) as stubber:
+        with pytest.raises(ValueError, match="do not fit"):
+            block_list.load_block_list(
+                waf_client, ["10.0.0.0/24", "10.0.2.0/24"], ip_sets
+            )
+        stubber.assert_no_pending_responses()
+
+
+def test_update_ip_set_retries_with_a_new_lock_token(waf_client):
+    shard = ip_set("v4-0")
+
+    with Stubber(waf_client) as stubber:
+        expect_update(
+            stubber,
+            shard,
+            ["10.0.0.0/24"],
+            lock_token="stale",
+            error="WAFOptimisticLockException",
+        )
+        expect_update(stubber, shard, ["10.0.0.0/24"], lock_token="fresh")
+        block_list.update_ip_set(waf_client, shard, ["10.0.0.0/24"], SCOPE)
+        stubber.assert_no_pending_responses()
+
+
+def test_update_ip_set_gives_up_after_the_lock_retries(waf_client):
+    shard = ip_set("v4-0")
+
+    with Stubber(waf_client) as stubber:
+        for _ in range(block_list.LOCK_RETRIES):
+            expect_update(stubber, shard, [], error="WAFOptimisticLockException")
+        with pytest.raises(RuntimeError, match="kept changing"):
+            block_list.update_ip_set(waf_client, shard, [], SCOPE)
+        stubber.assert_no_pending_responses()
@@ -0,0 +1,212 @@
+#!/usr/bin/env python3
+"""Project the cache keys saved by the cache key normalization function.
+
+Replays a sample of request URLs through the CloudFront Function rendered from
+the cache_key_normalization options of cdk.json, run with node, and reports
+the distinct cache keys before and after normalization. Each request gets the
+cache key of the cache tier its path is mapped to by cache_behaviors, query
+strings only count in the keys of tiers caching them and requests to tiers
+that do not cache have no key. The sample holds one URL or path per line, or
+CloudFront standard access logs.
+
+    python3 tools/cache_key_report.py urls.txt
+    python3 tools/cache_key_report.py access-logs/*.gz --options '{"trailing_slash": "add"}'
+"""
+
+import argparse
+import fnmatch
+import gzip
+import json
+import os
+import subprocess
+import sys
+import tempfile
+from collections import defaultdict
+from urllib.parse import urlsplit
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+from src.cache_key_normalization import function_code  # noqa: E402
+from src.cache_tiers import CACHE_TIERS  # noqa: E402
+
+# Feeds the requests of a JSON lines file to the function, one URL per line out
+DRIVER = """
+var lines = require('fs').readFileSync(process.argv[2], 'utf8').split('\\n');
+var output = [];
+lines.forEach(function (line) {
+    if (!line) {
+        return;
+    }
+    var request = handler({request: JSON.parse(line)});
+    var query = [];
+    Object.keys(request.querystring).forEach(function (name) {
+        var parameter = request.querystring[name];
+        (parameter.multiValue || [parameter]).forEach(function (item) {
+            query.push(item.value === '' ? name : name + '=' + item.value);
+        });
+    });
+    output.push(request.uri + (query.length ? '?' + query.join('&') : ''));
+});
+process.stdout.write(output.join('\\n') + '\\n');
+"""
+
+
+def iter_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        yield from f
+
+
+def parse_requests(lines):
+    """Yield (path, query) of URL lines or CloudFront standard access log lines."""
+    fields = None
+    for line in lines:
+        line = line.rstrip("\n")
+        if line.startswith("#Fields:"):
+            fields = line.split()[1:]
+            continue
+        if not line or line.startswith("#"):
+            continue
+
+        if fields:
+            values = dict(zip(fields, line.split("\t")))
+            query = values.get("cs-uri-query", "-")
+            yield values["cs-uri-stem"], "" if query == "-" else query
+        else:
+            url = urlsplit(line.strip())
+            yield url.path or "/", url.query
+
+
+def function_request(path, query):
+    """Request of a CloudFront Function event, query values are kept encoded."""
+    querystring = {}
+    for parameter in filter(None, query.split("&")):
+        name, _, value = parameter.partition("=")
+        if name in querystring:
+            querystring[name].setdefault(
+                "multiValue", [{"value": querystring[name]["value"]}]
+            ).append({"value": value})
+        else:
+            querystring[name] = {"value": value}
+    return {"uri": path, "querystring": querystring}
+
+
+def normalize(requests, options):
+    """Return the URLs of the requests as normalized by the function."""
+    with tempfile.TemporaryDirectory() as directory:
+        script = os.path.join(directory, "function.js")
+        with open(script, "w") as f:
+            f.write(function_code(options) + DRIVER)
+
+        sample = os.path.join(directory, "requests.jsonl")
+        with open(sample, "w") as f:
+            for path, query in requests:
+                f.write(json.dumps(function_request(path, query)) + "\n")
+
+        output = subprocess.run(
+            ["node", script, sample], check=True, capture_output=True, text=True
+        ).stdout
+    return output.splitlines()
+
+
+def behavior_tier(path, cache_behaviors, default_cache_tier):
+    """Cache tier of the behavior CloudFront selects for a path, behaviors are tried in order."""
+    for path_pattern, tier_name in cache_behaviors.items():
+        # CloudFront path patterns are case sensitive, the leading / is optional
+        if not path_pattern.startswith(("/", "*")):
+            path_pattern = f"/{path_pattern}"
+        if fnmatch.fnmatchcase(path, path_pattern):
+            return tier_name
+    return default_cache_tier
+
+
+def cache_key(path, query, tier_name):
+    """Path and query string parts of the cache key of a tier caching responses."""
+    if CACHE_TIERS[tier_name]["cache_query_strings"] and query:
+        return f"{path}?{query}"
+    return path
+
+
+def report(requests, normalized, top, cache_behaviors, default_cache_tier):
+    keys = defaultdict(lambda: (set(), set()))
+    variants = defaultdict(set)
+    uncached = 0
+    for (path, query), url in zip(requests, normalized):
+        # The behavior is selected on the viewer's path, before the function runs
+        tier_name = behavior_tier(path, cache_behaviors, default_cache_tier)
+        if CACHE_TIERS[tier_name]["max_ttl"] == 0:
+            uncached += 1
+            continue
+
+        normalized_path, _, normalized_query = url.partition("?")
+        before = cache_key(path, query, tier_name)
+        after = cache_key(normalized_path, normalized_query, tier_name)
+        keys[tier_name][0].add(before)
+        keys[tier_name][1].add(after)
+        variants[after].add(before)
+
+    return {
+        "requests": len(requests),
+        "uncached_requests": uncached,
+        "keys": (
+            sum(len(before) for before, _ in keys.values()),
+            sum(len(after) for _, after in keys.values()),
+        ),
+        "keys_by_tier": {
+            tier_name: (len(before), len(after))
+            for tier_name, (before, after) in sorted(keys.items())
+        },
+        "most_merged": sorted(
+            ((key, len(merged)) for key, merged in variants.items() if len(merged) > 1),
+            key=lambda item: item[1],
+            reverse=True,
+        )[:top],
+    }
+
+
+def reduction(keys):
+    before, after = keys
+    return f"{before} -> {after} ({1 - after / max(1, before):.1%} fewer)"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="URL samples or access log files")
+    parser.add_argument(
+        "--options",
+        help="Normalization options as JSON, defaults to cache_key_normalization in cdk.json",
+    )
+    parser.add_argument("--top", type=int, default=10)
+    args = parser.parse_args()
+
+    with open(os.path.join(ROOT, "cdk.json")) as f:
+        context = json.load(f)["context"]
+    if args.options:
+        options = json.loads(args.options)
+    else:
+        options = context.get("cache_key_normalization") or {}
+
+    requests = [
+        request for path in args.paths for request in parse_requests(iter_lines(path))
+    ]
+    result = report(
+        requests,
+        normalize(requests, options),
+        args.top,
+        context.get("cache_behaviors") or {},
+        context.get("default_cache_tier") or "default",
+    )
+
+    print(
+        f"{result['requests']} requests, {result['uncached_requests']} to tiers that do not cache"
+    )
+    print(f"  cache keys: {reduction(result['keys'])}")
+    for tier_name, keys in result["keys_by_tier"].items():
+        print(f"    {tier_name:<10} {reduction(keys)}")
+    print("\nCache keys merging the most URLs")
+    for key, count in result["most_merged"]:
+        print(f"  {count:>8}  {key}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+"""Write a deployment manifest for the cache invalidation function.
+
+Run this as the last step of the Amplify build, pointing it at the artifacts
+base directory. The manifest maps every file path to a SHA-256 digest of its
+content and is written into the same directory so it gets deployed with the app.
+
+    python3 generate_deploy_manifest.py build --output deploy-manifest.json
+"""
+
+import argparse
+import hashlib
+import json
+import os
+
+CHUNK_SIZE = 1024 * 1024
+
+
+def file_digest(path):
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def build_manifest(root, output_name):
+    manifest = {}
+    for directory, _, files in os.walk(root):
+        for name in files:
+            path = os.path.join(directory, name)
+            relative_path = os.path.relpath(path, root).replace(os.sep, "/")
+            if relative_path != output_name:
+                manifest[f"/{relative_path}"] = file_digest(path)
+    return manifest
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("root", help="Amplify artifacts base directory")
+    parser.add_argument("--output", default="deploy-manifest.json")
+    args = parser.parse_args()
+
+    manifest = build_manifest(args.root, args.output)
+    with open(os.path.join(args.root, args.output), "w") as f:
+        json.dump(manifest, f, sort_keys=True)
+
+    print(f"Wrote {len(manifest)} entries to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,75 @@
+#!/usr/bin/env python3
+"""Load a block list of IP addresses and CIDRs into the web ACL IP sets.
+
+The list is streamed, deduplicated and merged into the fewest CIDRs, then
+written to the block list IP set shards created by CustomWebAclStack.
+Uploading the list to the block list bucket of the stack has the same effect.
+
+    python3 tools/load_ip_block_list.py block-list.txt --stack-name CustomWebAclStack
+"""
+
+import argparse
+import os
+import re
+import sys
+
+import boto3
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "ip_set_loader",
+    ),
+)
+from block_list import load_block_list  # noqa: E402
+
+
+def find_ip_sets(client, stack_name):
+    """Return the block list IP set shards of a stack for each IP version."""
+    pattern = re.compile(rf"^{re.escape(stack_name)}-block-list-ipv([46])-(\d+)$")
+    ip_sets = {4: [], 6: []}
+    params = {"Scope": "CLOUDFRONT"}
+    while True:
+        response = client.list_ip_sets(**params)
+        for ip_set in response["IPSets"]:
+            match = pattern.match(ip_set["Name"])
+            if match:
+                ip_sets[int(match.group(1))].append(
+                    (int(match.group(2)), {"Name": ip_set["Name"], "Id": ip_set["Id"]})
+                )
+        if not response.get("NextMarker"):
+            break
+        params["NextMarker"] = response["NextMarker"]
+
+    return {
+        version: [ip_set for _, ip_set in sorted(shards)]
+        for version, shards in ip_sets.items()
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("block_list", help="Block list file, - for standard input")
+    parser.add_argument("--stack-name", default="CustomWebAclStack")
+    args = parser.parse_args()
+
+    # CloudFront IP sets are managed in us-east-1
+    client = boto3.client("wafv2", region_name="us-east-1")
+    ip_sets = find_ip_sets(client, args.stack_name)
+    if not any(ip_sets.values()):
+        parser.error(f"No block list IP sets found for stack {args.stack_name}")
+
+    if args.block_list == "-":
+        loaded = load_block_list(client, sys.stdin, ip_sets)
+    else:
+        with open(args.block_list) as f:
+            loaded = load_block_list(client, f, ip_sets)
+
+    print(f"Loaded {loaded[4]} IPv4 and {loaded[6]} IPv6 addresses")
+
+
+if __name__ == "__main__":
+    main()
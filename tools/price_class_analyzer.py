@@ -0,0 +1,471 @@
+#!/usr/bin/env python3
+"""Recommend a distribution price class from CloudFront standard access logs.
+
+Requests, bytes and time taken are aggregated by edge location, by CloudFront
+pricing region and, given an IP to country file, by viewer country. Each price
+class is then projected: requests served by edge locations outside the class
+move to the nearest pricing region of the class, billed at its rates and
+slowed by a rough round trip estimate. The recommendation is the cheapest
+class whose mean time taken grows by at most --max-added-ms over all requests.
+
+Logs are streamed line by line, and files are spread across worker processes
+whose summaries are merged. Logs recorded with PriceClass_All give the edge
+locations viewers would use without restriction:
+
+    aws s3 sync s3://<ACCESS LOGS BUCKET>/<APP ID>/<BRANCH NAME>/ access-logs/
+    python3 tools/price_class_analyzer.py access-logs/ --countries dbip-country-lite.csv
+
+The country file holds one range per line, either first,last,country as in
+the DB-IP lite country CSV or network,country with a CIDR network.
+"""
+
+import argparse
+import bisect
+import json
+import os
+import socket
+import sys
+from collections import Counter
+from multiprocessing import Pool
+
+from waf_log_analyzer import iter_lines, log_files
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "ip_set_loader",
+    ),
+)
+from block_list import parse_range  # noqa: E402
+
+# Price classes from the cheapest edge locations only to every edge location
+PRICE_CLASSES = ["PriceClass_100", "PriceClass_200", "PriceClass_All"]
+
+# CloudFront pricing regions with the narrowest price class serving them, the
+# on-demand rates of the first 10 TB per GB and of 10,000 HTTPS requests, and
+# where their viewers are served from by the classes that exclude them, with a
+# rough estimate of the added round trip in milliseconds
+PRICING_REGIONS = {
+    "north_america": {
+        "price_class": "PriceClass_100",
+        "gb": 0.085,
+        "requests": 0.0100,
+        "fallback": {},
+    },
+    "europe": {
+        "price_class": "PriceClass_100",
+        "gb": 0.085,
+        "requests": 0.0120,
+        "fallback": {},
+    },
+    "middle_east_africa": {
+        "price_class": "PriceClass_200",
+        "gb": 0.110,
+        "requests": 0.0160,
+        "fallback": {"PriceClass_100": ("europe", 70)},
+    },
+    "japan": {
+        "price_class": "PriceClass_200",
+        "gb": 0.114,
+        "requests": 0.0120,
+        "fallback": {"PriceClass_100": ("north_america", 100)},
+    },
+    "asia": {
+        "price_class": "PriceClass_200",
+        "gb": 0.120,
+        "requests": 0.0120,
+        "fallback": {"PriceClass_100": ("north_america", 150)},
+    },
+    "india": {
+        "price_class": "PriceClass_200",
+        "gb": 0.109,
+        "requests": 0.0120,
+        "fallback": {"PriceClass_100": ("europe", 110)},
+    },
+    "south_america": {
+        "price_class": "PriceClass_All",
+        "gb": 0.110,
+        "requests": 0.0220,
+        "fallback": {
+            "PriceClass_100": ("north_america", 110),
+            "PriceClass_200": ("north_america", 110),
+        },
+    },
+    "australia": {
+        "price_class": "PriceClass_All",
+        "gb": 0.114,
+        "requests": 0.0125,
+        "fallback": {
+            "PriceClass_100": ("north_america", 150),
+            "PriceClass_200": ("asia", 90),
+        },
+    },
+}
+# Edge locations missing from the table are assumed to keep serving their
+# viewers, billed at the cheapest rates
+UNKNOWN_REGION = "unknown"
+
+# Airport codes starting the edge location names of each pricing region
+EDGE_LOCATION_CODES = {
+    "north_america": (
+        "ANC ATL AUS BNA BOS CLT CMH DEN DFW DTW EWR HIO HNL IAD IAH IND JAX JFK LAS LAX "
+        "MCI MIA MSP OKC OMA ORD PDX PHL PHX PIT RDU SEA SFO SJC SLC STL TPA YTO YUL YVR "
+        "YYC YYZ MEX QRO"
+    ),
+    "europe": (
+        "AMS ARN ATH BCN BER BRU BUD CDG CPH DUB DUS EDI FCO FRA HAM HEL LHR LIS LYS MAD "
+        "MAN MRS MUC MXP OSL OTP PMO PRG SOF TXL VIE WAW ZAG ZRH TLV"
+    ),
+    "middle_east_africa": "BAH CAI CPT DOH DXB FJR JED JNB LOS MCT NBO RUH",
+    "japan": "HND KIX NRT",
+    "asia": "BKK CGK HAN HKG ICN KUL MNL SGN SIN TPE",
+    "india": "BLR BOM CCU DEL HYD MAA PNQ",
+    "south_america": "BOG EZE FOR GIG GRU LIM POA SCL",
+    "australia": "AKL BNE MEL PER SYD",
+}
+EDGE_LOCATION_REGIONS = {
+    code: region
+    for region, codes in EDGE_LOCATION_CODES.items()
+    for code in codes.split()
+}
+
+GIGABYTE = 1024**3
+# Viewer addresses remembered by the country lookup, cleared beyond
+COUNTRY_MEMO_SIZE = 200000
+
+
+def edge_location_region(edge_location):
+    return EDGE_LOCATION_REGIONS.get(edge_location[:3], UNKNOWN_REGION)
+
+
+def serving_region(region, price_class):
+    """Pricing region and added milliseconds of the viewers of region under price_class."""
+    if region == UNKNOWN_REGION or PRICE_CLASSES.index(
+        PRICING_REGIONS[region]["price_class"]
+    ) <= PRICE_CLASSES.index(price_class):
+        return region, 0
+    return PRICING_REGIONS[region]["fallback"][price_class]
+
+
+def rates(region):
+    return PRICING_REGIONS["north_america" if region == UNKNOWN_REGION else region]
+
+
+class CountryIndex:
+    """Sorted address ranges of each IP version with their country, searched by bisection."""
+
+    def __init__(self, lines):
+        ranges = {4: [], 6: []}
+        for line in lines:
+            columns = [column.strip().strip('"') for column in line.split(",")]
+            try:
+                if len(columns) >= 3:
+                    (version, first), (_, last) = _address(columns[0]), _address(
+                        columns[1]
+                    )
+                    country = columns[2]
+                else:
+                    version, first, last = parse_range(columns[0])
+                    country = columns[1]
+            except (IndexError, OSError, ValueError):
+                # Headers and invalid lines
+                continue
+            ranges[version].append((first, last, country))
+
+        self.ranges = {}
+        for version, version_ranges in ranges.items():
+            version_ranges.sort()
+            self.ranges[version] = (
+                [first for first, _, _ in version_ranges],
+                version_ranges,
+            )
+        self._memo = {}
+
+    def __call__(self, ip):
+        try:
+            return self._memo[ip]
+        except KeyError:
+            pass
+        if len(self._memo) >= COUNTRY_MEMO_SIZE:
+            self._memo.clear()
+
+        country = None
+        try:
+            version, value = _address(ip)
+        except (OSError, ValueError):
+            version = None
+        if version:
+            firsts, ranges = self.ranges[version]
+            index = bisect.bisect_right(firsts, value) - 1
+            if index >= 0 and value <= ranges[index][1]:
+                country = ranges[index][2]
+        self._memo[ip] = country
+        return country
+
+
+def _address(ip):
+    family, version = (socket.AF_INET6, 6) if ":" in ip else (socket.AF_INET, 4)
+    return version, int.from_bytes(socket.inet_pton(family, ip), "big")
+
+
+class AccessLogSummary:
+    """Requests, bytes and milliseconds taken by edge location, pricing region and country.
+
+    Time taken is kept as a histogram of milliseconds per pricing region, which
+    percentiles and projections are computed from.
+    """
+
+    def __init__(self):
+        self.records = 0
+        self.invalid_records = 0
+        self.dates = set()
+        self.edge_locations = {}
+        self.regions = {}
+        self.countries = {}
+        self.latencies = {}
+
+    def add(self, edge_location, country, sc_bytes, milliseconds):
+        self.records += 1
+        region = edge_location_region(edge_location)
+        for table, key in (
+            (self.edge_locations, edge_location),
+            (self.regions, region),
+            (self.countries, country),
+        ):
+            if key is None:
+                continue
+            totals = table.get(key)
+            if totals is None:
+                totals = table[key] = [0, 0, 0]
+            totals[0] += 1
+            totals[1] += sc_bytes
+            totals[2] += milliseconds
+
+        histogram = self.latencies.get(region)
+        if histogram is None:
+            histogram = self.latencies[region] = Counter()
+        histogram[milliseconds] += 1
+
+    def merge(self, other):
+        self.records += other.records
+        self.invalid_records += other.invalid_records
+        self.dates |= other.dates
+        for name in ("edge_locations", "regions", "countries"):
+            table = getattr(self, name)
+            for key, (requests, sc_bytes, milliseconds) in getattr(other, name).items():
+                totals = table.setdefault(key, [0, 0, 0])
+                totals[0] += requests
+                totals[1] += sc_bytes
+                totals[2] += milliseconds
+        for region, histogram in other.latencies.items():
+            self.latencies.setdefault(region, Counter()).update(histogram)
+
+    def project(self, price_class):
+        """Cost and time taken of the logged requests if served under price_class."""
+        cost = 0.0
+        moved = 0
+        histogram = Counter()
+        for region, (requests, sc_bytes, _) in self.regions.items():
+            serving, added = serving_region(region, price_class)
+            cost += (
+                sc_bytes / GIGABYTE * rates(serving)["gb"]
+                + requests / 10000 * rates(serving)["requests"]
+            )
+            if serving != region:
+                moved += requests
+            for milliseconds, count in self.latencies[region].items():
+                histogram[milliseconds + added] += count
+
+        return {
+            "price_class": price_class,
+            "cost": cost,
+            # Monthly estimate from the days covered by the logs
+            "monthly_cost": cost * 30 / max(1, len(self.dates)),
+            "moved_requests": moved,
+            "mean_ms": _mean(histogram),
+            "p90_ms": _percentile(histogram, 0.9),
+        }
+
+    def report(self, n, max_added_ms):
+        projections = [self.project(price_class) for price_class in PRICE_CLASSES]
+        baseline = projections[-1]
+        # Cheapest class within the latency budget, the wider one on a tie
+        candidates = [
+            projection
+            for projection in projections
+            if projection["mean_ms"] - baseline["mean_ms"] <= max_added_ms
+        ]
+        recommended = min(
+            reversed(candidates), key=lambda projection: round(projection["cost"], 6)
+        )
+
+        def rows(table):
+            return [
+                {
+                    "key": key,
+                    "requests": requests,
+                    "gb": sc_bytes / GIGABYTE,
+                    "mean_ms": milliseconds / requests,
+                }
+                for key, (requests, sc_bytes, milliseconds) in sorted(
+                    table.items(), key=lambda item: item[1][0], reverse=True
+                )[:n]
+            ]
+
+        return {
+            "records": self.records,
+            "invalid_records": self.invalid_records,
+            "days": len(self.dates),
+            "regions": [
+                {**row, "p90_ms": _percentile(self.latencies[row["key"]], 0.9)}
+                for row in rows(self.regions)
+            ],
+            "edge_locations": rows(self.edge_locations),
+            "countries": rows(self.countries),
+            "projections": projections,
+            "recommended": recommended["price_class"],
+        }
+
+
+def _mean(histogram):
+    count = sum(histogram.values())
+    return sum(value * n for value, n in histogram.items()) / count if count else 0
+
+
+def _percentile(histogram, fraction):
+    count = sum(histogram.values())
+    seen = 0
+    for value in sorted(histogram):
+        seen += histogram[value]
+        if seen >= fraction * count:
+            return value
+    return 0
+
+
+countries = None
+
+
+def _init_worker(countries_path):
+    global countries
+    if countries_path:
+        countries = CountryIndex(iter_lines(countries_path))
+
+
+def summarize_file(path):
+    summary = AccessLogSummary()
+    indexes = None
+    for line in iter_lines(path):
+        if line.startswith("#"):
+            if line.startswith("#Fields:"):
+                fields = line.split()[1:]
+                indexes = [
+                    fields.index(name)
+                    for name in (
+                        "date",
+                        "x-edge-location",
+                        "c-ip",
+                        "sc-bytes",
+                        "time-taken",
+                    )
+                ]
+            continue
+        if not indexes:
+            summary.invalid_records += 1
+            continue
+
+        values = line.rstrip("\n").split("\t")
+        try:
+            date, edge_location, ip, sc_bytes, time_taken = (
+                values[index] for index in indexes
+            )
+            sc_bytes = int(sc_bytes)
+            milliseconds = round(1000 * float(time_taken))
+        except (IndexError, ValueError):
+            summary.invalid_records += 1
+            continue
+        summary.dates.add(date)
+        summary.add(
+            edge_location, countries(ip) if countries else None, sc_bytes, milliseconds
+        )
+    return summary
+
+
+def summarize(paths, countries_path=None, workers=None):
+    """Summarize access log files, in parallel across worker processes."""
+    summary = AccessLogSummary()
+    if workers == 1 or len(paths) < 2:
+        _init_worker(countries_path)
+        for path in paths:
+            summary.merge(summarize_file(path))
+        return summary
+
+    with Pool(workers, _init_worker, (countries_path,)) as pool:
+        for file_summary in pool.imap_unordered(summarize_file, paths):
+            summary.merge(file_summary)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Log files or directories")
+    parser.add_argument("--countries", help="IP ranges to country CSV file")
+    parser.add_argument(
+        "--max-added-ms",
+        type=float,
+        default=10,
+        help="Mean time taken a cheaper price class may add over all requests",
+    )
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    summary = summarize(
+        list(log_files(args.paths)), args.countries, workers=args.workers
+    )
+    report = summary.report(args.top, args.max_added_ms)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print(
+        f"{report['records']} requests over {report['days']} days "
+        f"({report['invalid_records']} invalid lines)"
+    )
+    for title, name in (
+        ("pricing regions", "regions"),
+        ("edge locations", "edge_locations"),
+        ("viewer countries", "countries"),
+    ):
+        if not report[name]:
+            continue
+        print(f"\nTop {title}")
+        print(f"  {'':<20} {'requests':>12} {'GB':>10} {'mean ms':>8}")
+        for row in report[name]:
+            print(
+                f"  {row['key']:<20} {row['requests']:>12} {row['gb']:>10.2f} {row['mean_ms']:>8.0f}"
+            )
+
+    print("\nProjected price classes")
+    print(
+        f"  {'':<16} {'cost $':>10} {'monthly $':>10} {'moved':>10} {'mean ms':>8} {'p90 ms':>7}"
+    )
+    for projection in report["projections"]:
+        print(
+            f"  {projection['price_class']:<16} {projection['cost']:>10.2f} "
+            f"{projection['monthly_cost']:>10.2f} {projection['moved_requests']:>10} "
+            f"{projection['mean_ms']:>8.0f} {projection['p90_ms']:>7}"
+        )
+    print(
+        f"\nRecommended, in cdk.json or the branch of branches_config:\n"
+        f'  "price_class": "{report["recommended"]}"'
+    )
+
+
+if __name__ == "__main__":
+    main()
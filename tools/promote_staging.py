@@ -0,0 +1,302 @@
+#!/usr/bin/env python3
+"""Compare the staging distributions of a stack with their primary ones and promote them.
+
+Without --promote, prints the requests, cache hit rate, origin latency and
+error rates of each primary and staging distribution over the last hours.
+With --promote, the configuration of each staging distribution is copied to
+its primary distribution, and staging_distribution config is folded into the
+top level settings of cdk.json, so that the next deployment keeps the promoted
+settings and removes the staging distributions.
+
+    python3 tools/promote_staging.py --stack-name CustomAmplifyDistributionStack --hours 24
+    python3 tools/promote_staging.py --stack-name CustomAmplifyDistributionStack --promote
+"""
+
+import argparse
+import datetime
+import json
+import os
+import re
+
+import boto3
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+WHITESPACE = re.compile(r"\s*")
+
+# CloudFront publishes the metrics of every distribution in us-east-1
+GLOBAL_METRICS_REGION = "us-east-1"
+
+# Compared metrics, the cache hit rate and origin latency are only published
+# with the additional metrics subscription
+COMPARISON_METRICS = [
+    ("requests", "Requests", "Sum"),
+    ("cache_hit_rate", "CacheHitRate", "Average"),
+    ("origin_latency_p90", "OriginLatency", "p90"),
+    ("4xx_error_rate", "4xxErrorRate", "Average"),
+    ("5xx_error_rate", "5xxErrorRate", "Average"),
+]
+
+
+def find_distributions(client, stack_name):
+    """Return the (primary, staging) distribution ids of each branch with a staging distribution.
+
+    Both are read from the lookup tables of the distribution stack, keyed by
+    app id and branch name.
+    """
+    lookup = {}
+    for table in ("distributions", "staging-distributions"):
+        prefix = f"/amplify-waf/{stack_name}/{table}/"
+        ids = lookup.setdefault(table, {})
+        for page in client.get_paginator("get_parameters_by_path").paginate(
+            Path=prefix, Recursive=True
+        ):
+            for parameter in page["Parameters"]:
+                ids[parameter["Name"][len(prefix) :]] = parameter["Value"]
+
+    return {
+        branch: (lookup["distributions"][branch], staging_id)
+        for branch, staging_id in sorted(lookup["staging-distributions"].items())
+        if branch in lookup["distributions"]
+    }
+
+
+def compare(client, distribution_ids, hours):
+    """Return each comparison metric of each distribution over the last hours, None without data."""
+    end = datetime.datetime.now(datetime.timezone.utc)
+    queries = [
+        {
+            "Id": f"m{index}x{metric_index}",
+            "MetricStat": {
+                "Metric": {
+                    "Namespace": "AWS/CloudFront",
+                    "MetricName": metric_name,
+                    "Dimensions": [
+                        {"Name": "DistributionId", "Value": distribution_id},
+                        {"Name": "Region", "Value": "Global"},
+                    ],
+                },
+                # A single data point covering the whole window
+                "Period": hours * 3600,
+                "Stat": statistic,
+            },
+        }
+        for index, distribution_id in enumerate(distribution_ids)
+        for metric_index, (_, metric_name, statistic) in enumerate(COMPARISON_METRICS)
+    ]
+
+    values = {}
+    # GetMetricData accepts at most 500 queries per call
+    for start in range(0, len(queries), 500):
+        params = {
+            "MetricDataQueries": queries[start : start + 500],
+            "StartTime": end - datetime.timedelta(hours=hours),
+            "EndTime": end,
+        }
+        while True:
+            response = client.get_metric_data(**params)
+            for result in response["MetricDataResults"]:
+                if result["Values"]:
+                    values[result["Id"]] = result["Values"][0]
+            if not response.get("NextToken"):
+                break
+            params["NextToken"] = response["NextToken"]
+
+    return {
+        distribution_id: {
+            name: values.get(f"m{index}x{metric_index}")
+            for metric_index, (name, _, _) in enumerate(COMPARISON_METRICS)
+        }
+        for index, distribution_id in enumerate(distribution_ids)
+    }
+
+
+def promote(client, primary_id, staging_id):
+    """Copy the staging distribution configuration to the primary one and wait for it to deploy."""
+    primary_etag = client.get_distribution(Id=primary_id)["ETag"]
+    staging_etag = client.get_distribution(Id=staging_id)["ETag"]
+    client.update_distribution_with_staging_config(
+        Id=primary_id,
+        StagingDistributionId=staging_id,
+        IfMatch=f"{primary_etag}, {staging_etag}",
+    )
+    client.get_waiter("distribution_deployed").wait(Id=primary_id)
+
+
+def _skip_whitespace(text, index):
+    return WHITESPACE.match(text, index).end()
+
+
+def object_members(text, index):
+    """Return the span of each member of the JSON object starting at index.
+
+    Spans are (key start, value start, value end) offsets in text, so that
+    single values can be replaced without reformatting the rest of the file.
+    """
+    decoder = json.JSONDecoder()
+    members = {}
+    index = _skip_whitespace(text, index + 1)
+    while text[index] != "}":
+        key, value_start = decoder.raw_decode(text, index)
+        key_start = index
+        value_start = _skip_whitespace(text, _skip_whitespace(text, value_start) + 1)
+        _, value_end = decoder.raw_decode(text, value_start)
+        members[key] = (key_start, value_start, value_end)
+        index = _skip_whitespace(text, value_end)
+        if text[index] == ",":
+            index = _skip_whitespace(text, index + 1)
+    return members
+
+
+def render_value(value, indent):
+    """Render a value in the style of cdk.json, nested lines indented as its key."""
+    return json.dumps(value, indent=2, separators=(",", ":")).replace(
+        "\n", "\n" + indent
+    )
+
+
+def fold_staging_config(path):
+    """Apply staging_distribution config to the top level settings of cdk.json.
+
+    Only the changed settings are rewritten, in place, keeping the formatting
+    and order of the rest of the file. Returns the names of the settings
+    changed, None when cdk.json has no staging distribution.
+    """
+    with open(path) as f:
+        text = f.read()
+
+    context_start = object_members(text, _skip_whitespace(text, 0))["context"][1]
+    members = object_members(text, context_start)
+    if "staging_distribution" not in members:
+        return None
+    staging_distribution = json.loads(text[slice(*members["staging_distribution"][1:])])
+    if staging_distribution is None:
+        return None
+
+    staging_key_start = members["staging_distribution"][0]
+    line_start = text.rindex("\n", 0, staging_key_start) + 1
+    indent = text[line_start:staging_key_start]
+
+    config = staging_distribution.get("config", {})
+    # (start, end, replacement), applied from the end of the file
+    edits = [(*members["staging_distribution"][1:], "null")]
+    for name, value in config.items():
+        # false turns off a setting in the staging config
+        rendered = render_value(None if value is False else value, indent)
+        if name in members:
+            edits.append((*members[name][1:], rendered))
+        else:
+            edits.append(
+                (
+                    staging_key_start,
+                    staging_key_start,
+                    f"{json.dumps(name)}:{rendered},\n{indent}",
+                )
+            )
+
+    for start, end, replacement in sorted(
+        edits, key=lambda edit: edit[:2], reverse=True
+    ):
+        text = text[:start] + replacement + text[end:]
+
+    with open(path, "w") as f:
+        f.write(text)
+    return sorted(config)
+
+
+def format_value(name, value):
+    if value is None:
+        return "-"
+    if name == "requests":
+        return f"{value:.0f}"
+    return f"{value:.2f}"
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--stack-name", default="CustomAmplifyDistributionStack")
+    parser.add_argument(
+        "--hours", type=int, default=24, help="Compared window, up to now"
+    )
+    parser.add_argument(
+        "--promote",
+        action="store_true",
+        help="Promote the staging distributions and update cdk.json",
+    )
+    parser.add_argument(
+        "--min-requests",
+        type=int,
+        default=1000,
+        help="Requests each staging distribution must have served in the window to be promoted",
+    )
+    parser.add_argument("--cdk-json", default=os.path.join(ROOT, "cdk.json"))
+    parser.add_argument(
+        "--json", action="store_true", help="Print the comparison as JSON"
+    )
+    args = parser.parse_args()
+
+    distributions = find_distributions(boto3.client("ssm"), args.stack_name)
+    if not distributions:
+        parser.error(f"No staging distributions found for stack {args.stack_name}")
+
+    metrics = compare(
+        boto3.client("cloudwatch", region_name=GLOBAL_METRICS_REGION),
+        [distribution_id for ids in distributions.values() for distribution_id in ids],
+        args.hours,
+    )
+
+    if args.json:
+        print(
+            json.dumps(
+                {
+                    branch: {
+                        "primary": {"id": primary_id, **metrics[primary_id]},
+                        "staging": {"id": staging_id, **metrics[staging_id]},
+                    }
+                    for branch, (primary_id, staging_id) in distributions.items()
+                },
+                indent=2,
+            )
+        )
+    else:
+        for branch, (primary_id, staging_id) in distributions.items():
+            print(f"{branch} over the last {args.hours} hours")
+            print(f"  {'':<20} {'primary':>12} {'staging':>12}")
+            for name, _, _ in COMPARISON_METRICS:
+                print(
+                    f"  {name:<20} {format_value(name, metrics[primary_id][name]):>12} "
+                    f"{format_value(name, metrics[staging_id][name]):>12}"
+                )
+
+    if not args.promote:
+        return
+
+    too_few = [
+        branch
+        for branch, (_, staging_id) in distributions.items()
+        if (metrics[staging_id]["requests"] or 0) < args.min_requests
+    ]
+    if too_few:
+        parser.error(
+            f"Staging distributions of {', '.join(too_few)} served fewer than "
+            f"{args.min_requests} requests, lower --min-requests to promote them anyway"
+        )
+
+    # Every branch of the stack shares the staging settings, they are promoted together
+    cloudfront = boto3.client("cloudfront")
+    for branch, (primary_id, staging_id) in distributions.items():
+        print(f"Promoting {staging_id} to {primary_id} ({branch})")
+        promote(cloudfront, primary_id, staging_id)
+
+    changed = fold_staging_config(args.cdk_json)
+    if changed is None:
+        print(f"{args.cdk_json} has no staging_distribution, already updated")
+    else:
+        print(
+            f"Updated {', '.join(changed) or 'no settings'} in {args.cdk_json}, "
+            "deploy the distribution stack to remove the staging distributions"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,238 @@
+#!/usr/bin/env python3
+"""Summarize exported WAF logs: top blocked IPs, URIs, rules and countries.
+
+Log files hold one JSON record per line, optionally gzip compressed and
+optionally prefixed by a timestamp as in CloudWatch Logs exports. Records are
+streamed, and heavy hitters are tracked with count-min sketches and bounded
+top-K tables, so memory does not grow with the size of the logs. Files are
+spread across worker processes whose summaries are merged.
+
+    python3 tools/waf_log_analyzer.py exported-logs/ --top 20 --workers 4
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import os
+import sys
+from array import array
+from collections import Counter
+from multiprocessing import Pool
+
+# Blocked request attributes reported by the analyzer
+DIMENSIONS = {
+    "ip": lambda record: record["httpRequest"].get("clientIp"),
+    "uri": lambda record: record["httpRequest"].get("uri"),
+    "rule": lambda record: record.get("terminatingRuleId"),
+    "country": lambda record: record["httpRequest"].get("country"),
+}
+BLOCKING_ACTIONS = {"BLOCK", "CAPTCHA", "CHALLENGE"}
+
+
+class CountMinSketch:
+    """Approximate counts of keys in a fixed width x depth table.
+
+    Estimates never undercount, and overcount by at most total / width * e with
+    probability 1 - exp(-depth). Keys are hashed with a keyed digest rather than
+    hash(), which is salted per process and would break merging.
+    """
+
+    def __init__(self, width=2**16, depth=4):
+        if depth > 8:
+            raise ValueError("depth is limited to 8 hashes of 32 bits")
+        self.width = width
+        self.depth = depth
+        self.table = array("Q", bytes(8 * width * depth))
+
+    def _cells(self, key):
+        digest = hashlib.blake2b(
+            key.encode("utf-8"), digest_size=4 * self.depth
+        ).digest()
+        return [
+            row * self.width
+            + int.from_bytes(digest[4 * row : 4 * row + 4], "little") % self.width
+            for row in range(self.depth)
+        ]
+
+    def add(self, key, count=1):
+        """Add count to key and return its new estimate."""
+        estimate = None
+        for cell in self._cells(key):
+            self.table[cell] += count
+            if estimate is None or self.table[cell] < estimate:
+                estimate = self.table[cell]
+        return estimate
+
+    def estimate(self, key):
+        return min(self.table[cell] for cell in self._cells(key))
+
+    def merge(self, other):
+        if (self.width, self.depth) != (other.width, other.depth):
+            raise ValueError("Only sketches of the same shape can be merged")
+        for index, value in enumerate(other.table):
+            if value:
+                self.table[index] += value
+
+
+class TopK:
+    """The k most frequent keys of a stream, estimated by a count-min sketch."""
+
+    def __init__(self, k, width=2**16, depth=4):
+        self.k = k
+        self.sketch = CountMinSketch(width, depth)
+        self.counts = {}
+        self._min_count = 0
+
+    def add(self, key, count=1):
+        estimate = self.sketch.add(key, count)
+        if key in self.counts:
+            self.counts[key] = estimate
+        elif len(self.counts) < self.k:
+            self.counts[key] = estimate
+            self._min_count = min(self.counts.values())
+        elif estimate > self._min_count:
+            # Evictions get rarer as the retained counts grow
+            del self.counts[min(self.counts, key=self.counts.get)]
+            self.counts[key] = estimate
+            self._min_count = min(self.counts.values())
+
+    def merge(self, other):
+        self.sketch.merge(other.sketch)
+        candidates = set(self.counts) | set(other.counts)
+        estimates = {key: self.sketch.estimate(key) for key in candidates}
+        self.counts = dict(
+            sorted(estimates.items(), key=lambda item: item[1], reverse=True)[: self.k]
+        )
+        self._min_count = min(self.counts.values(), default=0)
+
+    def most_common(self, n=None):
+        return sorted(self.counts.items(), key=lambda item: item[1], reverse=True)[:n]
+
+
+class WafLogSummary:
+    """Request totals per action and top blocked values of each dimension."""
+
+    def __init__(self, k=100, width=2**16, depth=4):
+        self.records = 0
+        self.invalid_records = 0
+        self.actions = Counter()
+        self.blocked = {name: TopK(k, width, depth) for name in DIMENSIONS}
+
+    def add(self, record):
+        self.records += 1
+        action = record.get("action")
+        self.actions[action] += 1
+        if action in BLOCKING_ACTIONS:
+            for name, extract in DIMENSIONS.items():
+                value = extract(record)
+                if value is not None:
+                    self.blocked[name].add(str(value))
+
+    def merge(self, other):
+        self.records += other.records
+        self.invalid_records += other.invalid_records
+        self.actions.update(other.actions)
+        for name, top_k in self.blocked.items():
+            top_k.merge(other.blocked[name])
+
+    def report(self, n):
+        return {
+            "records": self.records,
+            "invalid_records": self.invalid_records,
+            "actions": dict(self.actions.most_common()),
+            "blocked": {
+                name: top_k.most_common(n) for name, top_k in self.blocked.items()
+            },
+        }
+
+
+def iter_lines(path):
+    opener = gzip.open if path.endswith(".gz") else open
+    with opener(path, "rt", encoding="utf-8", errors="replace") as f:
+        yield from f
+
+
+def iter_records(lines, summary=None):
+    """Yield WAF log records, skipping lines that are not valid records."""
+    for line in lines:
+        # CloudWatch Logs exports prefix each record with its timestamp
+        start = line.find("{")
+        if start < 0:
+            continue
+        try:
+            record = json.loads(line[start:])
+        except ValueError:
+            if summary:
+                summary.invalid_records += 1
+            continue
+        if isinstance(record, dict) and "httpRequest" in record:
+            yield record
+
+
+def summarize_file(path, k=100, width=2**16, depth=4):
+    summary = WafLogSummary(k, width, depth)
+    for record in iter_records(iter_lines(path), summary):
+        summary.add(record)
+    return summary
+
+
+def _summarize_file(arguments):
+    return summarize_file(*arguments)
+
+
+def summarize(paths, workers=None, k=100, width=2**16, depth=4):
+    """Summarize log files, in parallel across worker processes."""
+    summary = WafLogSummary(k, width, depth)
+    tasks = [(path, k, width, depth) for path in paths]
+    if workers == 1 or len(tasks) < 2:
+        for task in tasks:
+            summary.merge(_summarize_file(task))
+        return summary
+
+    with Pool(workers) as pool:
+        for file_summary in pool.imap_unordered(_summarize_file, tasks):
+            summary.merge(file_summary)
+    return summary
+
+
+def log_files(paths):
+    for path in paths:
+        if os.path.isdir(path):
+            for directory, _, names in os.walk(path):
+                for name in sorted(names):
+                    yield os.path.join(directory, name)
+        else:
+            yield path
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Log files or directories")
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    # Top-K tables keep more candidates than reported, which improves recall
+    summary = summarize(
+        list(log_files(args.paths)), workers=args.workers, k=max(100, 10 * args.top)
+    )
+    report = summary.report(args.top)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"{report['records']} requests ({report['invalid_records']} invalid lines)")
+    for action, count in report["actions"].items():
+        print(f"  {action:<12} {count:>12}")
+    for name, top in report["blocked"].items():
+        print(f"\nTop blocked by {name} (approximate counts)")
+        for value, count in top:
+            print(f"  {count:>12}  {value}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,659 @@
+#!/usr/bin/env python3
+"""Replay recorded requests through the web ACL of a synthesized template.
+
+The rules of the web ACL are read from the CustomWebAclStack template written
+by cdk synth, so a change of the WAF context values can be tried on recorded
+traffic before it is deployed. Records are WAF logs (as read by the WAF log
+analyzer) or CloudFront standard access logs. The report gives the projected
+action of the requests against the recorded one and the hits of each rule.
+
+IP set, byte match, regex match, geo match, label match, logical and
+rate-based statements are evaluated on the request. Managed rule groups cannot
+be run locally: a request matches a group when the recorded request was
+terminated by it, or carries the labels of its blocking rules. Requests the
+recording holds no verdict of the group for are reported as unknown and do
+not match. Access logs carry no verdicts, so only custom rules apply to them.
+
+IP sets keep the addresses of the template, the block list IP sets are empty
+until the list is loaded, pass it with --block-list (or --ip-set NAME=FILE):
+
+    cdk synth CustomWebAclStack
+    python3 tools/waf_replay.py exported-logs/ --block-list block-list.txt --workers 4
+"""
+
+import argparse
+import bisect
+import calendar
+import json
+import os
+import re
+import socket
+import sys
+from collections import Counter, defaultdict, deque
+from itertools import islice
+from multiprocessing import Pool
+from urllib.parse import unquote
+
+from waf_log_analyzer import BLOCKING_ACTIONS, iter_lines, log_files
+
+sys.path.insert(
+    0,
+    os.path.join(
+        os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+        "src",
+        "functions",
+        "ip_set_loader",
+    ),
+)
+from block_list import merge_ranges, parse_ranges  # noqa: E402
+
+DEFAULT_TEMPLATE = os.path.join("cdk.out", "CustomWebAclStack.template.json")
+DEFAULT_RATE_WINDOW = 300
+
+# Lines handed to a worker at once
+CHUNK_LINES = 20000
+# Distinct values remembered by each statement, cleared beyond
+MEMO_SIZE = 200000
+# Records between two removals of the idle rate-based counters
+RATE_PRUNE_INTERVAL = 100000
+
+# Label namespaces of the managed rule groups whose every labelled rule blocks,
+# Bot Control labels verified bots and signals it does not block
+MANAGED_RULE_GROUP_LABELS = {
+    "AWSManagedRulesAmazonIpReputationList": "awswaf:managed:aws:amazon-ip-list:",
+    "AWSManagedRulesAnonymousIpList": "awswaf:managed:aws:anonymous-ip-list:",
+    "AWSManagedRulesKnownBadInputsRuleSet": "awswaf:managed:aws:known-bad-inputs:",
+    "AWSManagedRulesAdminProtectionRuleSet": "awswaf:managed:aws:admin-protection:",
+    "AWSManagedRulesCommonRuleSet": "awswaf:managed:aws:core-rule-set:",
+}
+
+TRANSFORMATIONS = {
+    "NONE": lambda value: value,
+    "LOWERCASE": str.lower,
+    "URL_DECODE": unquote,
+    "COMPRESS_WHITE_SPACE": lambda value: re.sub(r"\s+", " ", value),
+}
+
+POSITIONAL_CONSTRAINTS = {
+    "EXACTLY": lambda value, search: value == search,
+    "STARTS_WITH": lambda value, search: value.startswith(search),
+    "ENDS_WITH": lambda value, search: value.endswith(search),
+    "CONTAINS": lambda value, search: search in value,
+    "CONTAINS_WORD": lambda value, search: re.search(
+        rf"(?<![A-Za-z0-9_]){re.escape(search)}(?![A-Za-z0-9_])", value
+    )
+    is not None,
+}
+
+# Values of a statement on a request, in the verdicts computed by the workers
+NO_MATCH, MATCH, UNKNOWN = 0, 1, 2
+
+
+class Request:
+    """Fields of a recorded request the statements are evaluated on."""
+
+    __slots__ = (
+        "timestamp",
+        "ip",
+        "country",
+        "method",
+        "uri",
+        "args",
+        "headers",
+        "labels",
+        "action",
+        "rule",
+        "rule_groups",
+    )
+
+    def __init__(self, timestamp, ip, method, uri, args="", headers=None, **fields):
+        self.timestamp = timestamp
+        self.ip = ip
+        self.method = method
+        self.uri = uri
+        self.args = args
+        self.headers = headers or {}
+        self.country = fields.get("country")
+        self.labels = fields.get("labels", ())
+        # Recorded action and managed rule group verdicts, None in access logs
+        self.action = fields.get("action")
+        self.rule = fields.get("rule")
+        self.rule_groups = fields.get("rule_groups", {})
+
+
+def waf_log_request(record):
+    """Request of a WAF log record, with the verdicts of its managed rule groups."""
+    http_request = record["httpRequest"]
+    rule_groups = {}
+    for rule_group in record.get("ruleGroupList") or []:
+        # Ids are AWS#<name> optionally followed by #<version>
+        parts = rule_group.get("ruleGroupId", "").split("#")
+        if len(parts) > 1:
+            terminating = rule_group.get("terminatingRule") or {}
+            rule_groups[parts[1]] = terminating.get("action") in BLOCKING_ACTIONS
+    return Request(
+        record.get("timestamp", 0) / 1000,
+        http_request.get("clientIp", ""),
+        http_request.get("httpMethod", ""),
+        http_request.get("uri", ""),
+        http_request.get("args", ""),
+        {
+            header["name"].lower(): header["value"]
+            for header in http_request.get("headers", [])
+        },
+        country=http_request.get("country"),
+        labels=tuple(label["name"] for label in record.get("labels") or []),
+        action=record.get("action"),
+        rule=(
+            record.get("terminatingRuleId")
+            if record.get("terminatingRuleType") == "MANAGED_RULE_GROUP"
+            else None
+        ),
+        rule_groups=rule_groups,
+    )
+
+
+def access_log_request(fields, line):
+    """Request of a CloudFront standard access log line."""
+    values = dict(zip(fields, line.rstrip("\n").split("\t")))
+    year, month, day = values["date"].split("-")
+    hour, minute, second = values["time"].split(":")
+    return Request(
+        calendar.timegm(
+            (int(year), int(month), int(day), int(hour), int(minute), int(second))
+        ),
+        values["c-ip"],
+        values["cs-method"],
+        values["cs-uri-stem"],
+        "" if values.get("cs-uri-query", "-") == "-" else values["cs-uri-query"],
+        {
+            # Header values are URL encoded in access logs
+            "host": values.get("cs(Host)", ""),
+            "user-agent": unquote(values.get("cs(User-Agent)", "")),
+            "referer": unquote(values.get("cs(Referer)", "")),
+        },
+    )
+
+
+def iter_requests(lines, fields=None):
+    """Yield the requests of WAF log or access log lines, skipping other lines.
+
+    fields are the access log fields declared before the lines, if any.
+    """
+    for line in lines:
+        if line.startswith("#"):
+            if line.startswith("#Fields:"):
+                fields = line.split()[1:]
+            continue
+        try:
+            if fields:
+                yield access_log_request(fields, line)
+                continue
+            # CloudWatch Logs exports prefix each record with its timestamp
+            start = line.find("{")
+            if start >= 0:
+                record = json.loads(line[start:])
+                if isinstance(record, dict) and "httpRequest" in record:
+                    yield waf_log_request(record)
+        except (KeyError, ValueError):
+            continue
+
+
+class IpIndex:
+    """Sorted address ranges of each IP version, searched by bisection."""
+
+    def __init__(self, ranges):
+        self.ranges = {}
+        for version, version_ranges in merge_ranges(ranges).items():
+            self.ranges[version] = (
+                [first for first, _ in version_ranges],
+                [last for _, last in version_ranges],
+            )
+
+    def __contains__(self, ip):
+        family, version = (socket.AF_INET6, 6) if ":" in ip else (socket.AF_INET, 4)
+        try:
+            value = int.from_bytes(socket.inet_pton(family, ip), "big")
+        except OSError:
+            return False
+        firsts, lasts = self.ranges[version]
+        index = bisect.bisect_right(firsts, value) - 1
+        return index >= 0 and value <= lasts[index]
+
+    def __len__(self):
+        return sum(len(firsts) for firsts, _ in self.ranges.values())
+
+
+def memoized(function, key):
+    """Remember the result of function for each key of a request."""
+    memo = {}
+
+    def evaluate(request):
+        value = key(request)
+        try:
+            return memo[value]
+        except KeyError:
+            if len(memo) >= MEMO_SIZE:
+                memo.clear()
+            result = memo[value] = function(value)
+            return result
+
+    return evaluate
+
+
+def _field(field_to_match):
+    ((kind, options),) = field_to_match.items()
+    if kind == "UriPath":
+        return lambda request: request.uri
+    if kind == "QueryString":
+        return lambda request: request.args
+    if kind == "Method":
+        return lambda request: request.method
+    if kind == "SingleHeader":
+        name = options["Name"].lower()
+        return lambda request: request.headers.get(name, "")
+    raise ValueError(f"Field {kind} is not supported by the replay")
+
+
+def _transformation(text_transformations):
+    steps = []
+    for transformation in sorted(text_transformations, key=lambda t: t["Priority"]):
+        if transformation["Type"] not in TRANSFORMATIONS:
+            raise ValueError(
+                f"Text transformation {transformation['Type']} is not supported by the replay"
+            )
+        steps.append(TRANSFORMATIONS[transformation["Type"]])
+    return lambda value: _apply(steps, value)
+
+
+def _apply(steps, value):
+    for step in steps:
+        value = step(value)
+    return value
+
+
+def compile_statement(statement, ip_sets):
+    """Return a function telling whether a request matches a statement."""
+    ((kind, options),) = statement.items()
+    if kind in ("AndStatement", "OrStatement"):
+        statements = [compile_statement(s, ip_sets) for s in options["Statements"]]
+        combine = all if kind == "AndStatement" else any
+        return lambda request: combine(s(request) for s in statements)
+    if kind == "NotStatement":
+        inner = compile_statement(options["Statement"], ip_sets)
+        return lambda request: not inner(request)
+    if kind == "IPSetReferenceStatement":
+        index = ip_sets[_ip_set_id(options["Arn"])]
+        return memoized(lambda ip: ip in index, lambda request: request.ip)
+    if kind == "GeoMatchStatement":
+        countries = set(options["CountryCodes"])
+        return lambda request: request.country in countries
+    if kind == "LabelMatchStatement":
+        key = options["Key"]
+        if options["Scope"] == "NAMESPACE":
+            return lambda request: any(
+                label.startswith(key) for label in request.labels
+            )
+        return lambda request: any(
+            label == key or label.endswith(f":{key}") for label in request.labels
+        )
+    if kind == "ByteMatchStatement":
+        constraint = POSITIONAL_CONSTRAINTS[options["PositionalConstraint"]]
+        search = options["SearchString"]
+        transform = _transformation(options["TextTransformations"])
+        return memoized(
+            lambda value: constraint(transform(value), search),
+            _field(options["FieldToMatch"]),
+        )
+    if kind == "RegexMatchStatement":
+        pattern = re.compile(options["RegexString"])
+        transform = _transformation(options["TextTransformations"])
+        return memoized(
+            lambda value: pattern.search(transform(value)) is not None,
+            _field(options["FieldToMatch"]),
+        )
+    raise ValueError(f"{kind} is not supported by the replay")
+
+
+def _ip_set_id(arn):
+    # IP sets of the stack are referenced by their logical id
+    if isinstance(arn, dict):
+        return arn["Fn::GetAtt"][0]
+    return arn
+
+
+class Rule:
+    """A web ACL rule compiled for the replay.
+
+    kind is match, rate or managed. action is the action taken when the rule
+    matches, COUNT lets the request through to the next rules.
+    """
+
+    def __init__(self, rule, ip_sets):
+        self.name = rule["Name"]
+        self.priority = rule["Priority"]
+        if "OverrideAction" in rule:
+            # Rule groups apply their own action unless counted
+            self.action = "COUNT" if "Count" in rule["OverrideAction"] else "BLOCK"
+        else:
+            self.action = next(iter(rule["Action"])).upper()
+
+        ((kind, options),) = rule["Statement"].items()
+        scope_down = options.get("ScopeDownStatement")
+        self.scope = compile_statement(scope_down, ip_sets) if scope_down else None
+        if kind == "RateBasedStatement":
+            if options.get("AggregateKeyType", "IP") != "IP":
+                raise ValueError(
+                    f"Rate-based rule {self.name} aggregates by {options['AggregateKeyType']}, "
+                    "the replay only counts requests per source address"
+                )
+            self.kind = "rate"
+            self.limit = options["Limit"]
+            self.window = options.get("EvaluationWindowSec", DEFAULT_RATE_WINDOW)
+        elif kind == "ManagedRuleGroupStatement":
+            self.kind = "managed"
+            self.group = options["Name"]
+            self.labels = MANAGED_RULE_GROUP_LABELS.get(self.group)
+        else:
+            self.kind = "match"
+            self.match = compile_statement(rule["Statement"], ip_sets)
+
+    def evaluate(self, request):
+        """Verdict of the stateless part of the rule, rate-based rules return whether they count the request."""
+        if self.kind == "match":
+            return MATCH if self.match(request) else NO_MATCH
+        if self.scope is not None and not self.scope(request):
+            return NO_MATCH
+        if self.kind == "rate":
+            return MATCH
+        if self.group in request.rule_groups:
+            return MATCH if request.rule_groups[self.group] else NO_MATCH
+        if request.rule == self.name and request.action in BLOCKING_ACTIONS:
+            return MATCH
+        if self.labels and any(
+            label.startswith(self.labels) for label in request.labels
+        ):
+            return MATCH
+        return UNKNOWN
+
+
+def load_ip_sets(template, addresses):
+    """Return the address index of each IP set of the template by logical id.
+
+    addresses maps IP set logical ids or names to the lines of an address list,
+    which replace the addresses of the template.
+    """
+    ip_sets = {}
+    for logical_id, resource in template["Resources"].items():
+        if resource["Type"] != "AWS::WAFv2::IPSet":
+            continue
+        properties = resource["Properties"]
+        lines = addresses.get(logical_id, addresses.get(properties.get("Name")))
+        if lines is None:
+            lines = properties.get("Addresses", [])
+        ip_sets[logical_id] = IpIndex(parse_ranges(lines))
+        if not len(ip_sets[logical_id]):
+            print(
+                f"IP set {logical_id} has no addresses, pass them with --ip-set or --block-list",
+                file=sys.stderr,
+            )
+    return ip_sets
+
+
+def load_rules(template, ip_sets):
+    """Return the compiled rules of the web ACL, in evaluation order, and its default action."""
+    web_acl = next(
+        resource["Properties"]
+        for resource in template["Resources"].values()
+        if resource["Type"] == "AWS::WAFv2::WebACL"
+    )
+    rules = [
+        Rule(rule, ip_sets)
+        for rule in sorted(web_acl.get("Rules", []), key=lambda rule: rule["Priority"])
+    ]
+    return rules, next(iter(web_acl["DefaultAction"])).upper()
+
+
+# Rules of the worker processes, compiled once per process
+_rules = None
+
+
+def _init_worker(template, addresses):
+    global _rules
+    _rules, _ = load_rules(template, load_ip_sets(template, addresses))
+
+
+def evaluate_lines(task):
+    """Compact verdicts of the requests of a chunk of lines.
+
+    Statements are evaluated here, in any order and process, the rate-based
+    counts depend on the order of the requests and are left to the replay.
+    """
+    fields, lines = task
+    return [
+        (
+            request.timestamp,
+            request.ip,
+            request.uri,
+            request.action,
+            bytes(rule.evaluate(request) for rule in _rules),
+        )
+        for request in iter_requests(lines, fields)
+    ]
+
+
+def chunks(paths, size=CHUNK_LINES):
+    """Yield (access log fields, lines) chunks of the log files, in order."""
+    for path in paths:
+        fields = None
+        lines = iter_lines(path)
+        while True:
+            chunk = list(islice(lines, size))
+            if not chunk:
+                break
+            yield fields, chunk
+            for line in chunk:
+                if line.startswith("#Fields:"):
+                    fields = line.split()[1:]
+
+
+class ReplaySummary:
+    """Projected actions of the replayed requests and the hits of each rule."""
+
+    def __init__(self, rules, default_action):
+        self.rules = rules
+        self.default_action = default_action
+        self.records = 0
+        self.recorded = Counter()
+        self.projected = Counter()
+        self.changes = Counter()
+        self.hits = Counter()
+        self.terminating = Counter()
+        self.unknown = Counter()
+        self.changed = {
+            name: defaultdict(Counter) for name in ("newly_blocked", "newly_allowed")
+        }
+        self.rate_counters = {rule.name: {} for rule in rules if rule.kind == "rate"}
+
+    def add(self, timestamp, ip, uri, recorded, verdicts):
+        self.records += 1
+        action, terminating = self.default_action, None
+        for rule, verdict in zip(self.rules, verdicts):
+            if rule.kind == "rate":
+                matched = verdict == MATCH and self._over_limit(rule, ip, timestamp)
+            else:
+                matched = verdict == MATCH
+                if verdict == UNKNOWN:
+                    self.unknown[rule.name] += 1
+            if matched:
+                self.hits[rule.name] += 1
+                if rule.action != "COUNT":
+                    action, terminating = rule.action, rule.name
+                    break
+
+        self.projected[action] += 1
+        if terminating:
+            self.terminating[terminating] += 1
+        if recorded is not None:
+            self.recorded[recorded] += 1
+            if recorded != action:
+                self.changes[f"{recorded} -> {action}"] += 1
+                blocked = action in BLOCKING_ACTIONS
+                if blocked != (recorded in BLOCKING_ACTIONS):
+                    changed = self.changed[
+                        "newly_blocked" if blocked else "newly_allowed"
+                    ]
+                    changed["ip"][ip] += 1
+                    changed["uri"][uri] += 1
+                    changed["rule"][terminating or "Default_Action"] += 1
+
+        if self.records % RATE_PRUNE_INTERVAL == 0:
+            self._prune(timestamp)
+
+    def _over_limit(self, rule, ip, timestamp):
+        # Requests counted within the trailing window of the source address
+        window = self.rate_counters[rule.name].get(ip)
+        if window is None:
+            window = self.rate_counters[rule.name][ip] = deque()
+        window.append(timestamp)
+        while window[0] <= timestamp - rule.window:
+            window.popleft()
+        return len(window) > rule.limit
+
+    def _prune(self, timestamp):
+        for rule in self.rules:
+            if rule.kind == "rate":
+                counters = self.rate_counters[rule.name]
+                for ip in [
+                    ip
+                    for ip, window in counters.items()
+                    if window[-1] <= timestamp - rule.window
+                ]:
+                    del counters[ip]
+
+    def report(self, n):
+        return {
+            "records": self.records,
+            "recorded": dict(self.recorded.most_common()),
+            "projected": dict(self.projected.most_common()),
+            "changes": dict(self.changes.most_common()),
+            "rules": [
+                {
+                    "name": rule.name,
+                    "action": rule.action,
+                    "hits": self.hits[rule.name],
+                    "terminating": self.terminating[rule.name],
+                    "unknown": self.unknown[rule.name],
+                }
+                for rule in self.rules
+            ],
+            **{
+                name: {
+                    dimension: counts.most_common(n)
+                    for dimension, counts in dimensions.items()
+                }
+                for name, dimensions in self.changed.items()
+            },
+        }
+
+
+def replay(paths, template, addresses=None, workers=None):
+    """Replay the requests of log files through the web ACL of a template."""
+    addresses = addresses or {}
+    rules, default_action = load_rules(template, load_ip_sets(template, addresses))
+    summary = ReplaySummary(rules, default_action)
+
+    if workers == 1:
+        _init_worker(template, addresses)
+        results = map(evaluate_lines, chunks(paths))
+        for verdicts in results:
+            for verdict in verdicts:
+                summary.add(*verdict)
+        return summary
+
+    # Chunks come back in order, so that rate-based rules see the requests
+    # in the order of the logs
+    with Pool(
+        workers, initializer=_init_worker, initargs=(template, addresses)
+    ) as pool:
+        for verdicts in pool.imap(evaluate_lines, chunks(paths)):
+            for verdict in verdicts:
+                summary.add(*verdict)
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("paths", nargs="+", help="Log files or directories")
+    parser.add_argument("--template", default=DEFAULT_TEMPLATE)
+    parser.add_argument(
+        "--ip-set",
+        action="append",
+        default=[],
+        metavar="NAME=FILE",
+        help="Addresses of an IP set, by logical id or name",
+    )
+    parser.add_argument(
+        "--block-list", help="Addresses of every block list IP set of the stack"
+    )
+    parser.add_argument("--top", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    args = parser.parse_args()
+
+    with open(args.template) as f:
+        template = json.load(f)
+
+    addresses = {}
+    for ip_set in args.ip_set:
+        name, _, path = ip_set.partition("=")
+        with open(path) as f:
+            addresses[name] = f.readlines()
+    if args.block_list:
+        with open(args.block_list) as f:
+            lines = f.readlines()
+        for logical_id, resource in template["Resources"].items():
+            if resource["Type"] == "AWS::WAFv2::IPSet" and "-block-list-" in str(
+                resource["Properties"].get("Name")
+            ):
+                addresses.setdefault(logical_id, lines)
+
+    summary = replay(
+        list(log_files(args.paths)), template, addresses, workers=args.workers
+    )
+    report = summary.report(args.top)
+
+    if args.json:
+        json.dump(report, sys.stdout, indent=2)
+        print()
+        return
+
+    print(f"{report['records']} requests replayed")
+    print(f"\n{'action':<12} {'recorded':>12} {'projected':>12}")
+    for action in sorted(set(report["recorded"]) | set(report["projected"])):
+        print(
+            f"{action:<12} {report['recorded'].get(action, 0):>12} "
+            f"{report['projected'].get(action, 0):>12}"
+        )
+    if report["changes"]:
+        print("\nChanged actions")
+        for change, count in report["changes"].items():
+            print(f"  {count:>12}  {change}")
+
+    print(f"\n{'hits':>12} {'terminating':>12} {'unknown':>12}  rule")
+    for rule in report["rules"]:
+        print(
+            f"{rule['hits']:>12} {rule['terminating']:>12} {rule['unknown']:>12}  "
+            f"{rule['name']} ({rule['action']})"
+        )
+
+    for name in ("newly_blocked", "newly_allowed"):
+        for dimension, top in report[name].items():
+            if top:
+                print(f"\nTop {name.replace('_', ' ')} by {dimension}")
+                for value, count in top:
+                    print(f"  {count:>12}  {value}")
+
+
+if __name__ == "__main__":
+    main()